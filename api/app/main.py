@@ -1,15 +1,35 @@
 from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
 import os
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Annotated
 from pydantic import BaseModel
 import json
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.encoders import jsonable_encoder
+from starlette.routing import Match
 import datetime # Add this import
+import time
+import threading
+import asyncio
+import functools
+import contextvars
+import hashlib
+import base64
+import inspect
+import copy
+import re
+import io
+import fcntl
+import shutil
+import tempfile
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs, parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
 
 print("<<<<<< HELLO FROM THE VERY TOP OF MAIN.PY - NEW VERSION RUNNING IF YOU SEE THIS - VERSION XYZ >>>>>>") # DIAGNOSTIC PRINT
 
@@ -26,20 +46,89 @@ db_params = {
     'database': os.getenv('DB_NAME'),
     'user': os.getenv('DB_USER'),
     'password': os.getenv('DB_PASSWORD'),
-    'sslmode': 'require'  # Required for Azure PostgreSQL
+    'sslmode': os.getenv('DB_SSLMODE', 'require'),  # Required for Azure PostgreSQL
+    'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '10'))
 }
 
-app = FastAPI(title="ZentroQ Inventory API")
+# Optional read replica for the read-only analytics endpoints. Unset DB_REPLICA_HOST keeps everything on the primary;
+# the other DB_REPLICA_* values default to the primary's.
+replica_db_params = None
+if os.getenv('DB_REPLICA_HOST'):
+    replica_db_params = {
+        **db_params,
+        'host': os.getenv('DB_REPLICA_HOST'),
+        'port': os.getenv('DB_REPLICA_PORT', db_params['port']),
+        'database': os.getenv('DB_REPLICA_NAME', db_params['database']),
+        'user': os.getenv('DB_REPLICA_USER', db_params['user']),
+        'password': os.getenv('DB_REPLICA_PASSWORD', db_params['password']),
+    }
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', '30'))  # fall back to primary beyond this
+DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', '10'))  # seconds between lag checks
 
-# Enable CORS for all origins
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins for debugging
-    allow_credentials=False,  # Must be False when using wildcard origins
-    allow_methods=["*"],
-    allow_headers=["*"],
-    max_age=600,  # Cache preflight requests for 10 minutes
-)
+# Connection pool settings (one pool per process, shared by every endpoint)
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT', '10'))  # seconds to wait for a free connection
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', '1800'))  # recycle connections older than this
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv('DB_POOL_HEALTHCHECK_IDLE', '30'))  # ping connections idle longer than this
+# Worker threads that run blocking psycopg2 calls for the async endpoints (defaults to the pool size)
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', str(DB_POOL_MAX_SIZE)))
+# Prepared statements kept per pooled connection (least recently used ones are deallocated)
+PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv('PREPARED_STATEMENT_CACHE_SIZE', '64'))
+
+# Startup warm-up and health probes
+STARTUP_WARMUP = os.getenv('STARTUP_WARMUP', 'true').lower() in ('1', 'true', 'yes')
+HEALTH_PING_INTERVAL = float(os.getenv('HEALTH_PING_INTERVAL', '30'))  # re-verify the database if idle this long
+
+# statement_timeout (milliseconds) for the queries of each read route group; 0 disables the limit
+STATEMENT_TIMEOUTS_MS = {
+    "inventory": int(os.getenv('STATEMENT_TIMEOUT_INVENTORY_MS', '30000')),
+    "metrics": int(os.getenv('STATEMENT_TIMEOUT_METRICS_MS', '15000')),
+    "filtercounts": int(os.getenv('STATEMENT_TIMEOUT_FILTERCOUNTS_MS', '15000')),
+}
+
+# Shared inventory snapshot: a read-only columnar copy of demo_inventory written once to INVENTORY_SNAPSHOT_DIR
+# and memory-mapped by every worker process, so running several workers does not multiply memory
+INVENTORY_SNAPSHOT = os.getenv('INVENTORY_SNAPSHOT', 'false').lower() in ('1', 'true', 'yes')
+INVENTORY_SNAPSHOT_DIR = os.getenv('INVENTORY_SNAPSHOT_DIR', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'zentroq-inventory'))
+INVENTORY_SNAPSHOT_SOURCE = os.getenv('INVENTORY_SNAPSHOT_SOURCE', 'database')  # 'database' or 'csv'
+INVENTORY_CSV_PATH = os.getenv('INVENTORY_CSV_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data.csv'))
+INVENTORY_SNAPSHOT_MAX_AGE = float(os.getenv('INVENTORY_SNAPSHOT_MAX_AGE', '300'))  # rebuild snapshots older than this
+# With the data version (migration 0007) a database snapshot is rebuilt when the version moves instead of by age,
+# and with the change log (0008) from the rows changed since; more changed keys than this reload the whole table
+INVENTORY_SNAPSHOT_MAX_DELTA_KEYS = int(os.getenv('INVENTORY_SNAPSHOT_MAX_DELTA_KEYS', '100000'))
+INVENTORY_SNAPSHOT_CHECK_INTERVAL = float(os.getenv('INVENTORY_SNAPSHOT_CHECK_INTERVAL', '5'))  # seconds between checks
+# Answer the inventory listings (filters, sorts, pages and their totals) from the snapshot instead of the database
+INVENTORY_SNAPSHOT_LISTINGS = os.getenv('INVENTORY_SNAPSHOT_LISTINGS', 'false').lower() in ('1', 'true', 'yes')
+
+# Inventory listings fetch the page rows and the totals in one statement (false: totals, then page)
+INVENTORY_COMBINED_PAGE_QUERY = os.getenv('INVENTORY_COMBINED_PAGE_QUERY', 'true').lower() in ('1', 'true', 'yes')
+
+# Search: 'auto' matches the trigram-indexed search_document column (api/migrations) when the database has it,
+# 'columns' always matches each search column with ILIKE
+INVENTORY_SEARCH_MODE = os.getenv('INVENTORY_SEARCH_MODE', 'auto')
+SCHEMA_FEATURES_CHECK_INTERVAL = float(os.getenv('SCHEMA_FEATURES_CHECK_INTERVAL', '300'))  # seconds between re-checks
+# Metrics and filter counts: 'auto' sums the demo_inventory_rollup table (api/migrations) when the database has it and
+# there is no search text, 'table' always aggregates demo_inventory itself
+INVENTORY_METRICS_SOURCE = os.getenv('INVENTORY_METRICS_SOURCE', 'auto')
+# Seconds between reads of the demo_inventory data version (api/migrations); results cached under it can be this stale
+DATA_VERSION_CHECK_INTERVAL = float(os.getenv('DATA_VERSION_CHECK_INTERVAL', '5'))
+
+# Admission control (per worker): concurrent requests allowed and queued for heavy and light routes
+ADMISSION_HEAVY_LIMIT = int(os.getenv('ADMISSION_HEAVY_LIMIT', '2'))
+ADMISSION_HEAVY_QUEUE = int(os.getenv('ADMISSION_HEAVY_QUEUE', '8'))
+ADMISSION_LIGHT_LIMIT = int(os.getenv('ADMISSION_LIGHT_LIMIT', '32'))
+ADMISSION_LIGHT_QUEUE = int(os.getenv('ADMISSION_LIGHT_QUEUE', '64'))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '10'))  # seconds a request may wait for a slot
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', '5'))  # Retry-After sent with a 503
+
+# Circuit breaker and degraded mode
+DB_BREAKER_FAILURE_THRESHOLD = int(os.getenv('DB_BREAKER_FAILURE_THRESHOLD', '5'))  # consecutive failures that open it
+DB_BREAKER_RESET_TIMEOUT = float(os.getenv('DB_BREAKER_RESET_TIMEOUT', '15'))  # seconds before a probe is let through
+STALE_CACHE_SIZE = int(os.getenv('STALE_CACHE_SIZE', '128'))  # last good read results kept for degraded mode
+
+app = FastAPI(title="ZentroQ Inventory API")
 
 # Custom JSON response class to handle infinity values
 class CustomJSONResponse(JSONResponse):
@@ -162,15 +251,19 @@ def determine_inventory_status(row):
     - Low: Less than 1 month of supply and has usage
     - Optimal: All other cases
     """
-    months_of_cover = safe_convert(row.get("Sum of Months of Cover"), float, 999.0)
-    ttm_qty_used = safe_convert(row.get("Sum of TTM Qty Used"), int)
-    quantity_on_hand = safe_convert(row.get("Sum of Quantity On Hand"), int)
-    
     # Existing status from database (if present)
     existing_status = row.get("status")
     if existing_status:
         return existing_status
     
+    if "months_of_cover" in row:
+        # Numeric column from api/migrations; NULL stands for an unparseable source value
+        months_of_cover = row["months_of_cover"] if row["months_of_cover"] is not None else 999.0
+    else:
+        months_of_cover = safe_convert(row.get("Sum of Months of Cover"), float, 999.0)
+    ttm_qty_used = safe_convert(row.get("Sum of TTM Qty Used"), int)
+    quantity_on_hand = safe_convert(row.get("Sum of Quantity On Hand"), int)
+    
     # Apply business rules
     if months_of_cover > 6:
         return "excess"
@@ -215,7 +308,7 @@ def get_company_statuses(mfg_part_numbers):
     status_dict = {}
     
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(read_only=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
         # Build a query that returns data for all manufacturer part numbers in one go
@@ -272,7 +365,7 @@ def get_company_statuses(mfg_part_numbers):
         return {pn: "unknown" for pn in unique_mfg_part_numbers}
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 # Helper function to convert a single DB row to API format
 def convert_db_row_to_api_format(row, index=0):
@@ -283,9 +376,6 @@ def convert_db_row_to_api_format(row, index=0):
         row: The database row data
         index: The index for the ID field (default 0)
     """
-    months_of_cover = safe_convert(row.get("Sum of Months of Cover"), float, 
-                                  999.0 if row.get("Sum of Months of Cover") in ["Infinity", "inf"] else 0)
-    
     # Get manufacturer part number (primary) and internal part number (secondary)
     mfg_part_number = row.get("mfgpartnbr", "")
     part_number = row.get("partnbr", "")
@@ -310,7 +400,10 @@ def convert_db_row_to_api_format(row, index=0):
 
     months_of_coverage = row.get("Months of Coverage")
     # Handle the months of coverage value
-    if months_of_coverage == "Infinity":
+    if "months_of_coverage" in row:
+        # Numeric column from api/migrations, Infinity included; nothing to parse
+        months_of_coverage = row["months_of_coverage"]
+    elif months_of_coverage == "Infinity":
         months_of_coverage = float('inf')
     elif months_of_coverage is not None:
         try:
@@ -359,404 +452,2793 @@ def convert_db_rows_to_api_format(rows, start_index=0):
     
     return result
 
-# Database connection helper
-def get_db_connection():
-    """Establishes a new database connection using environment variables."""
-    # Make sure environment variables are loaded (idempotent)
-    load_dotenv() 
-    if not os.path.exists('.env') and os.path.exists('../.env'):
-        load_dotenv('../.env')
-
-    current_db_params = {
-        'host': os.getenv('DB_HOST'),
-        'port': os.getenv('DB_PORT', '5432'),
-        'database': os.getenv('DB_NAME'),
-        'user': os.getenv('DB_USER'),
-        'password': os.getenv('DB_PASSWORD'),
-        'sslmode': 'require' 
-    }
-    # Diagnostic print to check connection parameters
-    # print(f"DB Connection Params in get_db_connection: {current_db_params}") 
-    
-    try:
-        conn = psycopg2.connect(**current_db_params)
-        return conn
-    except Exception as e:
-        print(f"Database connection error in get_db_connection: {e}")
-        raise HTTPException(status_code=503, detail=f"Database connection error: {str(e)}")
+# Shared filter/sort compiler for the inventory listing and filter count endpoints. The SQL text
+# depends only on the filter's shape, so it is compiled once per shape and the resulting statement
+# is reused (and prepared) across requests; the filter values travel as parameters.
+INVENTORY_TABLE = "inventory_management.demo_inventory"
 
-# Health check endpoint
-@app.get("/health")
-def health_check():
-    """Health check endpoint for Docker healthcheck"""
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        cursor.close()
-        conn.close()
-        return {"status": "healthy", "database": "connected"}
-    except Exception as e:
-        return {"status": "unhealthy", "error": str(e)}
-    finally:
-        if conn:
-            conn.close()
+# Columns matched by the search text (ILIKE '%text%'). With the search_document column (api/migrations)
+# the text is matched once against all of them, joined by newlines, through a trigram index.
+SEARCH_COLUMNS = ["mfgpartnbr", "description", "mfgname", "partnbr", "entity", "branch"]
+# sort_by value that ranks search results: exact part number hits first, then part number prefixes,
+# then by trigram similarity to the search document
+RELEVANCE_SORT_FIELD = "relevance"
 
-# Get all inventory items with pagination, sorting and filtering
-@app.get("/inventory", response_model=Dict[str, Any])
-def get_inventory(
-    limit: int = 20,
-    offset: int = 0,
-    search: str = None,
-    branch: str = None,
-    entity: str = None,
-    status: str = None,
-    network_status: str = None,
-    sort_by: str = "mfgPartNumber",
-    sort_dir: str = "asc"
-):
+# Map API sort fields to database fields
+SORT_FIELD_MAP = {
+    "inventoryBalance": "Inventory Balance",
+    "mfgPartNumber": "mfgpartnbr",
+    "partNumber": "partnbr",
+    "description": "description",
+    "quantityOnHand": "Sum of Quantity On Hand",
+    "monthsOfCoverage": "Months of Coverage",
+    "ttmQtyUsed": "Sum of TTM Qty Used",
+    "entity": "entity",
+    "branch": "branch",
+    "lastReceipt": "Last Receipt",
+    "companyStatus": "Network Status"
+}
+DEFAULT_SORT_FIELD = "mfgPartNumber"
+
+class InventoryFilter(BaseModel):
+    """Typed filter over demo_inventory; empty lists and None values do not filter"""
+    entities: List[str] = []
+    branches: List[str] = []
+    status: Optional[str] = None  # 'overview' means all statuses
+    network_status: Optional[str] = None
+    search: Optional[str] = None
+    exclude_corporate: bool = False  # leave out the 'Corporate' branch rows
+
+    def filters_status(self):
+        return bool(self.status) and self.status != "overview"
+
+    def shape(self, search_mode="columns"):
+        """Everything the compiled SQL depends on"""
+        return (len(self.entities), len(self.branches), self.filters_status(), bool(self.network_status),
+                search_mode if self.search else None, self.exclude_corporate)
+
+    def params(self, search_mode="columns"):
+        """Parameter values in the order of the compiled WHERE clause"""
+        params = list(self.entities) + list(self.branches)
+        if self.filters_status():
+            params.append(self.status)
+        if self.network_status:
+            params.append(self.network_status)
+        if self.search:
+            params.extend([f"%{self.search}%"] * (1 if search_mode == "document" else len(SEARCH_COLUMNS)))
+        return params
+
+@functools.lru_cache(maxsize=256)
+def _compile_where(shape):
+    entity_count, branch_count, has_status, has_network_status, search_mode, exclude_corporate = shape
+    conditions = []
+    if exclude_corporate:
+        conditions.append("branch != 'Corporate'")
+    if entity_count:
+        conditions.append(f"entity IN ({', '.join(['%s'] * entity_count)})")
+    if branch_count:
+        conditions.append(f"branch IN ({', '.join(['%s'] * branch_count)})")
+    if has_status:
+        conditions.append("status = %s")
+    if has_network_status:
+        conditions.append('"Network Status" = %s')
+    if search_mode == "document":
+        conditions.append("search_document ILIKE %s")
+    elif search_mode:
+        conditions.append(f"({' OR '.join(f'{column} ILIKE %s' for column in SEARCH_COLUMNS)})")
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+def compile_inventory_filter(inventory_filter):
+    """(WHERE clause or '', params) for an InventoryFilter"""
+    search_mode = inventory_search_mode() if inventory_filter.search else None
+    return _compile_where(inventory_filter.shape(search_mode)), inventory_filter.params(search_mode)
+
+# Keyset pagination orders by the sort column and then by this unique key, in the same direction
+KEYSET_TIEBREAKER = ["entity", "branch", "partnbr"]
+
+def _sort_field(sort_by):
+    """Normalized API sort field; unknown fields sort by mfgPartNumber"""
+    return sort_by if sort_by in SORT_FIELD_MAP else DEFAULT_SORT_FIELD
+
+def _sort_expression(sort_by, numeric_coverage=False):
+    db_sort_field = SORT_FIELD_MAP[_sort_field(sort_by)]
+    if db_sort_field == "Months of Coverage":
+        if numeric_coverage:
+            # DOUBLE PRECISION companion column from api/migrations, indexed for this sort
+            return "months_of_coverage"
+        # Stored as text; as FLOAT, 'Infinity'/'inf' sorts above every finite value
+        return 'CAST("Months of Coverage" AS FLOAT)'
+    return f'"{db_sort_field}"'
+
+def numeric_coverage_available():
+    return get_schema_features()["numericCoverage"]
+
+def _sort_direction(sort_dir):
+    return "DESC" if sort_dir.lower() == "desc" else "ASC"
+
+def _ranks_by_relevance(inventory_filter, sort_by):
+    """sort_by=relevance only ranks when there is search text; otherwise it sorts by mfgPartNumber"""
+    return sort_by == RELEVANCE_SORT_FIELD and bool(inventory_filter.search)
+
+# Most relevant first; equally relevant rows grouped by part, then in the unique key order
+RELEVANCE_ORDER = f"ORDER BY search_relevance DESC, mfgpartnbr, {', '.join(KEYSET_TIEBREAKER)}"
+
+def compile_search_relevance(search):
+    """(SQL, params) scoring how well a row matches the search text; higher is better"""
+    score = ("CASE WHEN lower(partnbr) = lower(%s) OR lower(mfgpartnbr) = lower(%s) THEN 2"
+             " WHEN partnbr ILIKE %s OR mfgpartnbr ILIKE %s THEN 1 ELSE 0 END")
+    params = [search, search, f"{search}%", f"{search}%"]
+    if inventory_search_mode() == "document":
+        score += " + word_similarity(%s, search_document)"
+        params.append(search)
+    return score, params
+
+def compile_inventory_order(sort_by, sort_dir, keyset=False):
+    """ORDER BY clause for an API sort field; keyset=True adds the unique tiebreaker"""
+    return _compile_order(sort_by, sort_dir, keyset, numeric_coverage_available())
+
+@functools.lru_cache(maxsize=64)
+def _compile_order(sort_by, sort_dir, keyset, numeric_coverage):
+    sort_direction = _sort_direction(sort_dir)
+    order = [f"{_sort_expression(sort_by, numeric_coverage)} {sort_direction}"]
+    if keyset:
+        order.extend(f"{column} {sort_direction}" for column in KEYSET_TIEBREAKER)
+    return f"ORDER BY {', '.join(order)}"
+
+@functools.lru_cache(maxsize=128)
+def _compile_keyset_condition(sort_by, sort_dir, key_is_null, numeric_coverage):
     """
-    Get all inventory items with efficient pagination, filtering, and sorting
-    - limit: Number of items to return (default 20, 0 for all items)
-    - offset: Pagination offset (starting position)
-    - search: Search text to filter items
-    - branch: Filter by branch
-    - entity: Filter by entity (optional)
-    - status: Filter by status (excess, low, dead)
-    - network_status: Filter by network status (optional)
-    - sort_by: Field to sort by (mfgPartNumber, inventoryBalance, partNumber, etc.)
-    - sort_dir: Sort direction (asc or desc)
+    Rows strictly after the cursor position in compile_inventory_order(keyset=True) order.
+    Postgres puts NULL sort values last when ascending and first when descending, and row
+    comparisons with NULL are never true, so NULL keys are handled explicitly.
     """
-    import time
-    start_time = time.time()
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Build query parameters
-        params = []
-        
-        # Build base query
-        query = """
-            SELECT *
-            FROM inventory_management.demo_inventory
-            WHERE "branch" != 'Corporate'
-        """
-        
-        # Add entity filter if specified
-        if entity:
-            query += " AND entity = %s"
-            params.append(entity)
-            
-        # Add branch filter if specified
-        if branch:
-            query += " AND branch = %s"
-            params.append(branch)
-        
-        # Add status filter if specified
-        if status:
-            if status == 'excess':
-                query += " AND status = 'excess'"
-            elif status == 'low':
-                query += " AND status = 'low'"
-            elif status == 'dead':
-                query += " AND status = 'dead'"
-            # 'overview' or other values don't need filtering
-        
-        # Add network status filter if specified
-        if network_status:
-            query += " AND \"Network Status\" = %s"
-            params.append(network_status)
-        
-        # Add search filter if specified
-        if search:
-            query += """ 
-                AND (
-                    mfgpartnbr ILIKE %s OR
-                    description ILIKE %s OR
-                    mfgname ILIKE %s OR
-                    partnbr ILIKE %s OR
-                    entity ILIKE %s OR
-                    branch ILIKE %s
-                )
-            """
-            search_param = f"%{search}%"
-            params.extend([search_param, search_param, search_param, search_param, search_param, search_param])
-        
-        # Get total count and metrics in one efficient query (for pagination)
-        count_query = f"""
-        SELECT 
-            COUNT(*) AS total,
-            SUM(CASE WHEN status = 'excess' THEN 1 ELSE 0 END) AS excess_count,
-            SUM(CASE WHEN status = 'low' THEN 1 ELSE 0 END) AS low_count,
-            SUM(CASE WHEN status = 'dead' THEN 1 ELSE 0 END) AS dead_count,
-            SUM("Inventory Balance") AS total_value,
-            COUNT(DISTINCT entity) AS entity_count,
-            COUNT(DISTINCT branch) AS branch_count
-        FROM ({query}) AS filtered
-        """
-        cursor.execute(count_query, params)
-        count_data = cursor.fetchone()
-        total_count = count_data["total"]
-        
-        if total_count == 0:
-            # No results found
-            return {
-                "items": [],
-                "totalCount": 0,
-                "limit": limit,
-                "offset": offset,
-                "hasMore": False,
-                "metrics": {
-                    "totalSKUs": 0,
-                    "excessItems": 0,
-                    "lowStockItems": 0,
-                    "deadStockItems": 0,
-                    "totalInventoryValue": 0,
-                    "entityCount": 0,
-                    "branchCount": 0
-                }
-            }
-        
-        # Map API sort fields to database fields
-        sort_field_map = {
-            "inventoryBalance": "Inventory Balance",
-            "mfgPartNumber": "mfgpartnbr",
-            "partNumber": "partnbr",
-            "description": "description",
-            "quantityOnHand": "Sum of Quantity On Hand",
-            "monthsOfCoverage": "Months of Coverage",  # Updated from "Months to Burn"
-            "ttmQtyUsed": "Sum of TTM Qty Used",
-            "entity": "entity",
-            "branch": "branch",
-            "lastReceipt": "Last Receipt",
-            "companyStatus": "Network Status"
-            # Add more mappings as needed
-        }
-        
-        # Get the database field name, default to "Inventory Balance" if not mapped
-        db_sort_field = sort_field_map.get(sort_by, "Inventory Balance")
-        
-        # Add sorting with special handling for monthsOfCoverage
-        sort_direction = "DESC" if sort_dir.lower() == "desc" else "ASC"
-        if sort_by == "monthsOfCoverage":
-            # For monthsOfCoverage, treat "Infinity" as the highest value
-            query += f''' ORDER BY 
-                CASE 
-                    WHEN "Months of Coverage" = 'Infinity' THEN 
-                        CASE WHEN '{sort_direction}' = 'ASC' THEN 1 ELSE 0 END
-                    ELSE 
-                        CASE WHEN '{sort_direction}' = 'ASC' THEN 0 ELSE 1 END
-                END,
-                CAST("Months of Coverage" AS FLOAT) {sort_direction}'''
-        else:
-            query += f' ORDER BY "{db_sort_field}" {sort_direction}'
-        
-        # Only add a limit if limit > 0 (limit=0 means no limit)
-        if limit > 0:
-            query += " LIMIT %s"
-            params.append(limit)
-            
-            # Add offset for pagination
-            if offset > 0:
-                query += " OFFSET %s"
-                params.append(offset)
-        
-        # Execute query to get paginated results
-        print(f"Executing query: {query} with params: {params}")
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
-        # Convert to API format with efficient batch processing
-        result = convert_db_rows_to_api_format(rows, offset)
-        
-        # Calculate metrics from the count query results
-        metrics = {
-            "totalSKUs": safe_convert(count_data["total"], int),
-            "excessItems": safe_convert(count_data["excess_count"], int),
-            "lowStockItems": safe_convert(count_data["low_count"], int),
-            "deadStockItems": safe_convert(count_data["dead_count"], int),
-            "totalInventoryValue": safe_convert(count_data["total_value"], float),
-            "entityCount": safe_convert(count_data["entity_count"], int),
-            "branchCount": safe_convert(count_data["branch_count"], int)
-        }
-        
-        # Calculate inventory turnover only for overall metrics
-        # Skip for filtered results to save processing time
-        inventory_turns = 0.0
-        if not entity and not branch and not status and not search:
-            # Calculate for all entities (including HCN)
-            turns_query = """
-                SELECT 
-                    SUM("Inventory Balance") AS total_inventory_value,
-                    SUM(("Sum of Quantity On Hand" + COALESCE("Sum of TTM Qty Used", 0)) * COALESCE("_Average Cost", 0)) AS total_cogs
-                FROM inventory_management.demo_inventory
-                WHERE "branch" != 'Corporate'
-            """
-            cursor.execute(turns_query)
-            turns_row = cursor.fetchone()
-            
-            if turns_row and turns_row["total_inventory_value"] and turns_row["total_inventory_value"] > 0:
-                inventory_turns = turns_row["total_cogs"] / turns_row["total_inventory_value"]
-                
-            print(f"Overall Inventory Turns: {inventory_turns}")
-        
-        metrics["inventoryTurnover"] = safe_convert(inventory_turns, float)
-        
-        cursor.close()
-        
-        total_time = time.time() - start_time
-        print(f"Total API processing time: {total_time:.3f} seconds")
-        
-        # Return with pagination metadata and metrics
-        return {
-            "items": result,
-            "totalCount": total_count,
-            "limit": limit,
-            "offset": offset,
-            "hasMore": offset + len(result) < total_count,
-            "metrics": metrics,
-            "executionTime": f"{total_time:.3f}s"
-        }
-    except Exception as e:
-        print(f"Error reading inventory data: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error reading inventory data: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
+    expression = _sort_expression(sort_by, numeric_coverage)
+    tiebreaker = ", ".join(KEYSET_TIEBREAKER)
+    placeholders = ", ".join(["%s"] * len(KEYSET_TIEBREAKER))
+    operator = "<" if _sort_direction(sort_dir) == "DESC" else ">"
+    if key_is_null:
+        tie_condition = f"{expression} IS NULL AND ({tiebreaker}) {operator} ({placeholders})"
+        if operator == "<":
+            return f"({expression} IS NOT NULL OR ({tie_condition}))"
+        return f"({tie_condition})"
+    condition = f"({expression}, {tiebreaker}) {operator} (%s, {placeholders})"
+    if operator == ">":
+        return f"({expression} IS NULL OR {condition})"
+    return f"({condition})"
 
-# Get metrics for advanced filters (multiple entities and branches)
-@app.get("/metrics/advanced")
-def get_advanced_metrics(
-    entities: str = None,
-    branches: str = None,
-    status_filter: str = None # Renamed for clarity and to avoid conflict with 'status' column
-):
+def _compile_page_clauses(sort_by, sort_dir, limit, offset, after, keyset, order=None):
+    """(keyset condition or None, its params, 'ORDER BY ... LIMIT ... OFFSET ...', their params)"""
+    condition, condition_params = None, []
+    if keyset and after is not None:
+        key, *tiebreaker = after
+        condition = _compile_keyset_condition(_sort_field(sort_by), sort_dir.lower(), key is None,
+                                              numeric_coverage_available())
+        condition_params = list(tiebreaker if key is None else after)
+    tail, tail_params = order or compile_inventory_order(sort_by, sort_dir, keyset), []
+    if limit > 0:
+        tail += " LIMIT %s"
+        tail_params.append(limit)
+        if offset > 0 and not keyset:
+            tail += " OFFSET %s"
+            tail_params.append(offset)
+    return condition, condition_params, tail, tail_params
+
+def compile_inventory_page(inventory_filter, sort_by, sort_dir, limit, offset, after=None, keyset=False, select_list="*"):
     """
-    Get consolidated metrics and summaries across multiple entities and branches
-    - entities: Comma-separated list of entity names
-    - branches: Comma-separated list of branch names
-    - status_filter: Optional filter by inventory status (excess, low, dead, overview)
+    (SQL, params) selecting one sorted page of rows; limit <= 0 returns every matching row.
+    keyset=True pages by position instead of OFFSET: rows come after the `after` key
+    ([sort value, entity, branch, partnbr] of the previous page's last row, None for the first page).
+    sort_by=relevance with search text ranks the rows by compile_search_relevance (OFFSET paging only).
     """
-    import time
-    start_time = time.time()
-    conn = None
-    try:
-        entity_list = entities.split(',') if entities else []
-        branch_list = branches.split(',') if branches else []
-        
-        print(f"Advanced metrics/summaries request: entities={entity_list}, branches={branch_list}, status_filter={status_filter}")
-        
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        where_conditions = []
-        params = []
-        
-        if entity_list:
-            placeholders = ', '.join(['%s'] * len(entity_list))
-            where_conditions.append(f"entity IN ({placeholders})")
-            params.extend(entity_list)
-        
-        if branch_list:
-            placeholders = ', '.join(['%s'] * len(branch_list))
-            where_conditions.append(f"branch IN ({placeholders})")
-            params.extend(branch_list)
-        
-        # Parameterized status filter
-        if status_filter and status_filter != 'overview': # 'overview' implies no status filter for main counts
-            where_conditions.append("status = %s")
-            params.append(status_filter)
-        
-        base_where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
+    where_sql, params = compile_inventory_filter(inventory_filter)
+    if _ranks_by_relevance(inventory_filter, sort_by):
+        relevance_sql, relevance_params = compile_search_relevance(inventory_filter.search)
+        _, _, tail, tail_params = _compile_page_clauses(sort_by, sort_dir, limit, offset, None, False, RELEVANCE_ORDER)
+        query = f"SELECT {relevance_sql} AS search_relevance, {select_list} FROM {INVENTORY_TABLE} {where_sql} {tail}"
+        return query, relevance_params + params + tail_params
+    condition, condition_params, tail, tail_params = _compile_page_clauses(sort_by, sort_dir, limit, offset, after, keyset)
+    if condition:
+        where_sql = f"{where_sql} AND {condition}" if where_sql else f"WHERE {condition}"
+    return f"SELECT {select_list} FROM {INVENTORY_TABLE} {where_sql} {tail}", params + condition_params + tail_params
 
-        # Main query for metrics, summaries, and turnover components
-        # This query tries to get everything in one go for the given filters
-        query = f"""
-            SELECT 
-                COUNT(*) AS total_skus,
-                SUM(CASE WHEN status = 'excess' THEN 1 ELSE 0 END) AS excess_items,
-                SUM(CASE WHEN status = 'low' THEN 1 ELSE 0 END) AS low_stock_items,
-                SUM(CASE WHEN status = 'dead' THEN 1 ELSE 0 END) AS dead_stock_items,
-
-                SUM("Inventory Balance") AS overview_total_value,
-                SUM("Sum of Quantity On Hand") AS overview_total_quantity,
-                SUM(("Sum of Quantity On Hand" + COALESCE("Sum of TTM Qty Used", 0)) * COALESCE("_Average Cost", 0)) AS overview_total_cogs,
-
-                SUM(CASE WHEN status = 'excess' THEN "Inventory Balance" ELSE 0 END) AS excess_total_value,
-                SUM(CASE WHEN status = 'excess' THEN "Sum of Quantity On Hand" ELSE 0 END) AS excess_total_quantity,
-                SUM(CASE WHEN status = 'excess' THEN ("Sum of Quantity On Hand" + COALESCE("Sum of TTM Qty Used", 0)) * COALESCE("_Average Cost", 0) ELSE 0 END) AS excess_total_cogs,
-
-                SUM(CASE WHEN status = 'low' THEN "Inventory Balance" ELSE 0 END) AS low_total_value,
-                SUM(CASE WHEN status = 'low' THEN "Sum of Quantity On Hand" ELSE 0 END) AS low_total_quantity,
-                SUM(CASE WHEN status = 'low' THEN ("Sum of Quantity On Hand" + COALESCE("Sum of TTM Qty Used", 0)) * COALESCE("_Average Cost", 0) ELSE 0 END) AS low_total_cogs,
-
-                SUM(CASE WHEN status = 'dead' THEN "Inventory Balance" ELSE 0 END) AS dead_total_value,
-                SUM(CASE WHEN status = 'dead' THEN "Sum of Quantity On Hand" ELSE 0 END) AS dead_total_quantity,
-                SUM(CASE WHEN status = 'dead' THEN ("Sum of Quantity On Hand" + COALESCE("Sum of TTM Qty Used", 0)) * COALESCE("_Average Cost", 0) ELSE 0 END) AS dead_total_cogs
-            FROM inventory_management.demo_inventory
-            WHERE {base_where_clause}
-        """
-        
-        print(f"Executing combined metrics/summaries query with params: {params}")
-        cursor.execute(query, tuple(params)) # Ensure params is a tuple
-        data = cursor.fetchone()
+# Per (entity, branch, status, "Network Status") sums of the measures below, kept up to date by triggers on
+# demo_inventory (api/migrations). Its key columns carry demo_inventory's names, so compiled filters apply to it.
+INVENTORY_ROLLUP_TABLE = "inventory_management.demo_inventory_rollup"
 
-        # Get actual entity and branch counts separately, applying the same filters
-        # This is because COUNT(DISTINCT) on the main query would be for the whole filtered set,
-        # not necessarily reflecting the input if some entities/branches had no matching items.
-        # For the purpose of displaying selected criteria, it's often better to echo back what was asked for,
-        # or list what *actually* had results. Let's get what *actually* had results.
-        
-        count_query_params = []
-        count_where_conditions = []
-        if entity_list:
-            placeholders = ', '.join(['%s'] * len(entity_list))
-            count_where_conditions.append(f"entity IN ({placeholders})")
-            count_query_params.extend(entity_list)
-        if branch_list:
-            placeholders = ', '.join(['%s'] * len(branch_list))
-            count_where_conditions.append(f"branch IN ({placeholders})")
-            count_query_params.extend(branch_list)
-        # No status filter for distinct entity/branch list usually
-        count_where_clause = " AND ".join(count_where_conditions) if count_where_conditions else "1=1"
+# What the metrics aggregate, per demo_inventory row and as the rollup's summed columns. Aggregates are
+# written as templates over these names, e.g. "SUM({value})", and compiled against either source.
+ROW_MEASURES = {
+    "skus": "1",
+    "value": '"Inventory Balance"',
+    "quantity": '"Sum of Quantity On Hand"',
+    # COGS = (Quantity On Hand + TTM Qty Used) * Average Cost, for inventory turnover
+    "cogs": '("Sum of Quantity On Hand" + COALESCE("Sum of TTM Qty Used", 0)) * COALESCE("_Average Cost", 0)',
+}
+ROLLUP_MEASURES = {
+    "skus": "sku_count",
+    "value": "inventory_value::DOUBLE PRECISION",
+    "quantity": "quantity_on_hand::DOUBLE PRECISION",
+    "cogs": "cogs::DOUBLE PRECISION",
+}
 
-        count_query = f"""
-            SELECT 
-                array_agg(DISTINCT entity) AS actual_entities,
-                array_agg(DISTINCT branch) AS actual_branches
-            FROM inventory_management.demo_inventory
-            WHERE {count_where_clause}
-        """
-        cursor.execute(count_query, tuple(count_query_params))
-        count_data = cursor.fetchone()
-        
-        actual_entities = count_data.get("actual_entities", []) if count_data else []
-        actual_branches = count_data.get("actual_branches", []) if count_data else []
+def status_total(status, measure):
+    """Aggregate template summing a measure over the rows of one status"""
+    return f"SUM(CASE WHEN status = '{status}' THEN {{{measure}}} ELSE 0 END)"
 
+# Totals reported next to every listing page (name -> aggregate template over the matching rows)
+INVENTORY_PAGE_TOTALS = {
+    "total": "COALESCE(SUM({skus}), 0)::BIGINT",
+    "excess_count": status_total("excess", "skus"),
+    "low_count": status_total("low", "skus"),
+    "dead_count": status_total("dead", "skus"),
+    "total_value": "SUM({value})",
+    "total_cogs": "SUM({cogs})",
+}
 
-        def calculate_turnover(cogs, value):
-            if value and value > 0 and cogs is not None:
-                return safe_convert(cogs / value, float)
-            return 0.0
+# Tab counts, values, quantities and COGS (for each tab's inventory turnover) per status, reported by
+# the filter count endpoints
+FILTER_COUNT_TOTALS = {
+    "total_items": "COALESCE(SUM({skus}), 0)",
+    "excess_items": status_total("excess", "skus"),
+    "low_stock_items": status_total("low", "skus"),
+    "dead_stock_items": status_total("dead", "skus"),
+    "total_value": "SUM({value})",
+    "excess_value": status_total("excess", "value"),
+    "low_value": status_total("low", "value"),
+    "dead_value": status_total("dead", "value"),
+    "total_quantity": "SUM({quantity})",
+    "excess_quantity": status_total("excess", "quantity"),
+    "low_quantity": status_total("low", "quantity"),
+    "dead_quantity": status_total("dead", "quantity"),
+    "total_cogs": "SUM({cogs})",
+    "excess_cogs": status_total("excess", "cogs"),
+    "low_cogs": status_total("low", "cogs"),
+    "dead_cogs": status_total("dead", "cogs"),
+}
 
-        summaries = {
-            "overview": {
-                "totalValue": safe_convert(data.get("overview_total_value"), float),
-                "totalQuantity": safe_convert(data.get("overview_total_quantity"), int),
-                "inventoryTurnover": calculate_turnover(data.get("overview_total_cogs"), data.get("overview_total_value")),
-                "entityCount": len(actual_entities), # Should reflect entities in the result
-                "branchCount": len(actual_branches)  # Should reflect branches in the result
-            },
-            "excess": {
-                "totalValue": safe_convert(data.get("excess_total_value"), float),
-                "totalQuantity": safe_convert(data.get("excess_total_quantity"), int),
-                "inventoryTurnover": calculate_turnover(data.get("excess_total_cogs"), data.get("excess_total_value")),
-                "entityCount": len(actual_entities),
-                "branchCount": len(actual_branches)
-            },
+def status_turnover(counts, prefix):
+    """Inventory turns (COGS / value) of one FILTER_COUNT_TOTALS status prefix; 0 without value"""
+    value = counts[f"{prefix}_value"]
+    return counts[f"{prefix}_cogs"] / value if value and value > 0 else 0.0
+
+def inventory_aggregate_source(inventory_filter):
+    """(relation, measures) to aggregate for a filter: the rollup unless search text needs the rows"""
+    if INVENTORY_METRICS_SOURCE != "table" and not inventory_filter.search and get_schema_features()["rollup"]:
+        return INVENTORY_ROLLUP_TABLE, ROLLUP_MEASURES
+    return INVENTORY_TABLE, ROW_MEASURES
+
+def compile_inventory_totals(inventory_filter, totals, group_by=(), grouping_sets=None):
+    """
+    (SQL, params) computing the `totals` aggregates (name -> template, see ROW_MEASURES) over the rows
+    matching the filter; one result row, or one per group_by combination.
+    grouping_sets (e.g. [(), ("branch",)]) computes several groupings in the same scan instead; each
+    row then carries by_<column>, true when that column is one of the row's grouping keys.
+    """
+    relation, measures = inventory_aggregate_source(inventory_filter)
+    where_sql, params = compile_inventory_filter(inventory_filter)
+    aggregates = [f"{template.format(**measures)} AS {name}" for name, template in totals.items()]
+    if grouping_sets is not None:
+        columns = list(dict.fromkeys(column for grouping_set in grouping_sets for column in grouping_set))
+        select_list = ", ".join([*columns, *(f"GROUPING({column}) = 0 AS by_{column}" for column in columns), *aggregates])
+        sets = ", ".join(f"({', '.join(grouping_set)})" for grouping_set in grouping_sets)
+        return f"SELECT {select_list} FROM {relation} {where_sql} GROUP BY GROUPING SETS ({sets})", params
+    select_list = ", ".join([*group_by, *aggregates])
+    group_sql = f"GROUP BY {', '.join(group_by)}" if group_by else ""
+    return f"SELECT {select_list} FROM {relation} {where_sql} {group_sql}", params
+
+def compile_inventory_page_with_totals(inventory_filter, totals, sort_by, sort_dir, limit, offset, after=None, keyset=False):
+    """
+    (SQL, params) for the page rows and the totals over all matching rows in one statement. The
+    page is selected on its own (not from the rows the totals read) so it can use a sort index and
+    stop at LIMIT; every result row carries the totals plus one page row, and a single row with a
+    NULL page_row stands for an empty page.
+    """
+    totals_query, totals_params = compile_inventory_totals(inventory_filter, totals)
+    page_query, page_params = compile_inventory_page(inventory_filter, sort_by, sort_dir, limit, offset, after, keyset,
+                                                     select_list="TRUE AS page_row, *")
+    query = f"""
+        WITH totals AS ({totals_query}), page AS ({page_query})
+        SELECT totals.*, page.* FROM totals LEFT JOIN page ON TRUE
+        {RELEVANCE_ORDER if _ranks_by_relevance(inventory_filter, sort_by) else compile_inventory_order(sort_by, sort_dir, keyset)}
+    """
+    return query, totals_params + page_params
+
+def inventory_filter_snapshot(inventory_filter):
+    """The snapshot to answer a filter's listing or counts from (INVENTORY_SNAPSHOT_LISTINGS), or None to query the database"""
+    if not INVENTORY_SNAPSHOT_LISTINGS:
+        return None
+    if inventory_filter.search and any(wildcard in inventory_filter.search for wildcard in "%_\\"):
+        return None  # ILIKE pattern characters; the snapshot only matches plain substrings
+    return get_inventory_snapshot()
+
+def inventory_listing_snapshot(inventory_filter, sort_by):
+    """inventory_filter_snapshot for a listing page; relevance ranking needs the database"""
+    if _ranks_by_relevance(inventory_filter, sort_by):
+        return None
+    return inventory_filter_snapshot(inventory_filter)
+
+def fetch_inventory_totals(cursor, inventory_filter, totals, snapshot=None):
+    """One row of totals over the rows matching the filter, from the snapshot when one is given"""
+    if snapshot is not None:
+        return snapshot.inventory_totals(inventory_filter, totals)
+    query, params = compile_inventory_totals(inventory_filter, totals)
+    execute_prepared(cursor, query, params)
+    return cursor.fetchone()
+
+def fetch_inventory_page(cursor, inventory_filter, totals, sort_by, sort_dir, limit, offset, after=None, keyset=False,
+                         snapshot=None):
+    """
+    Runs a listing endpoint's totals and page queries and returns (totals row, page rows).
+    With INVENTORY_COMBINED_PAGE_QUERY both come from one statement (one round trip); otherwise the totals run first and the page query is skipped when nothing matches.
+    With a snapshot (see inventory_listing_snapshot) both are computed in memory and cursor is not used.
+    """
+    if snapshot is not None:
+        return snapshot.inventory_page(inventory_filter, totals, sort_by, sort_dir, limit, offset, after, keyset)
+    if INVENTORY_COMBINED_PAGE_QUERY:
+        query, params = compile_inventory_page_with_totals(inventory_filter, totals, sort_by, sort_dir, limit, offset, after, keyset)
+        print(f"Executing page query: {' '.join(query.split())} with params: {params}")
+        execute_prepared(cursor, query, params)
+        result = cursor.fetchall()
+        totals_row = {name: result[0][name] for name in totals}
+        rows = [row for row in result if row["page_row"]]
+        for row in rows:
+            for name in totals:
+                del row[name]
+            del row["page_row"]
+        return totals_row, rows
+
+    totals_row = fetch_inventory_totals(cursor, inventory_filter, totals)
+    if not totals_row["total"]:
+        return totals_row, []
+    query, params = compile_inventory_page(inventory_filter, sort_by, sort_dir, limit, offset, after, keyset)
+    print(f"Executing query: {query} with params: {params}")
+    execute_prepared(cursor, query, params)
+    return totals_row, cursor.fetchall()
+
+def encode_inventory_cursor(sort_by, sort_dir, position, row):
+    """Opaque cursor pointing after `row` (a demo_inventory row) for the given sort"""
+    key = row[SORT_FIELD_MAP[_sort_field(sort_by)]]
+    if _sort_field(sort_by) == "monthsOfCoverage" and "months_of_coverage" in row:
+        key = row["months_of_coverage"]
+    elif _sort_field(sort_by) == "monthsOfCoverage" and key is not None:
+        key = float(key)
+    elif isinstance(key, (datetime.date, datetime.datetime)):
+        key = key.isoformat()
+    payload = {
+        "sort": [_sort_field(sort_by), _sort_direction(sort_dir)],
+        "position": position,
+        "after": [key] + [row[column] for column in KEYSET_TIEBREAKER],
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii")
+
+def decode_inventory_cursor(cursor, sort_by, sort_dir):
+    """
+    (position, after) for a cursor from encode_inventory_cursor; an empty cursor starts at the
+    first row. Raises HTTPException(400) for malformed cursors or ones issued for another sort.
+    """
+    if sort_by == RELEVANCE_SORT_FIELD:
+        raise HTTPException(status_code=400, detail="Cursor pagination is not available for the relevance sort")
+    if not cursor:
+        return 0, None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        position, after = int(payload["position"]), list(payload["after"])
+        sort = payload["sort"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if sort != [_sort_field(sort_by), _sort_direction(sort_dir)] or len(after) != len(KEYSET_TIEBREAKER) + 1:
+        raise HTTPException(status_code=400, detail="Cursor does not match the requested sort")
+    return position, after
+
+# Connection class used by the pool so every connection remembers its pool and age
+class PooledConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.in_use = False
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+        self.prepared_statements = OrderedDict()  # SQL text -> server-side statement name
+        self.discard_on_release = False
+        self.statement_timeout_ms = None  # None = server default
+        self.query_scope = None
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes free within the checkout timeout"""
+    pass
+
+# Bounded, thread-safe connection pool
+class DatabasePool:
+    """
+    Keeps up to max_size open connections and hands them out with borrow/return semantics.
+    - getconn(): borrow a connection, waiting up to checkout_timeout seconds when all are busy
+    - putconn(): return it; open transactions are rolled back so the next borrower starts clean
+    Connections idle longer than healthcheck_idle are pinged before being handed out, and
+    connections older than max_lifetime are closed and replaced.
+    """
+    def __init__(self, params, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 checkout_timeout=DB_POOL_CHECKOUT_TIMEOUT, max_lifetime=DB_POOL_MAX_LIFETIME,
+                 healthcheck_idle=DB_POOL_HEALTHCHECK_IDLE, name="primary"):
+        self.name = name
+        self.params = params
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.max_lifetime = max_lifetime
+        self.healthcheck_idle = healthcheck_idle
+        self._idle = []  # LIFO so the most recently used (warm) connection is reused first
+        self._size = 0   # open connections, idle and borrowed
+        self._closed = False
+        self._cond = threading.Condition()
+        self._counters = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "connectionsCreated": 0,
+            "connectionsRecycled": 0,
+            "healthCheckFailures": 0,
+            "connectionsDiscarded": 0,
+        }
+        # In-memory health: when the database last proved reachable / last failed
+        self._last_success_at = None
+        self._last_error_at = None
+        self._last_error = None
+
+    def _record_success(self):
+        with self._cond:
+            self._last_success_at = time.time()
+
+    def _record_error(self, error):
+        with self._cond:
+            self._last_error_at = time.time()
+            self._last_error = str(error)
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(connection_factory=PooledConnection, **self.params)
+        except Exception as e:
+            self._record_error(e)
+            raise
+        conn.pool = self
+        with self._cond:
+            self._counters["connectionsCreated"] += 1
+        self._record_success()
+        return conn
+
+    def _is_expired(self, conn, now):
+        return self.max_lifetime > 0 and now - conn.created_at > self.max_lifetime
+
+    def _is_healthy(self, conn, now):
+        """Cheap validation on checkout: only connections that sat idle for a while get a round trip"""
+        if conn.closed:
+            return False
+        if now - conn.last_used_at < self.healthcheck_idle:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            self._record_error(e)
+            return False
+
+    def _discard(self, conn):
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._counters["connectionsDiscarded"] += 1
+            self._cond.notify()
+
+    def open(self):
+        """Pre-open min_size connections so the first requests do not pay for the TLS handshake"""
+        conns = []
+        try:
+            while True:
+                with self._cond:
+                    if self._size >= self.min_size:
+                        break
+                conns.append(self.getconn())
+        finally:
+            for conn in conns:
+                self.putconn(conn)
+
+    def getconn(self, timeout=None):
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            conn = None
+            with self._cond:
+                waited = False
+                while True:
+                    if self._closed:
+                        raise PoolTimeoutError(f"Connection pool '{self.name}' is closed")
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1  # reserve the slot, connect outside the lock
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {timeout:.1f}s waiting for a connection from pool '{self.name}'"
+                        )
+                    if not waited:
+                        self._counters["waits"] += 1
+                        waited = True
+                    self._cond.wait(remaining)
+
+            now = time.monotonic()
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif self._is_expired(conn, now):
+                with self._cond:
+                    self._counters["connectionsRecycled"] += 1
+                self._discard(conn)
+                continue
+            elif not self._is_healthy(conn, now):
+                with self._cond:
+                    self._counters["healthCheckFailures"] += 1
+                self._discard(conn)
+                continue
+
+            conn.in_use = True
+            conn.last_used_at = now
+            with self._cond:
+                self._counters["checkouts"] += 1
+            return conn
+
+    def putconn(self, conn):
+        if not conn.in_use:
+            return  # already returned
+        conn.in_use = False
+        if conn.closed or conn.discard_on_release:
+            self._discard(conn)
+            return
+        try:
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            self._discard(conn)
+            return
+        now = time.monotonic()
+        if self._closed or self._is_expired(conn, now):
+            if not self._closed:
+                with self._cond:
+                    self._counters["connectionsRecycled"] += 1
+            self._discard(conn)
+            return
+        conn.last_used_at = now
+        self._record_success()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "name": self.name,
+                "size": self._size,
+                "idle": len(self._idle),
+                "inUse": self._size - len(self._idle),
+                "minSize": self.min_size,
+                "maxSize": self.max_size,
+                **self._counters,
+            }
+
+    def ping(self, timeout=1):
+        """Round trip on a pooled connection; the outcome lands in health()"""
+        try:
+            conn = self.getconn(timeout=timeout)
+        except Exception:
+            return  # connect failures are already recorded; a pool timeout means the database is busy, not down
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+        except psycopg2.Error as e:
+            self._record_error(e)
+            conn.discard_on_release = True
+        finally:
+            self.putconn(conn)
+
+    def health(self):
+        """Reachability as last observed by real traffic; no round trip"""
+        with self._cond:
+            healthy = self._last_success_at is not None and (
+                self._last_error_at is None or self._last_success_at >= self._last_error_at
+            )
+            return {
+                "healthy": healthy,
+                "lastSuccessAt": self._last_success_at,
+                "lastErrorAt": self._last_error_at,
+                "lastError": self._last_error,
+            }
+
+# Per-request query scope: statement timeouts and cancellation when the HTTP client goes away
+class QueryCancelledError(Exception):
+    """Raised when a request's client disconnected before (or while) its queries ran"""
+    pass
+
+class QueryScope:
+    """Tracks the connections a request has borrowed so they can be cancelled as a group"""
+    def __init__(self, route_group, statement_timeout_ms=None):
+        self.route_group = route_group
+        self.statement_timeout_ms = statement_timeout_ms or None
+        self.cancelled = False
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def register(self, conn):
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelledError("Client disconnected")
+            self._connections.add(conn)
+            conn.query_scope = self
+
+    def unregister(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+            conn.query_scope = None
+
+    def cancel(self):
+        """Cancels whatever the borrowed connections are running; later queries are refused"""
+        with self._lock:
+            if self.cancelled:
+                return 0
+            self.cancelled = True
+            cancelled = 0
+            for conn in self._connections:
+                try:
+                    conn.cancel()
+                    cancelled += 1
+                except psycopg2.Error as e:
+                    print(f"Failed to cancel query for disconnected client: {e}")
+            return cancelled
+
+current_query_scope = contextvars.ContextVar("current_query_scope", default=None)
+_query_cancellation_lock = threading.Lock()
+_query_cancellation_counters = {"clientDisconnects": 0, "queriesCancelled": 0}
+
+def route_group_for_path(path):
+    """Maps a request path to its STATEMENT_TIMEOUTS_MS group (None for routes without a limit)"""
+    for group in STATEMENT_TIMEOUTS_MS:
+        if path == f"/{group}" or path.startswith(f"/{group}/"):
+            return group
+    return None
+
+class QueryCancellationMiddleware:
+    """
+    ASGI middleware for the inventory, metrics and filtercounts routes. It opens a QueryScope
+    carrying the route's statement timeout and watches the connection for http.disconnect;
+    when the client goes away, queries still running for the request are cancelled.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        group = route_group_for_path(scope["path"]) if scope["type"] == "http" else None
+        if group is None:
+            await self.app(scope, receive, send)
+            return
+
+        query_scope = QueryScope(group, STATEMENT_TIMEOUTS_MS.get(group))
+        token = current_query_scope.set(query_scope)
+        messages = asyncio.Queue()
+
+        async def watch_for_disconnect():
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    cancelled = await asyncio.get_running_loop().run_in_executor(None, query_scope.cancel)
+                    with _query_cancellation_lock:
+                        _query_cancellation_counters["clientDisconnects"] += 1
+                        _query_cancellation_counters["queriesCancelled"] += cancelled
+                    return
+
+        watcher = asyncio.create_task(watch_for_disconnect())
+        try:
+            await self.app(scope, messages.get, send)
+        finally:
+            watcher.cancel()
+            current_query_scope.reset(token)
+
+app.add_middleware(QueryCancellationMiddleware)
+
+def query_cancellation_stats():
+    with _query_cancellation_lock:
+        return {"statementTimeoutsMs": STATEMENT_TIMEOUTS_MS, **_query_cancellation_counters}
+
+def _bind_query_scope(conn, query_scope):
+    """Applies the request's statement timeout to a borrowed connection and registers it for cancellation"""
+    timeout_ms = query_scope.statement_timeout_ms if query_scope else None
+    if conn.statement_timeout_ms != timeout_ms:
+        # Session-level SET, committed right away so a later rollback cannot undo it; only issued
+        # when the connection last served a route with a different limit
+        cursor = conn.cursor()
+        if timeout_ms:
+            cursor.execute("SET statement_timeout = %s", (timeout_ms,))
+        else:
+            cursor.execute("SET statement_timeout TO DEFAULT")
+        cursor.close()
+        conn.commit()
+        conn.statement_timeout_ms = timeout_ms
+    if query_scope:
+        query_scope.register(conn)
+
+# Admission control: separate concurrency budgets for heavy and light routes, so a few unbounded
+# fetches or summaries cannot take every pool connection and CPU while cart requests wait behind them
+class AdmissionBudget:
+    """
+    At most `limit` requests of one class run at a time; up to `queue_size` more wait (FIFO) for at
+    most `queue_timeout` seconds, or wait on an identical running request (joined). Everything runs on
+    the event loop, so no locking is needed.
+    """
+    def __init__(self, name, limit, queue_size, queue_timeout):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.joined = 0  # requests waiting on an identical running one, see join()
+        self._waiters = deque()
+        self.counters = {"admitted": 0, "queued": 0, "rejected": 0, "queueTimeouts": 0, "joined": 0}
+
+    async def acquire(self):
+        """True once the request may run, False when it has to be turned away"""
+        if self.running < self.limit and not self._waiters:
+            self.running += 1
+            self.counters["admitted"] += 1
+            return True
+        if len(self._waiters) + self.joined >= self.queue_size:
+            self.counters["rejected"] += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.counters["queued"] += 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._forget(future)
+            self.counters["queueTimeouts"] += 1
+            return False
+        except asyncio.CancelledError:
+            self._forget(future)
+            if future.done() and not future.cancelled():
+                self.release()  # the slot was handed over just as the request went away
+            raise
+        self.counters["admitted"] += 1
+        return True
+
+    def join(self):
+        """
+        True when a request may wait on an identical running one instead of taking a slot. It still holds
+        a thread while it waits, so joined requests take queue places: a burst of the same request is
+        bounded like any other. Pair with leave().
+        """
+        if len(self._waiters) + self.joined >= self.queue_size:
+            self.counters["rejected"] += 1
+            return False
+        self.joined += 1
+        self.counters["joined"] += 1
+        return True
+
+    def leave(self):
+        self.joined -= 1
+
+    async def claim(self):
+        """Trades a joined request's queue place for a slot (see AdmittedRequest.claim_slot); False when turned away"""
+        self.leave()
+        return await self.acquire()
+
+    def _forget(self, future):
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def release(self):
+        # Hand the slot straight to the oldest waiter that is still waiting
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(True)
+                return
+        self.running -= 1
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "queueSize": self.queue_size,
+            "running": self.running,
+            "waiting": len(self._waiters),
+            "joinedWaiting": self.joined,
+            **self.counters
+        }
+
+admission_budgets = {
+    "heavy": AdmissionBudget("heavy", ADMISSION_HEAVY_LIMIT, ADMISSION_HEAVY_QUEUE, ADMISSION_QUEUE_TIMEOUT),
+    "light": AdmissionBudget("light", ADMISSION_LIGHT_LIMIT, ADMISSION_LIGHT_QUEUE, ADMISSION_QUEUE_TIMEOUT),
+}
+
+# Summaries over every row, whatever the query string
+HEAVY_PATHS = {"/part-branch-summary", "/metrics/all/complete", "/filtercounts/all"}
+# Probes and monitoring are never queued
+ADMISSION_EXEMPT_PATHS = {"/", "/stats", "/health", "/health/live", "/health/ready"}
+
+def admission_class_for(scope):
+    """'heavy', 'light' or None (not limited) for an HTTP request"""
+    path = scope["path"]
+    if scope["method"] == "OPTIONS" or path in ADMISSION_EXEMPT_PATHS:
+        return None
+    if path in HEAVY_PATHS:
+        return "heavy"
+    if path == "/inventory" or path.startswith("/inventory/"):
+        # limit=0 (or any limit <= 0) fetches every matching row
+        limit = parse_qs(scope["query_string"].decode("latin-1")).get("limit", [None])[-1]
+        try:
+            if limit is not None and int(limit) <= 0:
+                return "heavy"
+        except ValueError:
+            pass
+    return "light"
+
+# Admitted GET requests to coalesced routes by path and sorted query string. An identical request arriving
+# while one is running takes a queue place instead of a slot: coalesce_requests makes it wait for that
+# request's result instead of querying, or claims a slot first when that request has already finished.
+_admitted_requests = {}
+
+def routes_to_coalesced_endpoint(scope):
+    """True when the route serving an HTTP request (the first whose path and method match) uses coalesce_requests"""
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(getattr(route, "endpoint", None), "coalesces_requests", False)
+    return False
+
+class AdmittedRequest:
+    """
+    A request's hold on its AdmissionBudget: a running slot ("slot") or a queue place while it waits on an
+    identical request ("joined"). Seen by the endpoint's thread through current_admission.
+    """
+    def __init__(self, budget, loop, holds):
+        self.budget = budget
+        self.loop = loop
+        self.holds = holds
+
+    def claim_slot(self):
+        """
+        Called from the endpoint's thread by a joined request that found nothing to wait on: waits for a slot
+        like any queued request, raising a 503 when turned away
+        """
+        self.holds = None
+        if not asyncio.run_coroutine_threadsafe(self.budget.claim(), self.loop).result():
+            raise HTTPException(status_code=503, detail=f"Server busy ({self.budget.name} requests), please retry",
+                                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)})
+        self.holds = "slot"
+
+    def finish(self):
+        if self.holds == "slot":
+            self.budget.release()
+        elif self.holds == "joined":
+            self.budget.leave()
+        self.holds = None
+
+current_admission = contextvars.ContextVar("current_admission", default=None)
+
+class AdmissionControlMiddleware:
+    """ASGI middleware that runs each request inside its class's AdmissionBudget, answering 503 + Retry-After when full"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        admission_class = admission_class_for(scope) if scope["type"] == "http" else None
+        if admission_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        budget = admission_budgets[admission_class]
+        request_key = None
+        if scope["method"] == "GET" and routes_to_coalesced_endpoint(scope):
+            query = parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+            request_key = (scope["path"], tuple(sorted(query)))
+        joined = request_key in _admitted_requests
+        if not (budget.join() if joined else await budget.acquire()):
+            response = CustomJSONResponse(
+                status_code=503,
+                content={"detail": f"Server busy ({admission_class} requests), please retry"},
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+            )
+            await response(scope, receive, send)
+            return
+        admission = AdmittedRequest(budget, asyncio.get_running_loop(), "joined" if joined else "slot")
+        token = current_admission.set(admission)
+        if request_key is not None:
+            _admitted_requests[request_key] = _admitted_requests.get(request_key, 0) + 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_admission.reset(token)
+            if request_key is not None:
+                _admitted_requests[request_key] -= 1
+                if not _admitted_requests[request_key]:
+                    del _admitted_requests[request_key]
+            admission.finish()
+
+app.add_middleware(AdmissionControlMiddleware)
+
+def admission_stats():
+    return {name: budget.stats() for name, budget in admission_budgets.items()}
+
+# GET routes whose responses only change with demo_inventory (and the snapshot serving it)
+DATA_VERSION_ETAG_PREFIXES = ("/inventory", "/metrics", "/filtercounts", "/entities", "/part-branch-summary", "/part-details")
+
+# Per tagged request: serve_stale_on_outage sets "stale" when it answers from its cache, and the middleware
+# below then leaves the response untagged. A mutable holder, so the mark made in the endpoint's thread
+# (which runs in a copy of the request's context) is seen here.
+current_response_freshness = contextvars.ContextVar("current_response_freshness", default=None)
+
+class DataVersionETagMiddleware:
+    """
+    ASGI middleware that tags inventory reads with the data version and snapshot version they were served at,
+    and answers a matching If-None-Match with 304 without running the endpoint. The tag is taken before the
+    endpoint runs, so a response is never older than its tag. Without a data version requests pass through,
+    and stale results (served from the last good result during an outage) are never tagged.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or not scope["path"].startswith(DATA_VERSION_ETAG_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        version = get_data_version()
+        if version is None:
+            await self.app(scope, receive, send)
+            return
+        snapshot = inventory_snapshot
+        etag = f'W/"d{version}.s{snapshot.version if snapshot else 0}"'
+        if_none_match = dict(scope["headers"]).get(b"if-none-match", b"").decode("latin-1")
+        if etag in (tag.strip() for tag in if_none_match.split(",")):
+            _data_version_counters["notModified"] += 1
+            response = Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+            await response(scope, receive, send)
+            return
+
+        freshness = {"stale": False}
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200 and not freshness["stale"]:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"etag", etag.encode("latin-1")), (b"cache-control", b"no-cache")]
+            await send(message)
+
+        token = current_response_freshness.set(freshness)
+        try:
+            await self.app(scope, receive, send_with_etag)
+        finally:
+            current_response_freshness.reset(token)
+
+app.add_middleware(DataVersionETagMiddleware)
+
+# Enable CORS for all origins (registered last so it wraps the middleware above, including its 503s and 304s)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # Allow all origins for debugging
+    allow_credentials=False,  # Must be False when using wildcard origins
+    allow_methods=["*"],
+    allow_headers=["*"],
+    max_age=600,  # Cache preflight requests for 10 minutes
+)
+
+db_pool = None
+db_replica_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Returns the process-wide pool, creating it on first use (scripts that import main.py never hit startup)"""
+    global db_pool
+    if db_pool is None:
+        with _db_pool_lock:
+            if db_pool is None:
+                db_pool = DatabasePool(db_params)
+    return db_pool
+
+def get_replica_pool():
+    """Returns the read replica pool, or None when no replica is configured"""
+    global db_replica_pool
+    if replica_db_params is None:
+        return None
+    if db_replica_pool is None:
+        with _db_pool_lock:
+            if db_replica_pool is None:
+                db_replica_pool = DatabasePool(replica_db_params, name="replica")
+    return db_replica_pool
+
+# Routes read-only work to the replica while it is reachable and close enough to the primary
+class DataSourceRouter:
+    """
+    Picks the pool for a connection request. Writes always use the primary. Reads use the
+    replica unless it is unreachable or its replay lag exceeds max_lag_seconds; the lag is
+    measured at most once per check_interval and cached in between.
+    """
+    LAG_QUERY = """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END AS lag_seconds
+    """
+
+    def __init__(self, max_lag_seconds=DB_REPLICA_MAX_LAG_SECONDS, check_interval=DB_REPLICA_LAG_CHECK_INTERVAL):
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._replica_usable = False
+        self._lag_seconds = None
+        self._last_error = None
+        self._counters = {"primaryReads": 0, "replicaReads": 0, "replicaFallbacks": 0, "writes": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
+
+    def _check_replica(self, replica):
+        lag, error = None, None
+        try:
+            conn = replica.getconn()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(self.LAG_QUERY)
+                lag = float(cursor.fetchone()[0])
+                cursor.close()
+            finally:
+                replica.putconn(conn)
+        except PoolTimeoutError as e:
+            # A saturated replica pool says nothing about the replica: keep the last verdict until the next check
+            print(f"Replica lag check skipped: {e}")
+            with self._lock:
+                self._checked_at = time.monotonic()
+            return
+        except Exception as e:
+            error = str(e)
+            print(f"Replica lag check failed: {e}")
+        with self._lock:
+            self._checked_at = time.monotonic()
+            self._lag_seconds = lag
+            self._last_error = error
+            self._replica_usable = lag is not None and lag <= self.max_lag_seconds
+
+    def replica_usable(self, replica):
+        with self._lock:
+            due = self._checked_at is None or time.monotonic() - self._checked_at >= self.check_interval
+        if due:
+            self._check_replica(replica)
+        with self._lock:
+            return self._replica_usable
+
+    def mark_replica_unavailable(self, error):
+        """Called when borrowing from the replica failed; reads go to the primary until the next check"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            self._replica_usable = False
+            self._last_error = str(error)
+
+    def pool_for(self, read_only):
+        if not read_only:
+            self._count("writes")
+            return get_db_pool()
+        replica = get_replica_pool()
+        if replica is None:
+            self._count("primaryReads")
+            return get_db_pool()
+        if self.replica_usable(replica):
+            self._count("replicaReads")
+            return replica
+        self._count("replicaFallbacks")
+        return get_db_pool()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "replicaConfigured": replica_db_params is not None,
+                "replicaUsable": self._replica_usable,
+                "replicaLagSeconds": self._lag_seconds,
+                "maxLagSeconds": self.max_lag_seconds,
+                "lastError": self._last_error,
+                **self._counters,
+            }
+
+data_source_router = DataSourceRouter()
+
+# Circuit breaker around the data layer: after repeated connection failures, requests fail fast
+# for DB_BREAKER_RESET_TIMEOUT seconds instead of each waiting out its own connection timeout
+class DatabaseUnavailableError(HTTPException):
+    """503 raised while the circuit breaker is open"""
+    def __init__(self, retry_after):
+        super().__init__(
+            status_code=503,
+            detail="Database unavailable, please retry shortly",
+            headers={"Retry-After": str(max(1, int(retry_after)))},
+        )
+
+class DatabaseBusyError(HTTPException):
+    """503 raised when every pooled connection stayed busy for the checkout timeout; the database is up"""
+    def __init__(self, error):
+        super().__init__(
+            status_code=503,
+            detail=f"Database busy, please retry: {error}",
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+        )
+
+class CircuitBreaker:
+    """
+    closed: calls go through. open: calls are rejected until reset_timeout has passed. half-open:
+    one probe call goes through; its success closes the breaker, its failure opens it again.
+    """
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.counters = {"trips": 0, "rejected": 0}
+
+    def before_call(self):
+        """Raises DatabaseUnavailableError unless the call may go through"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            remaining = self.opened_at + self.reset_timeout - time.time()
+            if remaining <= 0 and not self._probe_in_flight:
+                self.state = "half-open"
+                self._probe_in_flight = True
+                return
+            self.counters["rejected"] += 1
+        raise DatabaseUnavailableError(remaining if remaining > 0 else self.reset_timeout)
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_inconclusive(self):
+        """The call ended without reaching the database (e.g. the pool was saturated); a probe may be retried"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half-open" or (self.state == "closed" and self.consecutive_failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.time()
+                self.counters["trips"] += 1
+            self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutiveFailures": self.consecutive_failures,
+                "openedAt": self.opened_at,
+                **self.counters
+            }
+
+database_breaker = CircuitBreaker(DB_BREAKER_FAILURE_THRESHOLD, DB_BREAKER_RESET_TIMEOUT)
+
+def database_outage(exc):
+    """
+    The database-unavailable error behind exc, if any. Endpoints re-raise failures as a generic
+    HTTPException(500), so the chain of handled exceptions (__cause__/__context__) is searched.
+    Returns an HTTPException(503) to raise, or None when exc is not an outage.
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, HTTPException) and exc.status_code == 503:
+            return exc
+        if isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+            return HTTPException(status_code=503, detail=f"Database unavailable: {str(exc)}")
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+# Database connection helper
+def get_db_connection(read_only=False):
+    """
+    Borrows a connection from the process-wide pool. Return it with release_db_connection().
+    Raises DatabaseUnavailableError (503) right away while the circuit breaker is open.
+    - read_only: the caller only reads inventory data, so a healthy read replica may serve it
+    """
+    database_breaker.before_call()
+    pool = data_source_router.pool_for(read_only)
+    try:
+        conn = pool.getconn()
+    except PoolTimeoutError as e:
+        # Every connection is in use: the database (or replica) is busy, not down, so neither the
+        # breaker nor the replica routing learns anything from it
+        database_breaker.record_inconclusive()
+        print(f"Connection pool saturated in get_db_connection: {e}")
+        raise DatabaseBusyError(e)
+    except Exception as e:
+        if pool is get_db_pool():
+            database_breaker.record_failure()
+            print(f"Database connection error in get_db_connection: {e}")
+            raise HTTPException(status_code=503, detail=f"Database connection error: {str(e)}")
+        print(f"Replica connection error, falling back to primary: {e}")
+        data_source_router.mark_replica_unavailable(e)
+        try:
+            conn = get_db_pool().getconn()
+        except PoolTimeoutError as e:
+            database_breaker.record_inconclusive()
+            print(f"Connection pool saturated in get_db_connection: {e}")
+            raise DatabaseBusyError(e)
+        except Exception as e:
+            database_breaker.record_failure()
+            print(f"Database connection error in get_db_connection: {e}")
+            raise HTTPException(status_code=503, detail=f"Database connection error: {str(e)}")
+    try:
+        _bind_query_scope(conn, current_query_scope.get())
+    except QueryCancelledError:
+        release_db_connection(conn)
+        database_breaker.record_success()
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except Exception as e:
+        release_db_connection(conn)
+        database_breaker.record_failure()
+        print(f"Database connection error in get_db_connection: {e}")
+        raise HTTPException(status_code=503, detail=f"Database connection error: {str(e)}")
+    database_breaker.record_success()
+    return conn
+
+def release_db_connection(conn):
+    """Returns a borrowed connection to its pool (rolling back anything left uncommitted)"""
+    query_scope = getattr(conn, "query_scope", None)
+    if query_scope is not None:
+        query_scope.unregister(conn)
+    pool = getattr(conn, "pool", None)
+    if pool is not None:
+        pool.putconn(conn)
+    else:
+        conn.close()
+
+# Server-side prepared statements
+_prepared_statement_lock = threading.Lock()
+_prepared_statement_counters = {"prepared": 0, "reused": 0, "deallocated": 0, "replanned": 0}
+
+def _to_positional_params(query):
+    """Rewrites psycopg2 %s placeholders into the $1, $2, ... form PREPARE expects"""
+    counter = iter(range(1, query.count("%s") + 1))
+    return re.sub(r"%s", lambda _: f"${next(counter)}", query).replace("%%", "%")
+
+def execute_prepared(cursor, query, params=None):
+    """
+    Executes a query as a server-side prepared statement on the cursor's (pooled) connection.
+    Every filter combination an endpoint can build produces its own SQL text, so the text is
+    the cache key: the first request of a shape pays for PREPARE, later ones only EXECUTE and
+    skip parsing/planning. Falls back to a plain execute on non-pooled connections.
+    """
+    conn = cursor.connection
+    cache = getattr(conn, "prepared_statements", None)
+    if cache is None:
+        cursor.execute(query, params)
+        return
+    params = list(params or [])
+    if conn.query_scope is not None and conn.query_scope.cancelled:
+        raise QueryCancelledError("Client disconnected")
+
+    name = cache.get(query)
+    if name is None:
+        if len(cache) >= PREPARED_STATEMENT_CACHE_SIZE:
+            _, oldest = cache.popitem(last=False)
+            cursor.execute(f"DEALLOCATE {oldest}")
+            with _prepared_statement_lock:
+                _prepared_statement_counters["deallocated"] += 1
+        name = "ps_" + hashlib.md5(query.encode("utf-8")).hexdigest()[:16]
+        cursor.execute(f"PREPARE {name} AS {_to_positional_params(query)}")
+        cache[query] = name
+        with _prepared_statement_lock:
+            _prepared_statement_counters["prepared"] += 1
+    else:
+        cache.move_to_end(query)
+        with _prepared_statement_lock:
+            _prepared_statement_counters["reused"] += 1
+
+    execute = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}"
+    try:
+        cursor.execute(execute, params or None)
+    except psycopg2.errors.FeatureNotSupported:
+        # "cached plan must not change result type": the table changed under us (e.g. a migration
+        # added a column). The failed EXECUTE aborted the transaction, which on these read paths held
+        # only reads; roll it back, prepare the statement again and retry once. Prepared statements
+        # live outside transactions, so the rollback keeps the rest of the cache.
+        conn.rollback()
+        cursor.execute(f"DEALLOCATE {name}")
+        cache.pop(query, None)
+        cursor.execute(f"PREPARE {name} AS {_to_positional_params(query)}")
+        cache[query] = name
+        with _prepared_statement_lock:
+            _prepared_statement_counters["replanned"] += 1
+        try:
+            cursor.execute(execute, params or None)
+        except psycopg2.errors.FeatureNotSupported:
+            # Still failing: drop this connection so its stale statements go with it
+            conn.discard_on_release = True
+            raise
+
+def prepared_statement_stats():
+    with _prepared_statement_lock:
+        return dict(_prepared_statement_counters)
+
+# Dedicated executor for the async endpoints. psycopg2 is blocking, so running it directly inside
+# an `async def` handler stalls the event loop; these endpoints hand their work to this executor instead.
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db-worker")
+_db_executor_lock = threading.Lock()
+_db_executor_counters = {"submitted": 0, "inFlight": 0}
+
+def _run_tracked(func, *args, **kwargs):
+    with _db_executor_lock:
+        _db_executor_counters["inFlight"] += 1
+    try:
+        return func(*args, **kwargs)
+    finally:
+        with _db_executor_lock:
+            _db_executor_counters["inFlight"] -= 1
+
+async def run_in_db_executor(func, *args, **kwargs):
+    """Runs a blocking database function on the db executor and awaits its result"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()  # keep request-scoped context variables in the worker thread
+    with _db_executor_lock:
+        _db_executor_counters["submitted"] += 1
+    return await loop.run_in_executor(
+        db_executor, functools.partial(context.run, _run_tracked, func, *args, **kwargs)
+    )
+
+def db_offload(func):
+    """
+    Decorator for endpoints whose body is plain blocking psycopg2 code: the endpoint stays
+    async for FastAPI, but the body runs on the db executor so the event loop keeps serving.
+    Failures caused by an unavailable database are raised as a 503.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await run_in_db_executor(func, *args, **kwargs)
+        except Exception as e:
+            # The endpoints report every failure as a 500; an unavailable database is a 503
+            outage = database_outage(e)
+            if outage is not None and outage is not e:
+                raise outage from None
+            raise
+    return wrapper
+
+def db_executor_stats():
+    with _db_executor_lock:
+        return {"maxWorkers": DB_EXECUTOR_WORKERS, **_db_executor_counters}
+
+# Single-flight coalescing: identical concurrent calls of a read endpoint share one execution
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.waiters = 0
+
+_inflight_calls = {}
+_inflight_lock = threading.Lock()
+_coalescing_counters = {"executions": 0, "coalesced": 0, "retried": 0}
+
+def coalesce_requests(func):
+    """
+    Decorator for blocking read endpoints. Calls with the same arguments (defaults filled in) that
+    arrive while one is running wait for it and get their own copy of its result or error instead
+    of running the same queries again. The running call returns its result as is, so the waiters
+    copy a snapshot taken before they are woken, never an object its caller may be rewriting.
+    If the running call was cancelled because its client went away, the waiters start over rather
+    than inheriting the cancellation. A request admitted without a slot to wait here (see
+    AdmissionControlMiddleware) that finds nothing running claims a slot before it runs the call.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (func.__name__, tuple(sorted((name, repr(value)) for name, value in bound.arguments.items())))
+        admission = current_admission.get()
+        while True:
+            with _inflight_lock:
+                flight = _inflight_calls.get(key)
+                if flight is None and (admission is None or admission.holds != "joined"):
+                    flight = _Flight()
+                    _inflight_calls[key] = flight
+                    _coalescing_counters["executions"] += 1
+                    break
+                if flight is not None:
+                    flight.waiters += 1
+            if flight is None:
+                admission.claim_slot()
+                continue
+            flight.done.wait()
+            with _inflight_lock:
+                if flight.cancelled:
+                    _coalescing_counters["retried"] += 1
+                    continue
+                _coalescing_counters["coalesced"] += 1
+            if isinstance(flight.error, HTTPException):
+                raise HTTPException(status_code=flight.error.status_code, detail=flight.error.detail) from flight.error
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        except BaseException as e:
+            flight.error = e
+            query_scope = current_query_scope.get()
+            flight.cancelled = query_scope is not None and query_scope.cancelled
+            raise
+        finally:
+            with _inflight_lock:
+                del _inflight_calls[key]
+                shared = flight.waiters > 0  # final: nobody can join once the key is gone
+            if shared and flight.error is None:
+                flight.result = copy.deepcopy(result)
+            flight.done.set()
+    wrapper.coalesces_requests = True
+    return wrapper
+
+def coalescing_stats():
+    with _inflight_lock:
+        return {"inFlight": len(_inflight_calls), **_coalescing_counters}
+
+# Last good results of the read endpoints, served (marked stale) while the database is unavailable
+_stale_cache = OrderedDict()
+_stale_cache_lock = threading.Lock()
+_stale_cache_counters = {"stored": 0, "served": 0, "misses": 0}
+
+def serve_stale_on_outage(func):
+    """
+    Decorator for read endpoints returning a dict. Every successful result is remembered per
+    arguments (least recently used entries beyond STALE_CACHE_SIZE are dropped). When a call fails
+    because the database is unavailable, the remembered result is returned with "stale": true and
+    "staleAgeSeconds"; without one the outage is raised as a 503.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (func.__name__, tuple(sorted((name, repr(value)) for name, value in bound.arguments.items())))
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            outage = database_outage(e)
+            if outage is None:
+                raise
+            with _stale_cache_lock:
+                cached = _stale_cache.get(key)
+                if cached is None:
+                    _stale_cache_counters["misses"] += 1
+                else:
+                    _stale_cache.move_to_end(key)
+                    _stale_cache_counters["served"] += 1
+            if cached is None:
+                raise outage
+            stored_at, result = cached
+            freshness = current_response_freshness.get()
+            if freshness is not None:
+                freshness["stale"] = True
+            return {**result, "stale": True, "staleAgeSeconds": round(time.time() - stored_at, 1)}
+        if isinstance(result, dict):
+            with _stale_cache_lock:
+                _stale_cache[key] = (time.time(), result)
+                _stale_cache.move_to_end(key)
+                _stale_cache_counters["stored"] += 1
+                while len(_stale_cache) > STALE_CACHE_SIZE:
+                    _stale_cache.popitem(last=False)
+        return result
+    return wrapper
+
+def stale_cache_stats():
+    with _stale_cache_lock:
+        return {"entries": len(_stale_cache), "maxEntries": STALE_CACHE_SIZE, **_stale_cache_counters}
+
+@app.on_event("startup")
+def open_db_pool():
+    try:
+        get_db_pool().open()
+        print(f"Database pool ready: {db_pool.stats()}")
+    except Exception as e:
+        # Keep serving; connections will be opened lazily once the database is reachable
+        print(f"Database pool warm-up failed: {e}")
+    if get_replica_pool() is not None:
+        try:
+            db_replica_pool.open()
+            print(f"Replica pool ready: {db_replica_pool.stats()}")
+        except Exception as e:
+            print(f"Replica pool warm-up failed, reads will use the primary: {e}")
+
+@app.on_event("shutdown")
+def close_db_pool():
+    global db_pool, db_replica_pool
+    if db_pool is not None:
+        db_pool.closeall()
+        db_pool = None
+    if db_replica_pool is not None:
+        db_replica_pool.closeall()
+        db_replica_pool = None
+
+# Optional schema features added by api/migrations. They are detected at startup and re-checked in the
+# background at most every SCHEMA_FEATURES_CHECK_INTERVAL seconds, so the same code runs against migrated
+# and unmigrated databases and picks up a migration without a restart.
+schema_features = {"searchDocument": False, "trigram": False, "numericCoverage": False, "rollup": False, "dataVersion": False,
+                   "changeLog": False}
+_schema_features_checked_at = 0.0
+_schema_features_check_lock = threading.Lock()
+
+def probe_schema_features():
+    conn = None
+    try:
+        conn = get_db_connection(read_only=True)
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = 'inventory_management' AND table_name = 'demo_inventory'
+                AND column_name IN ('search_document', 'months_of_coverage')
+        """)
+        columns = {row["column_name"] for row in cursor.fetchall()}
+        cursor.execute("""
+            SELECT
+                EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') AS trigram,
+                to_regclass('inventory_management.demo_inventory_rollup') IS NOT NULL AS rollup,
+                to_regclass('inventory_management.demo_inventory_data_version') IS NOT NULL AS data_version,
+                to_regclass('inventory_management.demo_inventory_changes') IS NOT NULL AS change_log
+        """)
+        row = cursor.fetchone()
+        cursor.close()
+        schema_features.update(searchDocument="search_document" in columns, trigram=row["trigram"],
+                               numericCoverage="months_of_coverage" in columns, rollup=row["rollup"],
+                               dataVersion=row["data_version"], changeLog=row["change_log"])
+    finally:
+        if conn:
+            release_db_connection(conn)
+    return schema_features
+
+def _check_schema_features():
+    try:
+        probe_schema_features()
+    except Exception as e:
+        print(f"Schema feature check failed, keeping {schema_features}: {getattr(e, 'detail', e)}")
+    finally:
+        _schema_features_check_lock.release()
+
+def get_schema_features():
+    """The last detected schema features; re-checked in a background thread once they are too old"""
+    global _schema_features_checked_at
+    now = time.time()
+    if now - _schema_features_checked_at > SCHEMA_FEATURES_CHECK_INTERVAL and _schema_features_check_lock.acquire(blocking=False):
+        _schema_features_checked_at = now
+        threading.Thread(target=_check_schema_features, daemon=True).start()
+    return schema_features
+
+def inventory_search_mode():
+    """'document' (trigram-indexed search_document) or 'columns' (ILIKE on each search column)"""
+    if INVENTORY_SEARCH_MODE == "columns":
+        return "columns"
+    features = get_schema_features()
+    return "document" if features["searchDocument"] and features["trigram"] else "columns"
+
+@app.on_event("startup")
+def detect_schema_features():
+    global _schema_features_checked_at
+    try:
+        print(f"Schema features: {probe_schema_features()}")
+    except Exception as e:
+        print(f"Schema feature check failed, using the base schema: {getattr(e, 'detail', e)}")
+    _schema_features_checked_at = time.time()
+
+# Data version of demo_inventory: a counter bumped by a statement trigger on every change (api/migrations).
+# It is re-read in the background at most every DATA_VERSION_CHECK_INTERVAL seconds, and results derived
+# from the whole table are cached under it until it moves. Without the counter nothing is cached.
+data_version = {"version": None, "changedAt": None}
+_data_version_checked_at = 0.0
+_data_version_check_lock = threading.Lock()
+_data_version_cache = {}  # name -> (version, value)
+_data_version_cache_lock = threading.Lock()
+_data_version_counters = {"hits": 0, "misses": 0, "checkFailures": 0, "notModified": 0}
+
+def read_data_version():
+    conn = None
+    try:
+        conn = get_db_connection(read_only=True)
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        execute_prepared(cursor, "SELECT version, changed_at FROM inventory_management.demo_inventory_data_version")
+        row = cursor.fetchone()
+        cursor.close()
+        data_version.update(version=row["version"], changedAt=row["changed_at"].timestamp())
+    finally:
+        if conn:
+            release_db_connection(conn)
+    return data_version["version"]
+
+def _check_data_version():
+    try:
+        read_data_version()
+    except Exception as e:
+        _data_version_counters["checkFailures"] += 1
+        print(f"Data version check failed, keeping version {data_version['version']}: {getattr(e, 'detail', e)}")
+    finally:
+        _data_version_check_lock.release()
+
+def get_data_version():
+    """The last read data version (None without the counter); re-read in a background thread once it is too old"""
+    global _data_version_checked_at
+    if not get_schema_features()["dataVersion"]:
+        return None
+    now = time.time()
+    if now - _data_version_checked_at > DATA_VERSION_CHECK_INTERVAL and _data_version_check_lock.acquire(blocking=False):
+        _data_version_checked_at = now
+        threading.Thread(target=_check_data_version, daemon=True).start()
+    return data_version["version"]
+
+def cached_for_data_version(name, compute):
+    """
+    compute()'s result, reused (as a copy) while the data version is the one it was computed under.
+    The version is taken before computing, so a change that lands meanwhile only causes a recompute.
+    """
+    version = get_data_version()
+    if version is not None:
+        with _data_version_cache_lock:
+            cached = _data_version_cache.get(name)
+            hit = cached is not None and cached[0] == version
+            _data_version_counters["hits" if hit else "misses"] += 1
+        if hit:
+            return copy.deepcopy(cached[1])
+    value = compute()
+    if version is not None:
+        with _data_version_cache_lock:
+            _data_version_cache[name] = (version, copy.deepcopy(value))
+    return value
+
+@app.on_event("startup")
+def detect_data_version():
+    global _data_version_checked_at
+    if schema_features["dataVersion"]:
+        try:
+            print(f"Data version: {read_data_version()}")
+        except Exception as e:
+            print(f"Data version check failed, caching nothing until it is read: {getattr(e, 'detail', e)}")
+        _data_version_checked_at = time.time()
+
+def data_version_stats():
+    with _data_version_cache_lock:
+        return {**data_version, "cached": sorted(_data_version_cache), **_data_version_counters}
+
+# Columns of demo_inventory copied into the shared snapshot, by storage kind
+SNAPSHOT_STRING_COLUMNS = ["entity", "branch", "partnbr", "mfgname", "mfgpartnbr", "description",
+                           "family", "category", "status", "Network Status"]
+SNAPSHOT_NUMERIC_COLUMNS = ["Inventory Balance", "Sum of Quantity On Hand", "_Average Cost", "Sum of Latest Cost",
+                            "Sum of Quantity On Order", "Sum of T3M Qty Used", "Sum of T6M Qty Used",
+                            "Sum of TTM Qty Used", "Sum of Months of Cover", "Months of Coverage", "Months to Burn"]
+SNAPSHOT_DATETIME_COLUMNS = ["Last Receipt"]
+# Key columns of the snapshot's per-bucket aggregates, in bucket_keys column order; each also gets
+# one row bitmap per distinct value
+BUCKET_KEY_COLUMNS = ["entity", "branch", "status", "Network Status"]
+
+# Set bits per byte value, for counting the rows in a packed bitmap
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+def popcount(bits):
+    return int(POPCOUNT[bits].sum())
+
+# Search index per SEARCH_COLUMNS column, over its distinct values lowercased: "grams" (sorted distinct
+# trigrams) with "offsets" into "postings" (the codes of the values containing each trigram), and
+# "rows"/"starts" listing the rows of each code (rows[starts[code]:starts[code + 1]])
+SEARCH_INDEX_PARTS = ["grams", "offsets", "postings", "rows", "starts"]
+SEARCH_CACHE_SIZE = 64  # search texts whose matching rows each snapshot keeps
+
+def build_search_index(codes, values):
+    gram_list, code_list = [], []
+    for code, value in enumerate(np.char.lower(np.asarray(values, dtype=str)).tolist()):
+        grams = {value[i:i + 3] for i in range(len(value) - 2)}
+        gram_list.extend(grams)
+        code_list.extend([code] * len(grams))
+    grams, gram_of_pair = np.unique(np.array(gram_list, dtype=str), return_inverse=True)
+    gram_of_pair = gram_of_pair.reshape(-1)
+    rows = np.argsort(codes, kind="stable").astype(np.int32)
+    return {
+        "grams": grams,
+        "offsets": np.concatenate([[0], np.cumsum(np.bincount(gram_of_pair, minlength=len(grams)))]).astype(np.int64),
+        "postings": np.asarray(code_list, dtype=np.int32)[np.lexsort((code_list, gram_of_pair))],
+        "rows": rows,
+        "starts": np.searchsorted(codes[rows], np.arange(len(values) + 1)).astype(np.int64),
+    }
+
+def snapshot_sort_key(column):
+    """(key array, NULL mask, kind) of a snapshot column, ordered like the database orders its values"""
+    if isinstance(column, SnapshotStringColumn):
+        return column.codes, column.codes < 0, "string"
+    if column.dtype.kind == "M":
+        return column.view(np.int64), np.isnat(column), "datetime"
+    return np.nan_to_num(column, nan=0.0, posinf=np.inf, neginf=-np.inf), np.isnan(column), "float"
+
+def build_sort_permutation(columns, sort_by):
+    """
+    Every row number in compile_inventory_order(sort_by, "asc", keyset=True) order: the sort column with
+    NULLs last, then entity, branch and partnbr. Read backwards it is the descending order.
+    """
+    key, null, _ = snapshot_sort_key(columns[SORT_FIELD_MAP[sort_by]])
+    return np.lexsort([columns[name].codes for name in reversed(KEYSET_TIEBREAKER)] + [key, null]).astype(np.int32)
+
+SORT_WALK_CHUNK = 4096  # rows of a sort permutation checked against the filter first; doubles until the page is full
+
+def build_value_bitmaps(codes, value_count):
+    """Packed row bitmaps (np.packbits) of a dictionary-encoded column, one per code; NULL rows are in none"""
+    bitmaps = np.zeros((value_count, (len(codes) + 7) // 8), dtype=np.uint8)
+    for code in range(value_count):
+        bitmaps[code] = np.packbits(codes == code)
+    return bitmaps
+
+class SnapshotStringColumn:
+    """Dictionary-encoded text column: sorted distinct values plus one int32 code per row (-1 for NULL)"""
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    def code_of(self, text):
+        """Code of a value, or -2 (matches no row) when the value does not occur"""
+        position = int(np.searchsorted(self.values, text))
+        if position < len(self.values) and self.values[position] == text:
+            return position
+        return -2
+
+    def codes_of(self, texts):
+        """Codes of many values at once: -1 for None, -2 for values that do not occur"""
+        codes = np.full(len(texts), -1, dtype=np.int64)
+        present = np.array([text is not None for text in texts], dtype=bool)
+        lookup = np.array([text for text in texts if text is not None], dtype=str)
+        if not len(self.values):
+            codes[present] = -2
+            return codes
+        positions = np.searchsorted(self.values, lookup)
+        found = self.values[np.minimum(positions, len(self.values) - 1)] == lookup
+        codes[present] = np.where(found, positions, -2)
+        return codes
+
+    def rank_of(self, codes, text):
+        """-1, 0 or 1 per code: its value sorts before, equal to or after text (NULL before everything)"""
+        low = int(np.searchsorted(self.values, text, side="left"))
+        high = int(np.searchsorted(self.values, text, side="right"))
+        return np.where(codes < low, -1, np.where(codes >= high, 1, 0))
+
+    def decode(self, codes):
+        """Values of the given codes as a list, None for NULL"""
+        if not len(self.values):
+            return [None] * len(codes)
+        values = self.values[np.maximum(codes, 0)].tolist()
+        return [value if code >= 0 else None for code, value in zip(codes.tolist(), values)]
+
+class InventorySnapshot:
+    """
+    One read-only snapshot version. Every array is memory-mapped from INVENTORY_SNAPSHOT_DIR, so all
+    worker processes share the same pages instead of each holding a copy.
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+        self.directory = directory
+        self.version = manifest["version"]
+        self.built_at = manifest["builtAt"]
+        self.row_count = manifest["rowCount"]
+        self.source = manifest["source"]
+        self.data_version = manifest.get("dataVersion")  # demo_inventory's data version the rows reflect, if known
+        self.columns = {}
+        for column in manifest["columns"]:
+            if column["kind"] == "string":
+                self.columns[column["name"]] = SnapshotStringColumn(
+                    self._map(column["file"] + ".codes"), self._map(column["file"] + ".values"))
+            else:
+                self.columns[column["name"]] = self._map(column["file"])
+        self.aggregates = {name: self._map("agg." + name) for name in manifest["aggregates"]}
+        self.bitmaps = {bitmap["name"]: self._map(bitmap["file"]) for bitmap in manifest.get("bitmaps", [])}
+        self.sort_permutations = {permutation["field"]: self._map(permutation["file"])
+                                  for permutation in manifest.get("sortPermutations", [])}
+        self.search_indexes = {index["name"]: {part: self._map(f"{index['file']}.{part}") for part in SEARCH_INDEX_PARTS}
+                               for index in manifest.get("searchIndexes", [])}
+        self._derived = {}  # per-process arrays computed on first use, see _derive
+        self._search_cache = OrderedDict()  # search text -> packed bitmap of the matching rows
+        self._search_cache_lock = threading.Lock()
+
+    def _map(self, name):
+        # A plain ndarray view of the mapping: same shared pages, without np.memmap's per-index overhead
+        return np.asarray(np.load(os.path.join(self.directory, name + ".npy"), mmap_mode="r", allow_pickle=False))
+
+    def _derive(self, name, compute):
+        if name not in self._derived:
+            self._derived[name] = compute()
+        return self._derived[name]
+
+    # Listings: the same (totals row, page rows) fetch_inventory_page returns, computed with array masks.
+    # Text sorts follow code point order, where the database follows its collation.
+
+    def _filter_mask(self, inventory_filter, codes):
+        """Rows (or buckets) matching the filter's key columns; codes maps each key column to its codes"""
+        mask = np.ones(len(codes["entity"]), dtype=bool)
+        if inventory_filter.exclude_corporate:
+            mask &= (codes["branch"] >= 0) & (codes["branch"] != self.columns["branch"].code_of("Corporate"))
+        for column, wanted in (("entity", inventory_filter.entities), ("branch", inventory_filter.branches)):
+            if wanted:
+                mask &= np.isin(codes[column], [self.columns[column].code_of(value) for value in wanted])
+        if inventory_filter.filters_status():
+            mask &= codes["status"] == self.columns["status"].code_of(inventory_filter.status)
+        if inventory_filter.network_status:
+            mask &= codes["Network Status"] == self.columns["Network Status"].code_of(inventory_filter.network_status)
+        return mask
+
+    def _search_index(self, name):
+        """The search index of a SEARCH_COLUMNS column (built here for snapshots written without one)"""
+        if name in self.search_indexes:
+            return self.search_indexes[name]
+        column = self.columns[name]
+        return self._derive("search." + name, lambda: build_search_index(column.codes, column.values))
+
+    def _matching_codes(self, name, text):
+        """Codes of the column's values containing text (lowercase): trigram postings intersected, then verified"""
+        lowered = self._derive("lower." + name, lambda: np.char.lower(np.asarray(self.columns[name].values)))
+        if len(text) < 3:
+            return np.flatnonzero(np.char.find(lowered, text) >= 0)
+        index = self._search_index(name)
+        postings = []
+        for gram in {text[i:i + 3] for i in range(len(text) - 2)}:
+            position = int(np.searchsorted(index["grams"], gram))
+            if position == len(index["grams"]) or index["grams"][position] != gram:
+                return np.zeros(0, dtype=np.int64)
+            postings.append(index["postings"][index["offsets"][position]:index["offsets"][position + 1]])
+        postings.sort(key=len)
+        candidates = postings[0]
+        for other in postings[1:]:
+            candidates = np.intersect1d(candidates, other, assume_unique=True)
+        return candidates[np.char.find(lowered[candidates], text) >= 0]
+
+    def _search_bits(self, search):
+        """Packed bitmap of the rows where any SEARCH_COLUMNS value contains the search text, case-insensitively"""
+        text = search.lower()
+        with self._search_cache_lock:
+            if text in self._search_cache:
+                self._search_cache.move_to_end(text)
+                return self._search_cache[text]
+        mask = np.zeros(self.row_count, dtype=bool)
+        for name in SEARCH_COLUMNS:
+            index = self._search_index(name)
+            codes = self._matching_codes(name, text)
+            # Concatenated row ranges of the matching codes
+            starts, lengths = index["starts"][codes], index["starts"][codes + 1] - index["starts"][codes]
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            mask[index["rows"][positions]] = True
+        bits = np.packbits(mask)
+        with self._search_cache_lock:
+            self._search_cache[text] = bits
+            while len(self._search_cache) > SEARCH_CACHE_SIZE:
+                self._search_cache.popitem(last=False)
+        return bits
+
+    # Facets: a packed bitmap per distinct value of each BUCKET_KEY_COLUMNS column (bit i is row i), so any
+    # combination of key filters is an OR/AND over a few bitmaps and every count is a popcount
+
+    def _bitmaps(self, name):
+        """One packed row bitmap per code of a key column (built here for snapshots written without them)"""
+        if name in self.bitmaps:
+            return self.bitmaps[name]
+        column = self.columns[name]
+        return self._derive("bitmaps." + name, lambda: build_value_bitmaps(column.codes, len(column.values)))
+
+    def _any_of(self, name, values):
+        """Packed bitmap of the rows whose column holds any of the values"""
+        bitmaps = self._bitmaps(name)
+        codes = [code for code in (self.columns[name].code_of(value) for value in values) if code >= 0]
+        return np.bitwise_or.reduce(bitmaps[codes], axis=0) if codes else np.zeros(bitmaps.shape[1], dtype=np.uint8)
+
+    def _filter_bits(self, inventory_filter):
+        """Packed bitmap of the rows matching the filter"""
+        bits = self._derive("bits.all", lambda: np.packbits(np.ones(self.row_count, dtype=bool)))
+        if inventory_filter.exclude_corporate:
+            branches = self.columns["branch"].values.tolist()
+            bits = bits & self._derive("bits.noncorporate",
+                                       lambda: self._any_of("branch", [branch for branch in branches if branch != "Corporate"]))
+        for column, wanted in (("entity", inventory_filter.entities), ("branch", inventory_filter.branches)):
+            if wanted:
+                bits = bits & self._any_of(column, wanted)
+        if inventory_filter.filters_status():
+            bits = bits & self._any_of("status", [inventory_filter.status])
+        if inventory_filter.network_status:
+            bits = bits & self._any_of("Network Status", [inventory_filter.network_status])
+        if inventory_filter.search:
+            bits = bits & self._search_bits(inventory_filter.search)
+        return bits
+
+    def _row_mask(self, inventory_filter):
+        return np.unpackbits(self._filter_bits(inventory_filter), count=self.row_count).astype(bool)
+
+    def _row_cogs(self):
+        numbers = self.columns
+        return self._derive("cogs", lambda: np.nan_to_num(
+            (numbers["Sum of Quantity On Hand"] + np.nan_to_num(numbers["Sum of TTM Qty Used"]))
+            * np.nan_to_num(numbers["_Average Cost"])))
+
+    def _facets(self, inventory_filter):
+        """
+        {"count" | "value" | "quantity" | "cogs": {"total" | "excess" | "low" | "dead": figure}, "entity_count",
+        "branch_count"} over the matching rows. Counts are popcounts of the filter's bitmap; sums come from
+        the per-bucket aggregates, or from the matching rows when search text narrows them further.
+        """
+        bits = self._filter_bits(inventory_filter)
+        status_codes = {name: self.columns["status"].code_of(name) for name in ("excess", "low", "dead")}
+        status_bitmaps = self._bitmaps("status")
+        facets = {"count": {"total": popcount(bits)}}
+        for name, code in status_codes.items():
+            facets["count"][name] = popcount(bits & status_bitmaps[code]) if code >= 0 else 0
+        for name in ("entity", "branch"):
+            facets[f"{name}_count"] = int((POPCOUNT[self._bitmaps(name) & bits].sum(axis=1) > 0).sum())
+        if inventory_filter.search:
+            rows = np.flatnonzero(np.unpackbits(bits, count=self.row_count))
+            status = self.columns["status"].codes[rows]
+            measures = {"value": np.nan_to_num(self.columns["Inventory Balance"][rows]),
+                        "quantity": np.nan_to_num(self.columns["Sum of Quantity On Hand"][rows]),
+                        "cogs": self._row_cogs()[rows]}
+        else:
+            keys = self.aggregates["bucket_keys"]
+            mask = self._filter_mask(inventory_filter, {name: keys[:, position] for position, name in enumerate(BUCKET_KEY_COLUMNS)})
+            status = keys[mask, BUCKET_KEY_COLUMNS.index("status")]
+            measures = {"value": self.aggregates["bucket_value"][mask],
+                        "quantity": self.aggregates["bucket_quantity"][mask],
+                        "cogs": self.aggregates["bucket_cogs"][mask]}
+        for measure, values in measures.items():
+            facets[measure] = {"total": float(values.sum())}
+            for name, code in status_codes.items():
+                facets[measure][name] = float(values[status == code].sum())
+        return facets
+
+    def inventory_totals(self, inventory_filter, totals):
+        """The INVENTORY_PAGE_TOTALS figures (plus entity_count and branch_count) over the matching rows, named as in totals"""
+        facets = self._facets(inventory_filter)
+        total = facets["count"]["total"]
+        row = {
+            "total": total,
+            "excess_count": facets["count"]["excess"] if total else None,
+            "low_count": facets["count"]["low"] if total else None,
+            "dead_count": facets["count"]["dead"] if total else None,
+            "total_value": facets["value"]["total"] if total else None,
+            "total_cogs": facets["cogs"]["total"] if total else None,
+            "entity_count": facets["entity_count"],
+            "branch_count": facets["branch_count"],
+        }
+        return {name: row[name] for name in totals}
+
+    def filter_counts(self, inventory_filter, totals):
+        """The FILTER_COUNT_TOTALS figures (plus entity_count and branch_count) over the matching rows, named as in totals"""
+        facets = self._facets(inventory_filter)
+        total = facets["count"]["total"]
+        row = {
+            "total_items": total,
+            "excess_items": facets["count"]["excess"] if total else None,
+            "low_stock_items": facets["count"]["low"] if total else None,
+            "dead_stock_items": facets["count"]["dead"] if total else None,
+            "entity_count": facets["entity_count"],
+            "branch_count": facets["branch_count"],
+        }
+        for measure in ("value", "quantity", "cogs"):
+            for status in ("total", "excess", "low", "dead"):
+                row[f"{status}_{measure}"] = facets[measure][status] if total else None
+        return {name: row[name] for name in totals}
+
+    def _sort_key(self, sort_by):
+        """(key array, NULL mask, kind) of an API sort field's column over all rows"""
+        return snapshot_sort_key(self.columns[SORT_FIELD_MAP[_sort_field(sort_by)]])
+
+    def _sort_permutation(self, sort_by):
+        """The ascending permutation of a sort field (built here for snapshots written without one)"""
+        sort_by = _sort_field(sort_by)
+        if sort_by in self.sort_permutations:
+            return self.sort_permutations[sort_by]
+        return self._derive("sort." + sort_by, lambda: build_sort_permutation(self.columns, sort_by))
+
+    def _sorted(self, mask, sort_by, sort_dir, count=None, skip=0):
+        """
+        Rows the mask keeps, in compile_inventory_order(keyset=True) order: the sort field's permutation,
+        backwards when descending, walked in growing chunks until count rows (all when None) are found.
+        The walk starts past the first skip rows of the permutation in walking order (see _keyset_skip).
+        """
+        permutation = self._sort_permutation(sort_by)
+        descending = _sort_direction(sort_dir) == "DESC"
+        if count is None:
+            rows = permutation[:len(permutation) - skip][::-1] if descending else permutation[skip:]
+            return rows[mask[rows]]
+        found, found_count, walked, chunk = [], 0, skip, SORT_WALK_CHUNK
+        while found_count < count and walked < len(permutation):
+            if descending:
+                rows = permutation[max(len(permutation) - walked - chunk, 0):len(permutation) - walked][::-1]
+            else:
+                rows = permutation[walked:walked + chunk]
+            rows = rows[mask[rows]]
+            found.append(rows)
+            found_count += len(rows)
+            walked += chunk
+            chunk *= 2
+        return np.concatenate(found)[:count] if found else np.zeros(0, dtype=np.int32)
+
+    def _after(self, rows, sort_by, sort_dir, after):
+        """Mask of rows strictly after a keyset cursor position, as _compile_keyset_condition selects them"""
+        key, *tiebreaker = after
+        tie = np.zeros(len(rows), dtype=np.int64)
+        for name, text in reversed(list(zip(KEYSET_TIEBREAKER, tiebreaker))):
+            rank = self.columns[name].rank_of(self.columns[name].codes[rows], text)
+            tie = np.where(rank != 0, rank, tie)
+        values, null, kind = self._sort_key(sort_by)
+        values, null = values[rows], null[rows]
+        descending = _sort_direction(sort_dir) == "DESC"
+        if key is None:
+            return ~null | (tie < 0) if descending else null & (tie > 0)
+        if kind == "string":
+            rank = self.columns[SORT_FIELD_MAP[_sort_field(sort_by)]].rank_of(values, key)
+        else:
+            key = np.datetime64(key, "s").astype(np.int64) if kind == "datetime" else float(key)
+            rank = np.where(values > key, 1, np.where(values < key, -1, 0))
+        if descending:
+            return ~null & ((rank < 0) | ((rank == 0) & (tie < 0)))
+        return null | (rank > 0) | ((rank == 0) & (tie > 0))
+
+    def _keyset_skip(self, sort_by, sort_dir, after):
+        """
+        How many rows of the sort field's permutation, in walking order, come at or before a keyset cursor
+        position: a binary search, since _after holds for a suffix of the walk
+        """
+        permutation = self._sort_permutation(sort_by)
+        descending = _sort_direction(sort_dir) == "DESC"
+        low, high = 0, len(permutation)
+        while low < high:
+            middle = (low + high) // 2
+            row = permutation[len(permutation) - 1 - middle if descending else middle]
+            if self._after(np.array([row]), sort_by, sort_dir, after)[0]:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _rows(self, rows):
+        """demo_inventory rows (dicts keyed like RealDictCursor rows) for the given row numbers"""
+        columns = {name: self.columns[name].decode(self.columns[name].codes[rows]) for name in SNAPSHOT_STRING_COLUMNS}
+        for name in SNAPSHOT_NUMERIC_COLUMNS:
+            columns[name] = [None if value != value else value for value in self.columns[name][rows].tolist()]
+        for name in SNAPSHOT_DATETIME_COLUMNS:
+            columns[name] = self.columns[name][rows].astype("datetime64[us]").tolist()
+        # The numeric form the coverage migration adds, so rows convert without parsing
+        columns["months_of_coverage"] = columns["Months of Coverage"]
+        names = list(columns)
+        return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+    def inventory_page(self, inventory_filter, totals, sort_by, sort_dir, limit, offset, after=None, keyset=False):
+        """(totals row, page rows) as fetch_inventory_page returns them; no relevance ranking"""
+        totals_row = self.inventory_totals(inventory_filter, totals)
+        if not totals_row["total"]:
+            return totals_row, []
+        mask = self._row_mask(inventory_filter)
+        if keyset and after is not None:
+            skip = self._keyset_skip(sort_by, sort_dir, after)
+            rows = self._sorted(mask, sort_by, sort_dir, limit if limit > 0 else None, skip)
+        elif limit > 0:
+            start = 0 if keyset else offset
+            rows = self._sorted(mask, sort_by, sort_dir, start + limit)[start:]
+        else:
+            rows = self._sorted(mask, sort_by, sort_dir)
+        return totals_row, self._rows(rows)
+
+    def overall_metrics(self):
+        """Same figures as the /metrics queries, from the per-bucket aggregates"""
+        keys = self.aggregates["bucket_keys"]
+        counts = self.aggregates["bucket_count"]
+        values = self.aggregates["bucket_value"]
+        status = self.columns["status"]
+        total_value = float(values.sum())
+        hcn_value = float(values[keys[:, 0] == self.columns["entity"].code_of("HCN")].sum())
+        total_cogs = float(self.aggregates["bucket_cogs"].sum())
+        return {
+            "totalSKUs": int(counts.sum()),
+            "excessItems": int(counts[keys[:, 2] == status.code_of("excess")].sum()),
+            "lowStockItems": int(counts[keys[:, 2] == status.code_of("low")].sum()),
+            "deadStockItems": int(counts[keys[:, 2] == status.code_of("dead")].sum()),
+            "totalInventoryValue": total_value,
+            "inventoryTurnover": total_cogs / total_value if total_value > 0 else 0.0,
+            "hcnPercentage": hcn_value / total_value * 100 if total_value > 0 else 0.0
+        }
+
+    def entity_hierarchy(self):
+        """The entity/branch hierarchy with SKU counts, as fetch_entity_hierarchy returns it"""
+        keys = self.aggregates["bucket_keys"]
+        present = (keys[:, 0] >= 0) & (keys[:, 1] >= 0)
+        keys, counts = keys[present], self.aggregates["bucket_count"][present]
+        pairs, pair_of_bucket = np.unique(keys[:, :2], axis=0, return_inverse=True)
+        pair_counts = np.bincount(pair_of_bucket.reshape(-1), weights=counts, minlength=len(pairs)).astype(np.int64)
+        entity_values = self.columns["entity"].values
+        branch_values = self.columns["branch"].values
+        nodes = {}
+        for (entity_code, branch_code), count in zip(pairs.tolist(), pair_counts.tolist()):
+            node = nodes.setdefault(entity_code, {"entity": str(entity_values[entity_code]), "skuCount": 0, "branches": []})
+            node["skuCount"] += count
+            node["branches"].append({"branch": str(branch_values[branch_code]), "skuCount": count})
+        branch_counts = np.bincount(keys[:, 1], weights=counts, minlength=len(branch_values)).astype(np.int64)
+        return {
+            "entities": list(nodes.values()),
+            "branches": [{"branch": str(branch_values[code]), "skuCount": int(branch_counts[code])}
+                         for code in np.flatnonzero(branch_counts)],
+        }
+
+    def part_branch_summary(self):
+        """{mfgpartnbr: [branches]} as returned by /part-branch-summary"""
+        pairs = self.aggregates["part_branches"]
+        parts = self.columns["mfgpartnbr"].values[pairs[:, 0]].tolist()
+        branches = self.columns["branch"].values[pairs[:, 1]].tolist()
+        part_branch_map = {}
+        for part_number, branch in zip(parts, branches):
+            part_branch_map.setdefault(part_number, []).append(branch)
+        return part_branch_map
+
+    def frame(self, without_keys=()):
+        """
+        The snapshot's rows as a build takes them (text, parsed numbers and dates), leaving out the rows whose
+        (entity, branch, partnbr) is in without_keys; a delta build appends the changed rows to this
+        """
+        keep = np.ones(self.row_count, dtype=bool)
+        if len(without_keys):
+            key_columns = [self.columns[name] for name in KEYSET_TIEBREAKER]
+            # One int64 per key: the codes (shifted past NULL) in mixed radix
+            row_keys = np.zeros(self.row_count, dtype=np.int64)
+            dropped_keys = np.zeros(len(without_keys), dtype=np.int64)
+            occurs = np.ones(len(without_keys), dtype=bool)
+            for position, column in enumerate(key_columns):
+                codes = column.codes_of([key[position] for key in without_keys])
+                occurs &= codes != -2
+                row_keys = row_keys * (len(column.values) + 1) + column.codes + 1
+                dropped_keys = dropped_keys * (len(column.values) + 1) + codes + 1
+            keep = ~np.isin(row_keys, dropped_keys[occurs])
+        frame = {}
+        for name in SNAPSHOT_STRING_COLUMNS:
+            column = self.columns[name]
+            codes = column.codes[keep]
+            values = column.values.astype(object)[np.maximum(codes, 0)] if len(column.values) else None
+            frame[name] = np.where(codes >= 0, values, None)
+        for name in SNAPSHOT_NUMERIC_COLUMNS + SNAPSHOT_DATETIME_COLUMNS:
+            frame[name] = self.columns[name][keep]
+        return pd.DataFrame(frame)
+
+def _copy_inventory_rows(cursor, where=""):
+    """demo_inventory rows as a DataFrame of text columns; NULL and '' become NaN"""
+    columns = SNAPSHOT_STRING_COLUMNS + SNAPSHOT_NUMERIC_COLUMNS + SNAPSHOT_DATETIME_COLUMNS
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    buffer = io.StringIO()
+    cursor.copy_expert(
+        f"COPY (SELECT {column_list} FROM inventory_management.demo_inventory {where}) TO STDOUT WITH (FORMAT csv, HEADER true)",
+        buffer)
+    buffer.seek(0)
+    return pd.read_csv(buffer, dtype=str, keep_default_na=False, na_values=[""])
+
+def _read_inventory_source(base=None):
+    """
+    (frame, data version, changed keys) for a build: demo_inventory (or the CSV it is loaded from) as a DataFrame.
+    Given the current snapshot as base and the change log (migration 0008), only the rows whose keys changed since
+    base's data version are copied and patched into base's rows, and changed keys is their count (None for a full
+    read). The version, the log and the rows are read in one REPEATABLE READ transaction, so they agree, also on a
+    replica. frame is None when the data has not moved since base.
+    """
+    if INVENTORY_SNAPSHOT_SOURCE == "csv":
+        columns = SNAPSHOT_STRING_COLUMNS + SNAPSHOT_NUMERIC_COLUMNS + SNAPSHOT_DATETIME_COLUMNS
+        return pd.read_csv(INVENTORY_CSV_PATH, usecols=columns, dtype=str, keep_default_na=False, na_values=[""]), None, None
+    features = get_schema_features()
+    conn = None
+    try:
+        conn = get_db_connection(read_only=True)
+        cursor = conn.cursor()
+        version = changes_since = None
+        if features["dataVersion"]:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cursor.execute("SELECT version, {} FROM inventory_management.demo_inventory_data_version".format(
+                "changes_since" if features["changeLog"] else "NULL"))
+            version, changes_since = cursor.fetchone()
+        if (base is not None and base.source == "database" and base.data_version is not None and version is not None
+                and changes_since is not None and changes_since <= base.data_version <= version):
+            if base.data_version == version:
+                return None, version, 0
+            cursor.execute("""
+                SELECT DISTINCT truncated, entity, branch, partnbr FROM inventory_management.demo_inventory_changes
+                WHERE version > %s AND version <= %s
+                LIMIT %s
+            """, (base.data_version, version, INVENTORY_SNAPSHOT_MAX_DELTA_KEYS + 1))
+            changes = cursor.fetchall()
+            # A TRUNCATE, too many keys or a NULL key part (the IN below cannot match it) reload the table
+            if len(changes) <= INVENTORY_SNAPSHOT_MAX_DELTA_KEYS and not any(
+                    truncated or None in key for truncated, *key in changes):
+                keys = [tuple(key) for _, *key in changes]
+                changed = _copy_inventory_rows(cursor, """
+                    WHERE (entity, branch, partnbr) IN (
+                        SELECT entity, branch, partnbr FROM inventory_management.demo_inventory_changes
+                        WHERE version > {} AND version <= {})
+                """.format(int(base.data_version), int(version)))
+                for name in SNAPSHOT_NUMERIC_COLUMNS:
+                    changed[name] = pd.to_numeric(changed[name], errors="coerce")
+                for name in SNAPSHOT_DATETIME_COLUMNS:
+                    changed[name] = pd.to_datetime(changed[name], errors="coerce", format="mixed")
+                cursor.close()
+                return pd.concat([base.frame(without_keys=keys), changed], ignore_index=True), version, len(keys)
+        frame = _copy_inventory_rows(cursor)
+        cursor.close()
+        return frame, version, None
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def _build_inventory_snapshot(directory, version, frame, data_version=None):
+    """Writes one snapshot version of frame's rows (columns, aggregates and manifest) as .npy files into directory"""
+    if os.path.exists(directory):
+        shutil.rmtree(directory)  # left behind by a build that did not finish
+    os.makedirs(directory)
+
+    def save(name, array):
+        np.save(os.path.join(directory, name + ".npy"), array, allow_pickle=False)
+
+    manifest_columns = []
+    codes = {}
+    distinct_values = {}
+    for position, name in enumerate(SNAPSHOT_STRING_COLUMNS):
+        present = frame[name].notna().to_numpy()
+        values, inverse = np.unique(frame[name][present].to_numpy(dtype=str), return_inverse=True)
+        codes[name] = np.full(len(frame), -1, dtype=np.int32)
+        codes[name][present] = inverse
+        distinct_values[name] = values
+        file = f"s{position:02d}"
+        save(file + ".codes", codes[name])
+        save(file + ".values", values.astype(str))
+        manifest_columns.append({"name": name, "kind": "string", "file": file})
+    numbers = {}
+    for position, name in enumerate(SNAPSHOT_NUMERIC_COLUMNS):
+        numbers[name] = pd.to_numeric(frame[name], errors="coerce").to_numpy(dtype=np.float64)
+        file = f"n{position:02d}"
+        save(file, numbers[name])
+        manifest_columns.append({"name": name, "kind": "float", "file": file})
+    datetimes = {}
+    for position, name in enumerate(SNAPSHOT_DATETIME_COLUMNS):
+        datetimes[name] = pd.to_datetime(frame[name], errors="coerce", format="mixed").to_numpy(dtype="datetime64[s]")
+        file = f"d{position:02d}"
+        save(file, datetimes[name])
+        manifest_columns.append({"name": name, "kind": "datetime", "file": file})
+
+    # Per (entity, branch, status, network status) bucket: SKU count, inventory value and COGS
+    bucket_keys, bucket_of_row = np.unique(
+        np.stack([codes[name] for name in BUCKET_KEY_COLUMNS], axis=1),
+        axis=0, return_inverse=True)
+    bucket_of_row = bucket_of_row.reshape(-1)
+    cogs = ((numbers["Sum of Quantity On Hand"] + np.nan_to_num(numbers["Sum of TTM Qty Used"]))
+            * np.nan_to_num(numbers["_Average Cost"]))
+    aggregates = {
+        "bucket_keys": bucket_keys.astype(np.int32),
+        "bucket_count": np.bincount(bucket_of_row, minlength=len(bucket_keys)).astype(np.int64),
+        "bucket_value": np.bincount(bucket_of_row, weights=np.nan_to_num(numbers["Inventory Balance"]),
+                                    minlength=len(bucket_keys)),
+        "bucket_quantity": np.bincount(bucket_of_row, weights=np.nan_to_num(numbers["Sum of Quantity On Hand"]),
+                                       minlength=len(bucket_keys)),
+        "bucket_cogs": np.bincount(bucket_of_row, weights=np.nan_to_num(cogs), minlength=len(bucket_keys)),
+        # Distinct (mfgpartnbr, branch) pairs, sorted, for /part-branch-summary
+        "part_branches": np.unique(
+            np.stack([codes["mfgpartnbr"], codes["branch"]], axis=1)[(codes["mfgpartnbr"] >= 0) & (codes["branch"] >= 0)],
+            axis=0).reshape(-1, 2).astype(np.int32),
+    }
+    for name, array in aggregates.items():
+        save("agg." + name, array)
+    manifest_bitmaps = []
+    for position, name in enumerate(BUCKET_KEY_COLUMNS):
+        save(f"b{position:02d}", build_value_bitmaps(codes[name], len(distinct_values[name])))
+        manifest_bitmaps.append({"name": name, "file": f"b{position:02d}"})
+    # Sort permutations, over the columns as the snapshot will map them
+    sort_columns = {**numbers, **datetimes,
+                    **{name: SnapshotStringColumn(codes[name], distinct_values[name]) for name in codes}}
+    manifest_sort_permutations = []
+    for position, sort_by in enumerate(SORT_FIELD_MAP):
+        save(f"p{position:02d}", build_sort_permutation(sort_columns, sort_by))
+        manifest_sort_permutations.append({"field": sort_by, "file": f"p{position:02d}"})
+    manifest_search_indexes = []
+    for position, name in enumerate(SEARCH_COLUMNS):
+        file = f"t{position:02d}"
+        for part, array in build_search_index(codes[name], distinct_values[name]).items():
+            save(f"{file}.{part}", array)
+        manifest_search_indexes.append({"name": name, "file": file})
+
+    manifest = {
+        "version": version,
+        "builtAt": time.time(),
+        "rowCount": len(frame),
+        "source": INVENTORY_SNAPSHOT_SOURCE,
+        "dataVersion": data_version,
+        "columns": manifest_columns,
+        "aggregates": list(aggregates),
+        "bitmaps": manifest_bitmaps,
+        "sortPermutations": manifest_sort_permutations,
+        "searchIndexes": manifest_search_indexes,
+    }
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+inventory_snapshot = None
+_inventory_snapshot_check_lock = threading.Lock()
+_inventory_snapshot_checked_at = 0.0
+_inventory_snapshot_counters = {"builds": 0, "deltaBuilds": 0, "deltaKeys": 0, "loads": 0, "failures": 0}
+
+def _read_snapshot_pointer():
+    """The current.json pointer ({version, directory, builtAt}) shared by all workers, or None"""
+    try:
+        with open(os.path.join(INVENTORY_SNAPSHOT_DIR, "current.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _load_current_snapshot():
+    """Maps the version current.json points at, unless this worker already has it"""
+    global inventory_snapshot
+    pointer = _read_snapshot_pointer()
+    if pointer is not None and (inventory_snapshot is None or inventory_snapshot.version != pointer["version"]):
+        inventory_snapshot = InventorySnapshot(os.path.join(INVENTORY_SNAPSHOT_DIR, pointer["directory"]))
+        _inventory_snapshot_counters["loads"] += 1
+
+def _snapshot_follows_data_version():
+    """Database snapshots track demo_inventory's data version once migration 0007 is in"""
+    return INVENTORY_SNAPSHOT_SOURCE == "database" and get_schema_features()["dataVersion"]
+
+def refresh_inventory_snapshot(wait=True):
+    """
+    Builds a new snapshot version when none exists or the current one is out of date, then maps the current
+    version. A database snapshot with a data version is out of date once the version moves, and the new one
+    copies only the changed rows when the change log allows; otherwise snapshots are rebuilt in full after
+    INVENTORY_SNAPSHOT_MAX_AGE. Builds run under an exclusive file lock, so however many workers start
+    or go stale together only one of them queries the database; with wait=False a worker that finds
+    the lock taken keeps its current snapshot instead of waiting.
+    """
+    os.makedirs(INVENTORY_SNAPSHOT_DIR, exist_ok=True)
+    with open(os.path.join(INVENTORY_SNAPSHOT_DIR, "build.lock"), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return inventory_snapshot
+        try:
+            pointer = _read_snapshot_pointer()
+            if pointer is None:
+                stale = True
+            elif _snapshot_follows_data_version() and pointer.get("dataVersion") is not None:
+                current_data_version = get_data_version()
+                stale = current_data_version is not None and current_data_version != pointer["dataVersion"]
+            else:
+                stale = time.time() - pointer["builtAt"] > INVENTORY_SNAPSHOT_MAX_AGE
+            if stale:
+                _load_current_snapshot()
+                frame, data_version, changed_keys = _read_inventory_source(base=inventory_snapshot)
+                if frame is None:
+                    stale = False  # a lagging replica has not seen the new version yet
+            if stale:
+                version = (pointer["version"] if pointer else 0) + 1
+                directory_name = f"v{version:06d}"
+                manifest = _build_inventory_snapshot(
+                    os.path.join(INVENTORY_SNAPSHOT_DIR, directory_name), version, frame, data_version)
+                pointer_path = os.path.join(INVENTORY_SNAPSHOT_DIR, "current.json")
+                with open(pointer_path + ".tmp", "w") as f:
+                    json.dump({"version": version, "directory": directory_name, "builtAt": manifest["builtAt"],
+                               "dataVersion": data_version}, f)
+                os.replace(pointer_path + ".tmp", pointer_path)
+                _inventory_snapshot_counters["builds"] += 1
+                if changed_keys is not None:
+                    _inventory_snapshot_counters["deltaBuilds"] += 1
+                    _inventory_snapshot_counters["deltaKeys"] += changed_keys
+                # Older versions can go: workers still mapping them keep their pages until they switch
+                for entry in os.listdir(INVENTORY_SNAPSHOT_DIR):
+                    if entry.startswith("v") and entry != directory_name:
+                        shutil.rmtree(os.path.join(INVENTORY_SNAPSHOT_DIR, entry), ignore_errors=True)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    _load_current_snapshot()
+    return inventory_snapshot
+
+def _check_inventory_snapshot():
+    try:
+        refresh_inventory_snapshot(wait=False)
+    except Exception as e:
+        _inventory_snapshot_counters["failures"] += 1
+        print(f"Inventory snapshot refresh failed, keeping version {getattr(inventory_snapshot, 'version', None)}: {e}")
+    finally:
+        _inventory_snapshot_check_lock.release()
+
+def get_inventory_snapshot():
+    """
+    This worker's snapshot, or None when INVENTORY_SNAPSHOT is off or no snapshot could be built
+    (callers then query the database). At most every INVENTORY_SNAPSHOT_CHECK_INTERVAL seconds a
+    background thread picks up a version built by another worker or rebuilds an out-of-date one.
+    """
+    global _inventory_snapshot_checked_at
+    if not INVENTORY_SNAPSHOT:
+        return None
+    now = time.time()
+    if now - _inventory_snapshot_checked_at > INVENTORY_SNAPSHOT_CHECK_INTERVAL and _inventory_snapshot_check_lock.acquire(blocking=False):
+        _inventory_snapshot_checked_at = now
+        threading.Thread(target=_check_inventory_snapshot, daemon=True).start()
+    return inventory_snapshot
+
+def inventory_snapshot_stats():
+    snapshot = inventory_snapshot
+    return {
+        "enabled": INVENTORY_SNAPSHOT,
+        "pid": os.getpid(),
+        "directory": INVENTORY_SNAPSHOT_DIR,
+        "version": snapshot.version if snapshot else None,
+        "builtAt": snapshot.built_at if snapshot else None,
+        "rows": snapshot.row_count if snapshot else None,
+        "source": snapshot.source if snapshot else None,
+        "dataVersion": snapshot.data_version if snapshot else None,
+        **_inventory_snapshot_counters
+    }
+
+@app.on_event("startup")
+def open_inventory_snapshot():
+    global _inventory_snapshot_checked_at
+    if INVENTORY_SNAPSHOT:
+        try:
+            refresh_inventory_snapshot()
+            print(f"Inventory snapshot ready: {inventory_snapshot_stats()}")
+        except Exception as e:
+            _inventory_snapshot_counters["failures"] += 1
+            print(f"Inventory snapshot unavailable, serving from the database: {getattr(e, 'detail', e)}")
+        _inventory_snapshot_checked_at = time.time()
+
+# Pool and runtime statistics for monitoring
+@app.get("/stats")
+def get_stats():
+    return {
+        "pool": get_db_pool().stats(),
+        "replicaPool": get_replica_pool().stats() if get_replica_pool() is not None else None,
+        "routing": data_source_router.stats(),
+        "dbExecutor": db_executor_stats(),
+        "preparedStatements": prepared_statement_stats(),
+        "queryCancellation": query_cancellation_stats(),
+        "inventorySnapshot": inventory_snapshot_stats(),
+        "admission": admission_stats(),
+        "coalescing": coalescing_stats(),
+        "databaseBreaker": database_breaker.stats(),
+        "staleCache": stale_cache_stats(),
+        "dataVersion": data_version_stats(),
+        "schemaFeatures": {**schema_features, "searchMode": inventory_search_mode()}
+    }
+
+# Readiness state, filled in by the startup warm-up
+app_state = {
+    "startedAt": time.time(),
+    "startupComplete": False,
+    "warmup": {},
+}
+
+def database_health():
+    """
+    Database reachability from the pool's in-memory state. Only when no traffic has touched the
+    database for HEALTH_PING_INTERVAL seconds is a pooled connection pinged (never a new one per probe).
+    """
+    pool = get_db_pool()
+    health = pool.health()
+    last_success = health["lastSuccessAt"]
+    if last_success is None or time.time() - last_success > HEALTH_PING_INTERVAL:
+        pool.ping()
+        health = pool.health()
+    return health
+
+@app.on_event("startup")
+def warm_up():
+    """
+    Runs the dashboard's first requests once so the pool, the database buffer cache and the
+    prepared statements are hot before the instance reports ready.
+    """
+    if STARTUP_WARMUP:
+        warmup_calls = [
+            ("/metrics/all/complete", get_all_complete_metrics),
+            ("/entities", get_entities),
+            ("/filtercounts/all", get_all_filter_counts),
+            ("/inventory", get_inventory),
+        ]
+        for route, func in warmup_calls:
+            start_time = time.time()
+            try:
+                func()
+                app_state["warmup"][route] = f"{time.time() - start_time:.3f}s"
+            except Exception as e:
+                app_state["warmup"][route] = f"failed: {getattr(e, 'detail', e)}"
+        print(f"Startup warm-up finished: {app_state['warmup']}")
+    app_state["startupComplete"] = True
+
+# Liveness: the process is up and serving requests
+@app.get("/health/live")
+def liveness_check():
+    return {"status": "alive", "uptimeSeconds": round(time.time() - app_state["startedAt"], 1)}
+
+# Readiness: warm-up finished and the database is reachable
+@app.get("/health/ready")
+def readiness_check():
+    database = database_health()
+    ready = app_state["startupComplete"] and database["healthy"]
+    content = {
+        "status": "ready" if ready else "not ready",
+        "startupComplete": app_state["startupComplete"],
+        "database": database,
+        "warmup": app_state["warmup"],
+    }
+    return CustomJSONResponse(status_code=200 if ready else 503, content=content)
+
+# Health check endpoint
+@app.get("/health")
+def health_check():
+    """Health check endpoint for Docker healthcheck"""
+    database = database_health()
+    if database["healthy"]:
+        return {"status": "healthy", "database": "connected"}
+    return {"status": "unhealthy", "error": database["lastError"]}
+
+# Get all inventory items with pagination, sorting and filtering
+@app.get("/inventory", response_model=Dict[str, Any])
+@serve_stale_on_outage
+@coalesce_requests
+def get_inventory(
+    limit: int = 20,
+    offset: int = 0,
+    search: str = None,
+    branch: str = None,
+    entity: str = None,
+    status: str = None,
+    network_status: str = None,
+    sort_by: str = "mfgPartNumber",
+    sort_dir: str = "asc",
+    page_cursor: Annotated[Optional[str], Query(alias="cursor")] = None
+):
+    """
+    Get all inventory items with efficient pagination, filtering, and sorting
+    - limit: Number of items to return (default 20, 0 for all items)
+    - offset: Pagination offset (starting position)
+    - search: Search text to filter items
+    - branch: Filter by branch
+    - entity: Filter by entity (optional)
+    - status: Filter by status (excess, low, dead)
+    - network_status: Filter by network status (optional)
+    - sort_by: Field to sort by (mfgPartNumber, inventoryBalance, partNumber, etc.; relevance ranks search results)
+    - sort_dir: Sort direction (asc or desc)
+    - cursor: Keyset pagination instead of offset; pass an empty cursor for the first page,
+      then the returned nextCursor (null on the last page)
+    """
+    import time
+    start_time = time.time()
+    # Cursor mode: decode the position before touching the database
+    keyset = page_cursor is not None
+    keyset_after = None
+    if keyset:
+        offset, keyset_after = decode_inventory_cursor(page_cursor, sort_by, sort_dir)
+    conn = None
+    cursor = None
+    try:
+        # Build the filter
+        inventory_filter = InventoryFilter(
+            entities=[entity] if entity else [],
+            branches=[branch] if branch else [],
+            status=status,
+            network_status=network_status,
+            search=search,
+            exclude_corporate=True
+        )
+        
+        # Served from the shared snapshot when listings are enabled for it
+        snapshot = inventory_listing_snapshot(inventory_filter, sort_by)
+        if snapshot is None:
+            conn = get_db_connection(read_only=True)
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # Get the page and the totals/metrics (for pagination)
+        count_data, rows = fetch_inventory_page(
+            cursor, inventory_filter,
+            {**INVENTORY_PAGE_TOTALS, "entity_count": "COUNT(DISTINCT entity)", "branch_count": "COUNT(DISTINCT branch)"},
+            sort_by, sort_dir, limit, offset, keyset_after, keyset, snapshot
+        )
+        total_count = count_data["total"]
+        
+        if total_count == 0:
+            # No results found
+            return {
+                "items": [],
+                "totalCount": 0,
+                "limit": limit,
+                "offset": offset,
+                "hasMore": False,
+                "metrics": {
+                    "totalSKUs": 0,
+                    "excessItems": 0,
+                    "lowStockItems": 0,
+                    "deadStockItems": 0,
+                    "totalInventoryValue": 0,
+                    "entityCount": 0,
+                    "branchCount": 0
+                }
+            }
+        
+        # Convert to API format with efficient batch processing
+        result = convert_db_rows_to_api_format(rows, offset)
+        
+        # Calculate metrics from the count query results
+        metrics = {
+            "totalSKUs": safe_convert(count_data["total"], int),
+            "excessItems": safe_convert(count_data["excess_count"], int),
+            "lowStockItems": safe_convert(count_data["low_count"], int),
+            "deadStockItems": safe_convert(count_data["dead_count"], int),
+            "totalInventoryValue": safe_convert(count_data["total_value"], float),
+            "entityCount": safe_convert(count_data["entity_count"], int),
+            "branchCount": safe_convert(count_data["branch_count"], int)
+        }
+        
+        # Calculate inventory turnover only for overall metrics
+        # Skip for filtered results to save processing time
+        inventory_turns = 0.0
+        if not entity and not branch and not status and not search:
+            # Calculate for all entities (including HCN)
+            if network_status:
+                turns_row = fetch_inventory_totals(cursor, InventoryFilter(exclude_corporate=True), INVENTORY_PAGE_TOTALS, snapshot)
+            else:
+                turns_row = count_data  # the totals already cover exactly these rows
+            
+            if turns_row and turns_row["total_value"] and turns_row["total_value"] > 0:
+                inventory_turns = turns_row["total_cogs"] / turns_row["total_value"]
+                
+            print(f"Overall Inventory Turns: {inventory_turns}")
+        
+        metrics["inventoryTurnover"] = safe_convert(inventory_turns, float)
+        
+        if cursor:
+            cursor.close()
+        
+        total_time = time.time() - start_time
+        print(f"Total API processing time: {total_time:.3f} seconds")
+        
+        # Return with pagination metadata and metrics
+        response = {
+            "items": result,
+            "totalCount": total_count,
+            "limit": limit,
+            "offset": offset,
+            "hasMore": offset + len(result) < total_count,
+            "metrics": metrics,
+            "executionTime": f"{total_time:.3f}s"
+        }
+        if keyset:
+            # Cursor for the row after this page (None on the last page)
+            response["nextCursor"] = encode_inventory_cursor(sort_by, sort_dir, offset + len(rows), rows[-1]) if response["hasMore"] and rows else None
+        return response
+    except Exception as e:
+        print(f"Error reading inventory data: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error reading inventory data: {str(e)}")
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+# Get metrics for advanced filters (multiple entities and branches)
+@app.get("/metrics/advanced")
+@serve_stale_on_outage
+@coalesce_requests
+def get_advanced_metrics(
+    entities: str = None,
+    branches: str = None,
+    status_filter: str = None # Renamed for clarity and to avoid conflict with 'status' column
+):
+    """
+    Get consolidated metrics and summaries across multiple entities and branches
+    - entities: Comma-separated list of entity names
+    - branches: Comma-separated list of branch names
+    - status_filter: Optional filter by inventory status (excess, low, dead, overview)
+    """
+    import time
+    start_time = time.time()
+    conn = None
+    try:
+        entity_list = entities.split(',') if entities else []
+        branch_list = branches.split(',') if branches else []
+        
+        print(f"Advanced metrics/summaries request: entities={entity_list}, branches={branch_list}, status_filter={status_filter}")
+        
+        conn = get_db_connection(read_only=True)
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # Main query for metrics, summaries, and turnover components
+        # This query tries to get everything in one go for the given filters
+        aggregates = {
+            "total_skus": "COALESCE(SUM({skus}), 0)",
+            "excess_items": status_total("excess", "skus"),
+            "low_stock_items": status_total("low", "skus"),
+            "dead_stock_items": status_total("dead", "skus"),
+            "overview_total_value": "SUM({value})",
+            "overview_total_quantity": "SUM({quantity})",
+            "overview_total_cogs": "SUM({cogs})",
+        }
+        for status_name in ("excess", "low", "dead"):
+            for measure in ("value", "quantity", "cogs"):
+                aggregates[f"{status_name}_total_{measure}"] = status_total(status_name, measure)
+        query, params = compile_inventory_totals(
+            InventoryFilter(entities=entity_list, branches=branch_list, status=status_filter), aggregates)
+        
+        print(f"Executing combined metrics/summaries query with params: {params}")
+        execute_prepared(cursor, query, params)
+        data = cursor.fetchone()
+
+        # Get actual entity and branch counts separately, applying the same filters
+        # This is because COUNT(DISTINCT) on the main query would be for the whole filtered set,
+        # not necessarily reflecting the input if some entities/branches had no matching items.
+        # For the purpose of displaying selected criteria, it's often better to echo back what was asked for,
+        # or list what *actually* had results. Let's get what *actually* had results.
+        # No status filter for distinct entity/branch list usually
+        count_query, count_query_params = compile_inventory_totals(
+            InventoryFilter(entities=entity_list, branches=branch_list),
+            {"actual_entities": "array_agg(DISTINCT entity)", "actual_branches": "array_agg(DISTINCT branch)"})
+        execute_prepared(cursor, count_query, count_query_params)
+        count_data = cursor.fetchone()
+        
+        actual_entities = count_data.get("actual_entities", []) if count_data else []
+        actual_branches = count_data.get("actual_branches", []) if count_data else []
+
+
+        def calculate_turnover(cogs, value):
+            if value and value > 0 and cogs is not None:
+                return safe_convert(cogs / value, float)
+            return 0.0
+
+        summaries = {
+            "overview": {
+                "totalValue": safe_convert(data.get("overview_total_value"), float),
+                "totalQuantity": safe_convert(data.get("overview_total_quantity"), int),
+                "inventoryTurnover": calculate_turnover(data.get("overview_total_cogs"), data.get("overview_total_value")),
+                "entityCount": len(actual_entities), # Should reflect entities in the result
+                "branchCount": len(actual_branches)  # Should reflect branches in the result
+            },
+            "excess": {
+                "totalValue": safe_convert(data.get("excess_total_value"), float),
+                "totalQuantity": safe_convert(data.get("excess_total_quantity"), int),
+                "inventoryTurnover": calculate_turnover(data.get("excess_total_cogs"), data.get("excess_total_value")),
+                "entityCount": len(actual_entities),
+                "branchCount": len(actual_branches)
+            },
             "lowStock": {
                 "totalValue": safe_convert(data.get("low_total_value"), float),
                 "totalQuantity": safe_convert(data.get("low_total_quantity"), int),
@@ -791,67 +3273,49 @@ def get_advanced_metrics(
         raise HTTPException(status_code=500, detail=f"Error calculating advanced metrics/summaries: {str(e)}")
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 # Get overall metrics
 @app.get("/metrics")
+@serve_stale_on_outage
+@coalesce_requests
 def get_metrics():
     conn = None
     try:
-        conn = get_db_connection()
+        # Served from the shared snapshot when one is loaded
+        snapshot = get_inventory_snapshot()
+        if snapshot is not None:
+            return snapshot.overall_metrics()
+
+        conn = get_db_connection(read_only=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        # Query metrics directly from database
-        cursor.execute("""
-            SELECT 
-                COUNT(*) AS total_skus,
-                SUM(CASE WHEN status = 'excess' THEN 1 ELSE 0 END) AS excess_items,
-                SUM(CASE WHEN status = 'low' THEN 1 ELSE 0 END) AS low_stock_items,
-                SUM(CASE WHEN status = 'dead' THEN 1 ELSE 0 END) AS dead_stock_items,
-                SUM("Inventory Balance") AS total_inventory_value
-            FROM inventory_management.demo_inventory
-        """)
-        
-        row = cursor.fetchone()
-        
-        # Calculate inventory turnover rate - including all entities
+        # Counts, value, COGS and the HCN share in one aggregate
         # COGS = (Quantity On Hand + TTM Qty Used) * Average Cost
         # Inventory Turns = COGS / Inventory Balance
-        cursor.execute("""
-            SELECT 
-                SUM("Inventory Balance") AS total_inventory_value,
-                SUM(("Sum of Quantity On Hand" + COALESCE("Sum of TTM Qty Used", 0)) * COALESCE("_Average Cost", 0)) AS total_cogs
-            FROM inventory_management.demo_inventory
-        """)
+        query, params = compile_inventory_totals(InventoryFilter(), {
+            "total_skus": "COALESCE(SUM({skus}), 0)",
+            "excess_items": status_total("excess", "skus"),
+            "low_stock_items": status_total("low", "skus"),
+            "dead_stock_items": status_total("dead", "skus"),
+            "total_inventory_value": "SUM({value})",
+            "total_cogs": "SUM({cogs})",
+            "hcn_value": "SUM(CASE WHEN entity = 'HCN' THEN {value} ELSE 0 END)",
+        })
+        execute_prepared(cursor, query, params)
         
-        turns_row = cursor.fetchone()
+        row = cursor.fetchone()
         inventory_turns = 0.0
+        hcn_percentage = 0.0
         
-        if turns_row and turns_row["total_inventory_value"] and turns_row["total_inventory_value"] > 0:
-            inventory_turns = turns_row["total_cogs"] / turns_row["total_inventory_value"]
+        if row and row["total_inventory_value"] and row["total_inventory_value"] > 0:
+            inventory_turns = row["total_cogs"] / row["total_inventory_value"]
+            hcn_percentage = (row["hcn_value"] / row["total_inventory_value"]) * 100
             
         # Print for debugging
         print(f"Inventory Turns: {inventory_turns}")
-        print(f"Total COGS: {turns_row['total_cogs'] if turns_row else 'N/A'}")
-        print(f"Total Inventory Value: {turns_row['total_inventory_value'] if turns_row else 'N/A'}")
-        
-        # Don't force a fake value, just ensure it's not None
-        if inventory_turns is None:
-            inventory_turns = 0
-        
-        # Get HCN percentage for reference
-        cursor.execute("""
-            SELECT 
-                SUM(CASE WHEN entity = 'HCN' THEN "Inventory Balance" ELSE 0 END) AS hcn_value,
-                SUM("Inventory Balance") AS total_value
-            FROM inventory_management.demo_inventory
-        """)
-        
-        value_row = cursor.fetchone()
-        hcn_percentage = 0.0
-        
-        if value_row and value_row["total_value"] and value_row["total_value"] > 0:
-            hcn_percentage = (value_row["hcn_value"] / value_row["total_value"]) * 100
+        print(f"Total COGS: {row['total_cogs'] if row else 'N/A'}")
+        print(f"Total Inventory Value: {row['total_inventory_value'] if row else 'N/A'}")
             
         cursor.close()
         
@@ -880,184 +3344,134 @@ def get_metrics():
         raise HTTPException(status_code=500, detail=f"Error calculating metrics: {str(e)}")
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
+
+def fetch_entity_hierarchy(cursor):
+    """
+    {"entities": [{"entity", "skuCount", "branches": [{"branch", "skuCount"}]}], "branches": [{"branch", "skuCount"}]}
+    over all of demo_inventory, in database sort order, from one GROUPING SETS query
+    """
+    query, params = compile_inventory_totals(InventoryFilter(), {"sku_count": "SUM({skus})"},
+                                             grouping_sets=[("entity",), ("entity", "branch"), ("branch",)])
+    execute_prepared(cursor, f"{query} ORDER BY entity, by_branch, branch", params)
+    entities, branches = [], []
+    for row in cursor.fetchall():
+        if not row["by_entity"]:
+            branches.append({"branch": row["branch"], "skuCount": int(row["sku_count"])})
+        elif not row["by_branch"]:
+            entities.append({"entity": row["entity"], "skuCount": int(row["sku_count"]), "branches": []})
+        else:
+            entities[-1]["branches"].append({"branch": row["branch"], "skuCount": int(row["sku_count"])})
+    return {"entities": entities, "branches": branches}
 
 # Get all entities and their branches
 @app.get("/entities")
+@serve_stale_on_outage
+@coalesce_requests
 def get_entities():
     conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Get unique entities
-        cursor.execute("SELECT DISTINCT entity FROM inventory_management.demo_inventory ORDER BY entity")
-        entities = [row["entity"] for row in cursor.fetchall()]
-        
-        # Get branches for each entity
-        entity_branches = {}
-        for entity in entities:
-            cursor.execute(
-                "SELECT DISTINCT branch FROM inventory_management.demo_inventory WHERE entity = %s ORDER BY branch",
-                (entity,)
-            )
-            entity_branches[entity] = [row["branch"] for row in cursor.fetchall()]
+        snapshot = get_inventory_snapshot()
+        if snapshot is not None:
+            hierarchy = snapshot.entity_hierarchy()
+        else:
+            def fetch():
+                nonlocal conn
+                conn = get_db_connection(read_only=True)
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                hierarchy = fetch_entity_hierarchy(cursor)
+                cursor.close()
+                return hierarchy
+            hierarchy = cached_for_data_version("entityHierarchy", fetch)
         
-        cursor.close()
         return {
-            "entities": entities,
-            "entityBranches": entity_branches
+            "entities": [node["entity"] for node in hierarchy["entities"]],
+            "entityBranches": {node["entity"]: [branch["branch"] for branch in node["branches"]]
+                               for node in hierarchy["entities"]},
+            "hierarchy": hierarchy["entities"]  # the same tree with SKU counts per entity and branch
         }
     except Exception as e:
         print(f"Error retrieving entities: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error retrieving entities: {str(e)}")
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 # Get metrics for a specific entity
 @app.get("/metrics/{entity}")
+@serve_stale_on_outage
+@coalesce_requests
 def get_entity_metrics(entity: str):
     import time
     start_time = time.time()
     conn = None
     try:
         print(f"Starting metrics request for entity: {entity}")
-        conn = get_db_connection()
+        conn = get_db_connection(read_only=True)
         connection_time = time.time()
         print(f"Database connection time: {(connection_time - start_time):.3f} seconds")
         
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        # First check if entity exists
-        cursor.execute("SELECT COUNT(*) AS count FROM inventory_management.demo_inventory WHERE entity = %s", (entity,))
-        entity_check_time = time.time()
-        print(f"Entity check time: {(entity_check_time - connection_time):.3f} seconds")
-        
-        row = cursor.fetchone()
-        if not row or row["count"] == 0:
-            raise HTTPException(status_code=404, detail=f"Entity '{entity}' not found")
-        
-        # Enhanced metrics query that includes branch-specific counts and both overall and filtered data
-        # This way we can provide metrics for all filtering needs from a single query
+        # Entity totals, the per-branch breakdown and the turnover components in one scan: the ()
+        # grouping set is the entity's row, the (branch) set one row per branch
+        # COGS = (Quantity On Hand + TTM Qty Used) * Average Cost
+        # Inventory Turns = COGS / Inventory Balance
         main_query_start = time.time()
         print(f"Starting main metrics query for {entity}")
-        cursor.execute("""
-            WITH status_counts AS (
-                SELECT 
-                    branch,
-                    COUNT(*) AS item_count,
-                    SUM(CASE WHEN status = 'excess' THEN 1 ELSE 0 END) AS excess_count,
-                    SUM(CASE WHEN status = 'low' THEN 1 ELSE 0 END) AS low_stock_count,
-                    SUM(CASE WHEN status = 'dead' THEN 1 ELSE 0 END) AS dead_stock_count,
-                    SUM("Inventory Balance") AS inventory_value
-                FROM inventory_management.demo_inventory
-                WHERE entity = %s
-                GROUP BY branch
-            ),
-            overall_counts AS (
-                SELECT 
-                    COUNT(*) AS total_skus,
-                    SUM(CASE WHEN status = 'excess' THEN 1 ELSE 0 END) AS excess_items,
-                    SUM(CASE WHEN status = 'low' THEN 1 ELSE 0 END) AS low_stock_items,
-                    SUM(CASE WHEN status = 'dead' THEN 1 ELSE 0 END) AS dead_stock_items,
-                    SUM("Inventory Balance") AS total_inventory_value
-                FROM inventory_management.demo_inventory
-                WHERE entity = %s
-            )
-            SELECT 
-                oc.total_skus, 
-                oc.excess_items, 
-                oc.low_stock_items, 
-                oc.dead_stock_items, 
-                oc.total_inventory_value,
-                json_agg(json_build_object(
-                    'branch', sc.branch,
-                    'itemCount', sc.item_count,
-                    'excessCount', sc.excess_count,
-                    'lowStockCount', sc.low_stock_count,
-                    'deadStockCount', sc.dead_stock_count,
-                    'inventoryValue', sc.inventory_value
-                )) AS branch_metrics
-            FROM overall_counts oc, status_counts sc
-            GROUP BY oc.total_skus, oc.excess_items, oc.low_stock_items, oc.dead_stock_items, oc.total_inventory_value
-        """, (entity, entity))
+        query, params = compile_inventory_totals(InventoryFilter(entities=[entity]), {
+            "item_count": "COALESCE(SUM({skus}), 0)",
+            "excess_count": status_total("excess", "skus"),
+            "low_stock_count": status_total("low", "skus"),
+            "dead_stock_count": status_total("dead", "skus"),
+            "inventory_value": "SUM({value})",
+            "total_cogs": "SUM({cogs})",
+        }, grouping_sets=[(), ("branch",)])
+        execute_prepared(cursor, f"{query} ORDER BY by_branch, branch", params)
+        rows = cursor.fetchall()
         
         main_query_end = time.time()
         print(f"Main metrics query completed in {(main_query_end - main_query_start):.3f} seconds")
         
-        metrics = cursor.fetchone()
-        
-        # Calculate inventory turnover rate
-        # COGS = (Quantity On Hand + TTM Qty Used) * Average Cost
-        # Inventory Turns = COGS / Inventory Balance
-        inventory_turns_start = time.time()
-        print(f"Starting inventory turns calculation for {entity}")
+        metrics = rows[0]  # the entity row sorts first
+        if metrics["item_count"] == 0:
+            raise HTTPException(status_code=404, detail=f"Entity '{entity}' not found")
+        branch_rows = rows[1:]
+        branches = [row["branch"] for row in branch_rows]
+        # Branch-specific metrics for client-side filtering
+        branch_metrics = [{
+            "branch": row["branch"],
+            "itemCount": row["item_count"],
+            "excessCount": row["excess_count"],
+            "lowStockCount": row["low_stock_count"],
+            "deadStockCount": row["dead_stock_count"],
+            "inventoryValue": row["inventory_value"]
+        } for row in branch_rows]
         
         inventory_turns = None
-        
-        # Calculate inventory turns for all entities including HCN
-        cursor.execute("""
-            SELECT 
-                SUM("Inventory Balance") AS total_inventory_value,
-                SUM(("Sum of Quantity On Hand" + COALESCE("Sum of TTM Qty Used", 0)) * COALESCE("_Average Cost", 0)) AS total_cogs
-            FROM inventory_management.demo_inventory
-            WHERE entity = %s
-        """, (entity,))
-        
-        turns_row = cursor.fetchone()
-        
-        if turns_row and turns_row["total_inventory_value"] and turns_row["total_inventory_value"] > 0:
-            inventory_turns = turns_row["total_cogs"] / turns_row["total_inventory_value"]
-                
-            # Print for debugging
+        if metrics["inventory_value"] and metrics["inventory_value"] > 0:
+            inventory_turns = metrics["total_cogs"] / metrics["inventory_value"]
             print(f"Entity: {entity}")
             print(f"Inventory Turns: {inventory_turns}")
-            print(f"Total COGS: {turns_row['total_cogs'] if turns_row else 'N/A'}")
-            print(f"Total Inventory Value: {turns_row['total_inventory_value'] if turns_row else 'N/A'}")
-            
-            # Ensure we have a value (but don't force a fake one)
-            # Only default to 0 if it's None after calculation
-            if inventory_turns is None:
-                inventory_turns = 0
-                
-        inventory_turns_end = time.time()
-        print(f"Inventory turns calculation completed in {(inventory_turns_end - inventory_turns_start):.3f} seconds")
-                
-        # Get branches for this entity
-        branches_start = time.time()
-        print(f"Starting branches query for {entity}")
-        
-        cursor.execute(
-            "SELECT DISTINCT branch FROM inventory_management.demo_inventory WHERE entity = %s ORDER BY branch",
-            (entity,)
-        )
-        branches = [row["branch"] for row in cursor.fetchall()]
-        
-        branches_end = time.time()
-        print(f"Branches query completed in {(branches_end - branches_start):.3f} seconds")
-        
-        # Extract branch metrics from the query result
-        branch_metrics = metrics["branch_metrics"] if metrics and "branch_metrics" in metrics else []
         
         cursor.close()
         
         response_data = {
             "entity": entity,
-            "totalSKUs": safe_convert(metrics["total_skus"], int),
-            "excessItems": safe_convert(metrics["excess_items"], int),
-            "lowStockItems": safe_convert(metrics["low_stock_items"], int),
-            "deadStockItems": safe_convert(metrics["dead_stock_items"], int),
-            "totalInventoryValue": safe_convert(metrics["total_inventory_value"], float),
+            "totalSKUs": safe_convert(metrics["item_count"], int),
+            "excessItems": safe_convert(metrics["excess_count"], int),
+            "lowStockItems": safe_convert(metrics["low_stock_count"], int),
+            "deadStockItems": safe_convert(metrics["dead_stock_count"], int),
+            "totalInventoryValue": safe_convert(metrics["inventory_value"], float),
             "inventoryTurnover": safe_convert(inventory_turns, float),
             "branchCount": len(branches),
             "branches": branches,
             "branchMetrics": branch_metrics,  # Add branch-specific metrics for client-side filtering
             "filterCounts": {
-                "total": safe_convert(metrics["total_skus"], int),
-                "excess": safe_convert(metrics["excess_items"], int),
-                "low": safe_convert(metrics["low_stock_items"], int),
-                "dead": safe_convert(metrics["dead_stock_items"], int)
+                "total": safe_convert(metrics["item_count"], int),
+                "excess": safe_convert(metrics["excess_count"], int),
+                "low": safe_convert(metrics["low_stock_count"], int),
+                "dead": safe_convert(metrics["dead_stock_count"], int)
             }
         }
         
@@ -1072,119 +3486,125 @@ def get_entity_metrics(entity: str):
         raise HTTPException(status_code=500, detail=f"Error calculating entity metrics: {str(e)}")
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
+
+# Get filter counts for all entities
+@app.get("/filtercounts/all")
+@serve_stale_on_outage
+@coalesce_requests
+def get_all_filter_counts(search: str = None):
+    """Get filter counts across all entities (overview, excess, low stock, dead stock)"""
+    print("---- CHECKING API CODE VERSION FOR /filtercounts/all ----") # NEW MARKER
+    conn = None
+    try:
+        # Build the query with optional search filter
+        inventory_filter = InventoryFilter(search=search)
+        totals = {
+            **FILTER_COUNT_TOTALS,
+            "entity_count": "COUNT(DISTINCT entity)",
+            "branch_count": "COUNT(DISTINCT branch)",
+        }
+
+        # Counts, values, quantities and COGS by status in one scan (or from the snapshot's bitmaps)
+        snapshot = inventory_filter_snapshot(inventory_filter)
+        if snapshot is not None:
+            counts = snapshot.filter_counts(inventory_filter, totals)
+        else:
+            conn = get_db_connection(read_only=True)
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            query, params = compile_inventory_totals(inventory_filter, totals)
+            execute_prepared(cursor, query, params)
+            counts = cursor.fetchone()
+            cursor.close()
+        print(f"DEBUG: /filtercounts/all - raw counts from DB (with search='{search}'): {counts}")
+        
+        # Inventory turnover for each filter type, from the COGS summed in the same pass
+        total_turns = status_turnover(counts, "total")
+        excess_turns = status_turnover(counts, "excess")
+        low_turns = status_turnover(counts, "low")
+        dead_turns = status_turnover(counts, "dead")
+        
+        return {
+            "totalItems": safe_convert(counts["total_items"], int),
+            "excessItems": safe_convert(counts["excess_items"], int),
+            "lowStockItems": safe_convert(counts["low_stock_items"], int),
+            "deadStockItems": safe_convert(counts["dead_stock_items"], int),
+            "summaries": {
+                "overview": {
+                    "totalValue": safe_convert(counts["total_value"], float),
+                    "totalQuantity": safe_convert(counts["total_quantity"], int),
+                    "entityCount": safe_convert(counts["entity_count"], int),
+                    "branchCount": safe_convert(counts["branch_count"], int),
+                    "inventoryTurnover": safe_convert(total_turns, float)
+                },
+                "excess": {
+                    "totalValue": safe_convert(counts["excess_value"], float),
+                    "totalQuantity": safe_convert(counts["excess_quantity"], int),
+                    "entityCount": safe_convert(counts["entity_count"], int),
+                    "branchCount": safe_convert(counts["branch_count"], int),
+                    "inventoryTurnover": safe_convert(excess_turns, float)
+                },
+                "lowStock": {
+                    "totalValue": safe_convert(counts["low_value"], float),
+                    "totalQuantity": safe_convert(counts["low_quantity"], int),
+                    "entityCount": safe_convert(counts["entity_count"], int),
+                    "branchCount": safe_convert(counts["branch_count"], int),
+                    "inventoryTurnover": safe_convert(low_turns, float)
+                },
+                "deadStock": {
+                    "totalValue": safe_convert(counts["dead_value"], float),
+                    "totalQuantity": safe_convert(counts["dead_quantity"], int),
+                    "entityCount": safe_convert(counts["entity_count"], int),
+                    "branchCount": safe_convert(counts["branch_count"], int),
+                    "inventoryTurnover": safe_convert(dead_turns, float)
+                }
+            }
+        }
+    
+    except Exception as e:
+        print(f"Error fetching all filter counts: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching all filter counts: {str(e)}")
+    finally:
+        if conn:
+            release_db_connection(conn)
 
 # Get filter counts for a specific entity
 @app.get("/filtercounts/{entity}")
+@serve_stale_on_outage
+@coalesce_requests
 def get_filter_counts(entity: str, branch: str = None, search: str = None): # ADDED search parameter
     """Get filtered item counts for tabs (overview, excess, low stock, dead stock)"""
     conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Build the query with optional branch filter
-        params = [entity]
-        where_clause = "WHERE entity = %s"
-        
-        if branch:
-            where_clause += " AND branch = %s"
-            params.append(branch)
-
-        # Add search filter if specified
-        search_param_value = None
-        if search:
-            search_param_value = f"%{search}%"
-            search_conditions = []
-            search_fields = ["mfgpartnbr", "description", "mfgname", "partnbr"] 
-            for field in search_fields:
-                search_conditions.append(f"{field} ILIKE %s")
-                params.append(search_param_value)
-            
-            if search_conditions:
-                 where_clause += f" AND ({' OR '.join(search_conditions)})"
-
-        print(f"DEBUG: get_filter_counts - WHERE CLAUSE for main query: {where_clause}") # DEBUG
-        print(f"DEBUG: get_filter_counts - PARAMS for main query: {params}")       # DEBUG
+        # Build the filter (branch and search are optional)
+        inventory_filter = InventoryFilter(
+            entities=[entity],
+            branches=[branch] if branch else [],
+            search=search
+        )
+        totals = {
+            **FILTER_COUNT_TOTALS,
+            "branch_count": "COUNT(DISTINCT branch)",
+        }
 
-        # Execute the enhanced query with counts by status AND inventory values
-        query = f"""
-            SELECT 
-                COUNT(*) AS total_items,
-                SUM(CASE WHEN status = 'excess' THEN 1 ELSE 0 END) AS excess_items,
-                SUM(CASE WHEN status = 'low' THEN 1 ELSE 0 END) AS low_stock_items,
-                SUM(CASE WHEN status = 'dead' THEN 1 ELSE 0 END) AS dead_stock_items,
-                SUM("Inventory Balance") AS total_value,
-                SUM(CASE WHEN status = 'excess' THEN "Inventory Balance" ELSE 0 END) AS excess_value,
-                SUM(CASE WHEN status = 'low' THEN "Inventory Balance" ELSE 0 END) AS low_value,
-                SUM(CASE WHEN status = 'dead' THEN "Inventory Balance" ELSE 0 END) AS dead_value,
-                SUM("Sum of Quantity On Hand") AS total_quantity,
-                SUM(CASE WHEN status = 'excess' THEN "Sum of Quantity On Hand" ELSE 0 END) AS excess_quantity,
-                SUM(CASE WHEN status = 'low' THEN "Sum of Quantity On Hand" ELSE 0 END) AS low_quantity,
-                SUM(CASE WHEN status = 'dead' THEN "Sum of Quantity On Hand" ELSE 0 END) AS dead_quantity,
-                COUNT(DISTINCT branch) AS branch_count
-            FROM inventory_management.demo_inventory
-            {where_clause}
-        """
-        
-        cursor.execute(query, tuple(params)) 
-        counts = cursor.fetchone()
+        # Counts, values, quantities and COGS by status in one scan (or from the snapshot's bitmaps)
+        snapshot = inventory_filter_snapshot(inventory_filter)
+        if snapshot is not None:
+            counts = snapshot.filter_counts(inventory_filter, totals)
+        else:
+            conn = get_db_connection(read_only=True)
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            query, params = compile_inventory_totals(inventory_filter, totals)
+            execute_prepared(cursor, query, params)
+            counts = cursor.fetchone()
+            cursor.close()
         print(f"DEBUG: /filtercounts/{entity} - raw counts from DB (with search='{search}'): {counts}")
         
-        # Calculate inventory turnover for each filter type
-        # The where_clause and params already include the search filter if it was provided
-        print(f"DEBUG: get_filter_counts - WHERE CLAUSE for turnover query: {where_clause}") # DEBUG
-        print(f"DEBUG: get_filter_counts - PARAMS for turnover query: {params}")       # DEBUG
-        turnover_query = f"""
-            WITH filter_data AS (
-                SELECT 
-                    status,
-                    "Inventory Balance",
-                    "Sum of Quantity On Hand",
-                    COALESCE("Sum of TTM Qty Used", 0) AS ttm_qty,
-                    COALESCE("_Average Cost", 0) AS avg_cost
-                FROM inventory_management.demo_inventory
-                {where_clause}
-            )
-            SELECT 
-                SUM("Inventory Balance") AS total_value,
-                SUM(("Sum of Quantity On Hand" + ttm_qty) * avg_cost) AS total_cogs,
-                SUM(CASE WHEN status = 'excess' THEN "Inventory Balance" ELSE 0 END) AS excess_value,
-                SUM(CASE WHEN status = 'excess' THEN ("Sum of Quantity On Hand" + ttm_qty) * avg_cost ELSE 0 END) AS excess_cogs,
-                SUM(CASE WHEN status = 'low' THEN "Inventory Balance" ELSE 0 END) AS low_value,
-                SUM(CASE WHEN status = 'low' THEN ("Sum of Quantity On Hand" + ttm_qty) * avg_cost ELSE 0 END) AS low_cogs,
-                SUM(CASE WHEN status = 'dead' THEN "Inventory Balance" ELSE 0 END) AS dead_value,
-                SUM(CASE WHEN status = 'dead' THEN ("Sum of Quantity On Hand" + ttm_qty) * avg_cost ELSE 0 END) AS dead_cogs
-            FROM filter_data
-        """
-        
-        cursor.execute(turnover_query, tuple(params))
-        turnover_data = cursor.fetchone()
-        
-        # Calculate inventory turns for each category
-        total_turns = 0.0
-        excess_turns = 0.0
-        low_turns = 0.0
-        dead_turns = 0.0
-        
-        if turnover_data:
-            # Overall turns
-            if turnover_data["total_value"] and turnover_data["total_value"] > 0:
-                total_turns = turnover_data["total_cogs"] / turnover_data["total_value"]
-                
-            # Excess turns
-            if turnover_data["excess_value"] and turnover_data["excess_value"] > 0:
-                excess_turns = turnover_data["excess_cogs"] / turnover_data["excess_value"]
-                
-            # Low stock turns
-            if turnover_data["low_value"] and turnover_data["low_value"] > 0:
-                low_turns = turnover_data["low_cogs"] / turnover_data["low_value"]
-                
-            # Dead stock turns
-            if turnover_data["dead_value"] and turnover_data["dead_value"] > 0:
-                dead_turns = turnover_data["dead_cogs"] / turnover_data["dead_value"]
-        
-        cursor.close()
+        # Inventory turnover for each filter type, from the COGS summed in the same pass
+        total_turns = status_turnover(counts, "total")
+        excess_turns = status_turnover(counts, "excess")
+        low_turns = status_turnover(counts, "low")
+        dead_turns = status_turnover(counts, "dead")
         
         return {
             "entity": entity,
@@ -1220,16 +3640,113 @@ def get_filter_counts(entity: str, branch: str = None, search: str = None): # AD
                 }
             }
         }
-    
+    
+    except Exception as e:
+        print(f"Error fetching filter counts: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching filter counts: {str(e)}")
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+# NEW ENDPOINT FOR ADVANCED FILTERED INVENTORY ITEMS
+@app.get("/inventory/advanced", response_model=Dict[str, Any])
+@serve_stale_on_outage
+@coalesce_requests
+def get_advanced_inventory(
+    limit: int = 20,
+    offset: int = 0,
+    search: str = None,
+    entities: str = None, # Comma-separated list of entity names
+    branches: str = None, # Comma-separated list of branch names
+    status: str = None,
+    network_status: str = None,
+    sort_by: str = "mfgPartNumber",
+    sort_dir: str = "asc",
+    page_cursor: Annotated[Optional[str], Query(alias="cursor")] = None
+):
+    """
+    Get inventory items based on advanced filters with pagination, sorting.
+    - entities: Comma-separated list of entity names
+    - branches: Comma-separated list of branch names
+    - cursor: Keyset pagination instead of offset; pass an empty cursor for the first page,
+      then the returned nextCursor (null on the last page)
+    """
+    import time
+    start_time = time.time()
+    # Cursor mode: decode the position before touching the database
+    keyset = page_cursor is not None
+    keyset_after = None
+    if keyset:
+        offset, keyset_after = decode_inventory_cursor(page_cursor, sort_by, sort_dir)
+    conn = None
+    cursor = None
+    try:
+        entity_list = [e.strip() for e in entities.split(',') if e.strip()] if entities else []
+        branch_list = [b.strip() for b in branches.split(',') if b.strip()] if branches else []
+
+        print(f"Advanced inventory request: entities={entity_list}, branches={branch_list}, search={search}, status={status}, limit={limit}, offset={offset}")
+
+        # Build the filter
+        inventory_filter = InventoryFilter(
+            entities=entity_list,
+            branches=branch_list,
+            status=status,
+            network_status=network_status,
+            search=search
+        )
+        
+        # Served from the shared snapshot when listings are enabled for it
+        snapshot = inventory_listing_snapshot(inventory_filter, sort_by)
+        if snapshot is None:
+            conn = get_db_connection(read_only=True)
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # Get the page and the count and value of all matching items
+        count_data, rows = fetch_inventory_page(
+            cursor, inventory_filter, INVENTORY_PAGE_TOTALS, sort_by, sort_dir, limit, offset, keyset_after, keyset, snapshot
+        )
+        total_count = count_data["total"] if count_data else 0
+        total_value_for_filtered_items = count_data["total_value"] if count_data and count_data["total_value"] is not None else 0
+
+
+        if total_count == 0:
+            return {
+                "items": [], "totalCount": 0, "limit": limit, "offset": offset, "hasMore": False,
+                "metrics": { "totalSKUs": 0, "totalInventoryValue": 0 } # Simplified metrics for item list
+            }
+        
+        result = convert_db_rows_to_api_format(rows, offset)
+        if cursor:
+            cursor.close()
+        
+        total_time = time.time() - start_time
+        response = {
+            "items": result, "totalCount": total_count, "limit": limit, "offset": offset,
+            "hasMore": offset + len(result) < total_count,
+            "metrics": { # Basic metrics relevant to the item list shown
+                "totalSKUs": total_count, # SKUs matching the advanced filter
+                "totalInventoryValue": safe_convert(total_value_for_filtered_items, float)
+            },
+            "executionTime": f"{total_time:.3f}s"
+        }
+        if keyset:
+            # Cursor for the row after this page (None on the last page)
+            response["nextCursor"] = encode_inventory_cursor(sort_by, sort_dir, offset + len(rows), rows[-1]) if response["hasMore"] and rows else None
+        return response
     except Exception as e:
-        print(f"Error fetching filter counts: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error fetching filter counts: {str(e)}")
+        print(f"Error retrieving advanced filtered inventory: {str(e)}")
+        # Log full traceback here for better debugging if possible
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error retrieving advanced filtered inventory: {str(e)}")
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 # Get inventory for a specific entity with options to filter by branch and search text
 @app.get("/inventory/{entity}")
+@serve_stale_on_outage
+@coalesce_requests
 def get_entity_inventory(
     entity: str,
     limit: int = 20,
@@ -1239,7 +3756,8 @@ def get_entity_inventory(
     status: str = None,
     network_status: str = None,
     sort_by: str = "mfgPartNumber",
-    sort_dir: str = "asc"
+    sort_dir: str = "asc",
+    page_cursor: Annotated[Optional[str], Query(alias="cursor")] = None
 ):
     """
     Get inventory items filtered by entity with full pagination, sorting and filtering support
@@ -1249,71 +3767,41 @@ def get_entity_inventory(
     - branch: Filter by branch
     - status: Filter by status (excess, low, dead)
     - network_status: Filter by network status (optional)
-    - sort_by: Field to sort by (mfgPartNumber, inventoryBalance, partNumber, etc.)
+    - sort_by: Field to sort by (mfgPartNumber, inventoryBalance, partNumber, etc.; relevance ranks search results)
     - sort_dir: Sort direction (asc or desc)
+    - cursor: Keyset pagination instead of offset; pass an empty cursor for the first page,
+      then the returned nextCursor (null on the last page)
     """
     import time
     start_time = time.time()
+    # Cursor mode: decode the position before touching the database
+    keyset = page_cursor is not None
+    keyset_after = None
+    if keyset:
+        offset, keyset_after = decode_inventory_cursor(page_cursor, sort_by, sort_dir)
     conn = None
+    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Build query parameters
-        params = [entity]
+        # Build the filter
+        inventory_filter = InventoryFilter(
+            entities=[entity],
+            branches=[branch] if branch else [],
+            status=status,
+            network_status=network_status,
+            search=search,
+            exclude_corporate=True
+        )
         
-        # Build query
-        query = """
-            SELECT *
-            FROM inventory_management.demo_inventory
-            WHERE entity = %s AND "branch" != 'Corporate'
-        """
+        # Served from the shared snapshot when listings are enabled for it
+        snapshot = inventory_listing_snapshot(inventory_filter, sort_by)
+        if snapshot is None:
+            conn = get_db_connection(read_only=True)
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        # Add branch filter if specified
-        if branch:
-            query += " AND branch = %s"
-            params.append(branch)
-        
-        # Add status filter if specified
-        if status:
-            if status == 'excess':
-                query += " AND status = 'excess'"
-            elif status == 'low':
-                query += " AND status = 'low'"
-            elif status == 'dead':
-                query += " AND status = 'dead'"
-            # 'overview' or other values don't need filtering
-        
-        # Add network status filter if specified
-        if network_status:
-            query += " AND \"Network Status\" = %s"
-            params.append(network_status)
-        
-        # Add search filter if specified
-        if search:
-            query += """ 
-                AND (
-                    mfgpartnbr ILIKE %s OR
-                    description ILIKE %s OR
-                    mfgname ILIKE %s OR
-                    partnbr ILIKE %s
-                )
-            """
-            search_param = f"%{search}%"
-            params.extend([search_param, search_param, search_param, search_param])
-        
-        # Get total count first (for pagination and metrics)
-        count_query = f"""
-        SELECT 
-            COUNT(*) AS total,
-            SUM(CASE WHEN status = 'excess' THEN 1 ELSE 0 END) AS excess_count,
-            SUM(CASE WHEN status = 'low' THEN 1 ELSE 0 END) AS low_count,
-            SUM(CASE WHEN status = 'dead' THEN 1 ELSE 0 END) AS dead_count,
-            SUM("Inventory Balance") AS total_value
-        FROM ({query}) AS filtered
-        """
-        cursor.execute(count_query, params)
-        count_data = cursor.fetchone()
+        # Get the page and the totals (for pagination and metrics)
+        count_data, rows = fetch_inventory_page(
+            cursor, inventory_filter, INVENTORY_PAGE_TOTALS, sort_by, sort_dir, limit, offset, keyset_after, keyset, snapshot
+        )
         total_count = count_data["total"]
         
         if total_count == 0:
@@ -1333,54 +3821,6 @@ def get_entity_inventory(
                 }
             }
         
-        # Map API sort fields to database fields
-        sort_field_map = {
-            "inventoryBalance": "Inventory Balance",
-            "mfgPartNumber": "mfgpartnbr",
-            "partNumber": "partnbr",
-            "description": "description",
-            "quantityOnHand": "Sum of Quantity On Hand",
-            "monthsOfCoverage": "Months of Coverage",  # Updated from "Months to Burn"
-            "ttmQtyUsed": "Sum of TTM Qty Used",
-            "lastReceipt": "Last Receipt",
-            "companyStatus": "Network Status"
-            # Add more mappings as needed
-        }
-        
-        # Get the database field name, default to "Inventory Balance" if not mapped
-        db_sort_field = sort_field_map.get(sort_by, "Inventory Balance")
-        
-        # Add sorting with special handling for monthsOfCoverage
-        sort_direction = "DESC" if sort_dir.lower() == "desc" else "ASC"
-        if sort_by == "monthsOfCoverage":
-            # For monthsOfCoverage, treat "Infinity" as the highest value
-            query += f''' ORDER BY 
-                CASE 
-                    WHEN "Months to Burn" = 'Infinity' THEN 
-                        CASE WHEN '{sort_direction}' = 'ASC' THEN 1 ELSE 0 END
-                    ELSE 
-                        CASE WHEN '{sort_direction}' = 'ASC' THEN 0 ELSE 1 END
-                END,
-                CAST("Months to Burn" AS FLOAT) {sort_direction}'''
-        else:
-            query += f' ORDER BY "{db_sort_field}" {sort_direction}'
-        
-        # Only add a limit if limit > 0 (limit=0 means no limit)
-        if limit > 0:
-            query += " LIMIT %s"
-            params.append(limit)
-            
-            # Add offset for pagination
-            if offset > 0:
-                query += " OFFSET %s"
-                params.append(offset)
-        # If limit=0, don't add any limit to the query to return all records
-        
-        # Execute query
-        print(f"Executing query: {query} with params: {params}")
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
         # Convert to API format with efficient batch processing
         result = convert_db_rows_to_api_format(rows, offset)
         
@@ -1397,30 +3837,27 @@ def get_entity_inventory(
         # Calculate inventory turnover rate if needed (skip this if querying specific status)
         inventory_turns = 0.0
         if not status and entity != 'HCN':
-            turns_query = """
-                SELECT 
-                    SUM("Inventory Balance") AS total_inventory_value,
-                    SUM(("Sum of Quantity On Hand" + COALESCE("Sum of TTM Qty Used", 0)) * COALESCE("_Average Cost", 0)) AS total_cogs
-                FROM inventory_management.demo_inventory
-                WHERE entity = %s AND "branch" != 'Corporate'
-            """
-            cursor.execute(turns_query, [entity])
-            turns_row = cursor.fetchone()
+            if branch or network_status or search:
+                turns_row = fetch_inventory_totals(
+                    cursor, InventoryFilter(entities=[entity], exclude_corporate=True), INVENTORY_PAGE_TOTALS, snapshot)
+            else:
+                turns_row = count_data  # the totals already cover exactly these rows
             
-            if turns_row and turns_row["total_inventory_value"] and turns_row["total_inventory_value"] > 0:
-                inventory_turns = turns_row["total_cogs"] / turns_row["total_inventory_value"]
+            if turns_row and turns_row["total_value"] and turns_row["total_value"] > 0:
+                inventory_turns = turns_row["total_cogs"] / turns_row["total_value"]
                 
             print(f"Inventory Turns: {inventory_turns}")
             
         metrics["inventoryTurnover"] = safe_convert(inventory_turns, float)
         
-        cursor.close()
+        if cursor:
+            cursor.close()
         
         total_time = time.time() - start_time
         print(f"Total API processing time: {total_time:.3f} seconds")
         
         # Return with pagination metadata and metrics
-        return {
+        response = {
             "items": result,
             "totalCount": total_count,
             "limit": limit,
@@ -1429,166 +3866,16 @@ def get_entity_inventory(
             "metrics": metrics,
             "executionTime": f"{total_time:.3f}s"
         }
+        if keyset:
+            # Cursor for the row after this page (None on the last page)
+            response["nextCursor"] = encode_inventory_cursor(sort_by, sort_dir, offset + len(rows), rows[-1]) if response["hasMore"] and rows else None
+        return response
     except Exception as e:
         print(f"Error retrieving entity inventory: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error retrieving entity inventory: {str(e)}")
     finally:
         if conn:
-            conn.close()
-
-# NEW ENDPOINT FOR ADVANCED FILTERED INVENTORY ITEMS
-@app.get("/inventory/advanced", response_model=Dict[str, Any])
-def get_advanced_inventory(
-    limit: int = 20,
-    offset: int = 0,
-    search: str = None,
-    entities: str = None, # Comma-separated list of entity names
-    branches: str = None, # Comma-separated list of branch names
-    status: str = None,
-    network_status: str = None,
-    sort_by: str = "mfgPartNumber",
-    sort_dir: str = "asc"
-):
-    """
-    Get inventory items based on advanced filters with pagination, sorting.
-    - entities: Comma-separated list of entity names
-    - branches: Comma-separated list of branch names
-    """
-    import time
-    start_time = time.time()
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        entity_list = [e.strip() for e in entities.split(',') if e.strip()] if entities else []
-        branch_list = [b.strip() for b in branches.split(',') if b.strip()] if branches else []
-
-        print(f"Advanced inventory request: entities={entity_list}, branches={branch_list}, search={search}, status={status}, limit={limit}, offset={offset}")
-
-        # Build query parameters
-        sql_params = []
-        
-        # Build base query
-        query_parts = ["SELECT * FROM inventory_management.demo_inventory WHERE 1=1"]
-        count_query_parts = ["SELECT COUNT(*) AS total, SUM(\"Inventory Balance\") AS total_value FROM inventory_management.demo_inventory WHERE 1=1"] # Basic count and value
-
-        # Add entity filter if specified
-        if entity_list:
-            entity_placeholders = ', '.join(['%s'] * len(entity_list))
-            entity_condition = f"entity IN ({entity_placeholders})"
-            query_parts.append(f"AND {entity_condition}")
-            count_query_parts.append(f"AND {entity_condition}")
-            sql_params.extend(entity_list)
-            
-        # Add branch filter if specified
-        if branch_list:
-            branch_placeholders = ', '.join(['%s'] * len(branch_list))
-            branch_condition = f"branch IN ({branch_placeholders})"
-            query_parts.append(f"AND {branch_condition}")
-            count_query_parts.append(f"AND {branch_condition}")
-            sql_params.extend(branch_list)
-        
-        # Add status filter if specified
-        if status and status != 'overview': # 'overview' or other values don't need specific status filtering for items
-            status_condition = "status = %s"
-            query_parts.append(f"AND {status_condition}")
-            count_query_parts.append(f"AND {status_condition}")
-            sql_params.append(status)
-        
-        # Add network status filter if specified
-        if network_status:
-            network_status_condition = "\"Network Status\" = %s"
-            query_parts.append(f"AND {network_status_condition}")
-            count_query_parts.append(f"AND {network_status_condition}")
-            sql_params.append(network_status)
-        
-        # Add search filter if specified
-        if search:
-            search_condition = """ 
-                (
-                    mfgpartnbr ILIKE %s OR
-                    description ILIKE %s OR
-                    mfgname ILIKE %s OR
-                    partnbr ILIKE %s OR
-                    entity ILIKE %s OR
-                    branch ILIKE %s
-                )
-            """
-            query_parts.append(f"AND {search_condition}")
-            count_query_parts.append(f"AND {search_condition}")
-            search_param = f"%{search}%"
-            sql_params.extend([search_param] * 6) # Add search param for each field
-        
-        # Construct the final WHERE clause for the count query
-        # The count query needs its own parameter list if search params are different or not applied in the same way.
-        # For simplicity here, we'll assume the sql_params built so far are applicable for the count query as well.
-        # If search parameters were structured differently for count vs main query, this would need adjustment.
-        
-        final_count_query_str = ' '.join(count_query_parts)
-        print(f"Executing count query: {final_count_query_str} with params: {sql_params}")
-        cursor.execute(final_count_query_str, tuple(sql_params)) # Ensure params is a tuple
-        count_data = cursor.fetchone()
-        total_count = count_data["total"] if count_data else 0
-        total_value_for_filtered_items = count_data["total_value"] if count_data and count_data["total_value"] is not None else 0
-
-
-        if total_count == 0:
-            return {
-                "items": [], "totalCount": 0, "limit": limit, "offset": offset, "hasMore": False,
-                "metrics": { "totalSKUs": 0, "totalInventoryValue": 0 } # Simplified metrics for item list
-            }
-        
-        # Map API sort fields to database fields
-        sort_field_map = {
-            "inventoryBalance": "Inventory Balance", "mfgPartNumber": "mfgpartnbr",
-            "partNumber": "partnbr", "description": "description",
-            "quantityOnHand": "Sum of Quantity On Hand", "monthsOfCoverage": "Months to Burn",
-            "ttmQtyUsed": "Sum of TTM Qty Used", "entity": "entity", "branch": "branch",
-            "lastReceipt": "Last Receipt",
-            "companyStatus": "Network Status"
-        }
-        db_sort_field = sort_field_map.get(sort_by, "mfgpartnbr") # Default to mfgpartnbr
-        sort_direction = "DESC" if sort_dir.lower() == "desc" else "ASC"
-        
-        query_parts.append(f'ORDER BY "{db_sort_field}" {sort_direction}')
-        
-        item_query_params = list(sql_params) # Create a copy for item query
-
-        if limit > 0:
-            query_parts.append("LIMIT %s")
-            item_query_params.append(limit)
-            if offset > 0:
-                query_parts.append("OFFSET %s")
-                item_query_params.append(offset)
-        
-        final_item_query_str = ' '.join(query_parts)
-        print(f"Executing item query: {final_item_query_str} with params: {item_query_params}")
-        cursor.execute(final_item_query_str, tuple(item_query_params))
-        rows = cursor.fetchall()
-        
-        result = convert_db_rows_to_api_format(rows, offset)
-        cursor.close()
-        
-        total_time = time.time() - start_time
-        return {
-            "items": result, "totalCount": total_count, "limit": limit, "offset": offset,
-            "hasMore": offset + len(result) < total_count,
-            "metrics": { # Basic metrics relevant to the item list shown
-                "totalSKUs": total_count, # SKUs matching the advanced filter
-                "totalInventoryValue": safe_convert(total_value_for_filtered_items, float)
-            },
-            "executionTime": f"{total_time:.3f}s"
-        }
-    except Exception as e:
-        print(f"Error retrieving advanced filtered inventory: {str(e)}")
-        # Log full traceback here for better debugging if possible
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Error retrieving advanced filtered inventory: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
+            release_db_connection(conn)
 
 # User authorization models
 class UserData(BaseModel):
@@ -1668,128 +3955,95 @@ def verify_user(user_data: UserData):
         raise HTTPException(status_code=500, detail=f"Error verifying user: {str(e)}")
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
+
+def complete_metrics_response(metrics, hierarchy):
+    """The /metrics/all/complete body from the overall figures and the entity/branch hierarchy"""
+    return {
+        "entity": "All Entities",
+        "totalSKUs": metrics["totalSKUs"],
+        "excessItems": metrics["excessItems"],
+        "lowStockItems": metrics["lowStockItems"],
+        "deadStockItems": metrics["deadStockItems"],
+        "totalInventoryValue": metrics["totalInventoryValue"],
+        "inventoryTurnover": metrics["inventoryTurnover"],
+        "entityCount": metrics.get("entityCount", sum(1 for node in hierarchy["entities"] if node["entity"] is not None)),
+        "branchCount": metrics.get("branchCount", sum(1 for branch in hierarchy["branches"] if branch["branch"] is not None)),
+        "entities": [node["entity"] for node in hierarchy["entities"]],
+        "branches": [branch["branch"] for branch in hierarchy["branches"]],
+        "filterCounts": {
+            "total": metrics["totalSKUs"],
+            "excess": metrics["excessItems"],
+            "low": metrics["lowStockItems"],
+            "dead": metrics["deadStockItems"]
+        }
+    }
 
 # Get complete metrics for all entities
 @app.get("/metrics/all/complete")
+@serve_stale_on_outage
+@coalesce_requests
 def get_all_complete_metrics():
     """Get comprehensive metrics across all entities for the KeyMetrics component"""
-    print("GET /metrics/all/complete endpoint called!")  # Debug line to confirm endpoint is being hit
     import time
     start_time = time.time()
     conn = None
     try:
-        print("Attempting to connect to database for All Entities metrics")
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Enhanced metrics query that includes entity counts and overall data
-        # Following the same pattern as entity-specific metrics
-        main_query_start = time.time()
-        print("Starting main metrics query for All Entities")
-        
-        # Get basic metrics with status counts
-        cursor.execute("""
-            WITH status_counts AS (
-                SELECT 
-                    entity,
-                    COUNT(*) AS item_count,
-                    SUM(CASE WHEN status = 'excess' THEN 1 ELSE 0 END) AS excess_count,
-                    SUM(CASE WHEN status = 'low' THEN 1 ELSE 0 END) AS low_stock_count,
-                    SUM(CASE WHEN status = 'dead' THEN 1 ELSE 0 END) AS dead_stock_count,
-                    SUM("Inventory Balance") AS inventory_value
-                FROM inventory_management.demo_inventory
-                GROUP BY entity
-            ),
-            overall_counts AS (
-                SELECT 
-                    COUNT(*) AS total_skus,
-                    SUM(CASE WHEN status = 'excess' THEN 1 ELSE 0 END) AS excess_items,
-                    SUM(CASE WHEN status = 'low' THEN 1 ELSE 0 END) AS low_stock_items,
-                    SUM(CASE WHEN status = 'dead' THEN 1 ELSE 0 END) AS dead_stock_items,
-                    SUM("Inventory Balance") AS total_inventory_value,
-                    COUNT(DISTINCT entity) AS entity_count,
-                    COUNT(DISTINCT branch) AS branch_count
-                FROM inventory_management.demo_inventory
-            )
-            SELECT 
-                oc.total_skus, 
-                oc.excess_items, 
-                oc.low_stock_items, 
-                oc.dead_stock_items, 
-                oc.total_inventory_value,
-                oc.entity_count,
-                oc.branch_count
-            FROM overall_counts oc
-        """)
-        
-        main_query_end = time.time()
-        print(f"Main metrics query completed in {(main_query_end - main_query_start):.3f} seconds")
-        
-        metrics = cursor.fetchone()
-        
-        # Calculate inventory turnover rate - including all entities
-        # COGS = (Quantity On Hand + TTM Qty Used) * Average Cost
-        # Inventory Turns = COGS / Inventory Balance
-        inventory_turns_start = time.time()
-        print("Starting inventory turns calculation for All Entities")
-        
-        cursor.execute("""
-            SELECT 
-                SUM("Inventory Balance") AS total_inventory_value,
-                SUM(("Sum of Quantity On Hand" + COALESCE("Sum of TTM Qty Used", 0)) * COALESCE("_Average Cost", 0)) AS total_cogs
-            FROM inventory_management.demo_inventory
-        """)
-        
-        turns_row = cursor.fetchone()
-        inventory_turns = 0.0
-        
-        if turns_row and turns_row["total_inventory_value"] and turns_row["total_inventory_value"] > 0:
-            inventory_turns = turns_row["total_cogs"] / turns_row["total_inventory_value"]
+        # Served from the shared snapshot when one is loaded
+        snapshot = get_inventory_snapshot()
+        if snapshot is not None:
+            metrics = snapshot.overall_metrics()
+            hierarchy = snapshot.entity_hierarchy()
+            return complete_metrics_response(metrics, hierarchy)
+
+        def fetch():
+            nonlocal conn
+            timings = {}
+            phase_start = time.time()
+            conn = get_db_connection(read_only=True)
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            timings["connection"] = time.time() - phase_start
             
-        # Print for debugging
-        print(f"All Entities Inventory Turns: {inventory_turns}")
-        print(f"Total COGS: {turns_row['total_cogs'] if turns_row else 'N/A'}")
-        print(f"Total Inventory Value: {turns_row['total_inventory_value'] if turns_row else 'N/A'}")
-        
-        inventory_turns_end = time.time()
-        print(f"Inventory turns calculation completed in {(inventory_turns_end - inventory_turns_start):.3f} seconds")
-        
-        # Get all entities and branches for completeness
-        entity_branches_start = time.time()
-        print("Starting entities and branches query for All Entities")
-        
-        cursor.execute("SELECT DISTINCT entity FROM inventory_management.demo_inventory ORDER BY entity")
-        entities = [row["entity"] for row in cursor.fetchall()]
-        
-        cursor.execute("SELECT DISTINCT branch FROM inventory_management.demo_inventory ORDER BY branch")
-        branches = [row["branch"] for row in cursor.fetchall()]
-        
-        entity_branches_end = time.time()
-        print(f"Entities and branches query completed in {(entity_branches_end - entity_branches_start):.3f} seconds")
-        
-        cursor.close()
-        
-        # Format the response data to match entity-specific format
-        response_data = {
-            "entity": "All Entities",
-            "totalSKUs": safe_convert(metrics["total_skus"], int),
-            "excessItems": safe_convert(metrics["excess_items"], int),
-            "lowStockItems": safe_convert(metrics["low_stock_items"], int),
-            "deadStockItems": safe_convert(metrics["dead_stock_items"], int),
-            "totalInventoryValue": safe_convert(metrics["total_inventory_value"], float),
-            "inventoryTurnover": safe_convert(inventory_turns, float),
-            "entityCount": safe_convert(metrics["entity_count"], int),
-            "branchCount": safe_convert(metrics["branch_count"], int),
-            "entities": entities,
-            "branches": branches,
-            "filterCounts": {
-                "total": safe_convert(metrics["total_skus"], int),
-                "excess": safe_convert(metrics["excess_items"], int),
-                "low": safe_convert(metrics["low_stock_items"], int),
-                "dead": safe_convert(metrics["dead_stock_items"], int)
+            # Status counts, value, COGS and the entity/branch counts in one aggregate
+            # COGS = (Quantity On Hand + TTM Qty Used) * Average Cost
+            # Inventory Turns = COGS / Inventory Balance
+            phase_start = time.time()
+            query, params = compile_inventory_totals(InventoryFilter(), {
+                "total_skus": "COALESCE(SUM({skus}), 0)",
+                "excess_items": status_total("excess", "skus"),
+                "low_stock_items": status_total("low", "skus"),
+                "dead_stock_items": status_total("dead", "skus"),
+                "total_inventory_value": "SUM({value})",
+                "total_cogs": "SUM({cogs})",
+                "entity_count": "COUNT(DISTINCT entity)",
+                "branch_count": "COUNT(DISTINCT branch)",
+            })
+            execute_prepared(cursor, query, params)
+            row = cursor.fetchone()
+            timings["totals"] = time.time() - phase_start
+            
+            # The entity and branch lists, shared with /entities
+            phase_start = time.time()
+            hierarchy = cached_for_data_version("entityHierarchy", lambda: fetch_entity_hierarchy(cursor))
+            timings["hierarchy"] = time.time() - phase_start
+            cursor.close()
+            
+            total_value = row["total_inventory_value"]
+            metrics = {
+                "totalSKUs": safe_convert(row["total_skus"], int),
+                "excessItems": safe_convert(row["excess_items"], int),
+                "lowStockItems": safe_convert(row["low_stock_items"], int),
+                "deadStockItems": safe_convert(row["dead_stock_items"], int),
+                "totalInventoryValue": safe_convert(total_value, float),
+                "inventoryTurnover": safe_convert(row["total_cogs"] / total_value if total_value and total_value > 0 else 0.0, float),
+                "entityCount": safe_convert(row["entity_count"], int),
+                "branchCount": safe_convert(row["branch_count"], int),
             }
-        }
+            print("All Entities metrics timings: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items()))
+            return complete_metrics_response(metrics, hierarchy)
+        
+        # The whole response only changes with the data
+        response_data = cached_for_data_version("allCompleteMetrics", fetch)
         
         total_time = time.time() - start_time
         print(f"Total metrics API processing time for All Entities: {total_time:.3f} seconds")
@@ -1800,167 +4054,16 @@ def get_all_complete_metrics():
         raise HTTPException(status_code=500, detail=f"Error calculating complete metrics for all entities: {str(e)}")
     finally:
         if conn:
-            conn.close()
-
-# Get filter counts for all entities
-@app.get("/filtercounts/all")
-def get_all_filter_counts(search: str = None):
-    """Get filter counts across all entities (overview, excess, low stock, dead stock)"""
-    print("---- CHECKING API CODE VERSION FOR /filtercounts/all ----") # NEW MARKER
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # ADD DEBUGGING FOR SESSION CONTEXT
-        cursor.execute("SELECT current_user, session_user, current_setting('search_path') AS search_path;")
-        session_context = cursor.fetchone()
-        print(f"DEBUG: /filtercounts/all - DB Session Context: User={session_context['current_user']}, SessionUser={session_context['session_user']}, SearchPath={session_context['search_path']}")
-        
-        # Build the query with optional search filter
-        params = []
-        where_clause = ""
-        if search:
-            search_param = f"%{search}%"
-            # Updated search fields to be more comprehensive
-            search_fields = ["mfgpartnbr", "description", "mfgname", "partnbr", "entity", "branch"]
-            search_conditions = []
-            for field in search_fields:
-                # Corrected: Removed double quotes around the field name
-                search_conditions.append(f'{field} ILIKE %s')
-                params.append(search_param)
-            where_clause = f"WHERE {' OR '.join(search_conditions)}"
-            print(f"DEBUG: /filtercounts/all - Constructed WHERE clause: {where_clause}")
-
-
-        # Execute the query with counts by status AND inventory values
-        query = f"""
-            SELECT 
-                COUNT(*) AS total_items,
-                SUM(CASE WHEN status = 'excess' THEN 1 ELSE 0 END) AS excess_items,
-                SUM(CASE WHEN status = 'low' THEN 1 ELSE 0 END) AS low_stock_items,
-                SUM(CASE WHEN status = 'dead' THEN 1 ELSE 0 END) AS dead_stock_items,
-                SUM("Inventory Balance") AS total_value,
-                SUM(CASE WHEN status = 'excess' THEN "Inventory Balance" ELSE 0 END) AS excess_value,
-                SUM(CASE WHEN status = 'low' THEN "Inventory Balance" ELSE 0 END) AS low_value,
-                SUM(CASE WHEN status = 'dead' THEN "Inventory Balance" ELSE 0 END) AS dead_value,
-                SUM("Sum of Quantity On Hand") AS total_quantity,
-                SUM(CASE WHEN status = 'excess' THEN "Sum of Quantity On Hand" ELSE 0 END) AS excess_quantity,
-                SUM(CASE WHEN status = 'low' THEN "Sum of Quantity On Hand" ELSE 0 END) AS low_quantity,
-                SUM(CASE WHEN status = 'dead' THEN "Sum of Quantity On Hand" ELSE 0 END) AS dead_quantity,
-                COUNT(DISTINCT entity) AS entity_count,
-                COUNT(DISTINCT branch) AS branch_count
-            FROM inventory_management.demo_inventory
-            {where_clause}
-        """
-        
-        cursor.execute(query, tuple(params))
-        counts = cursor.fetchone()
-        print(f"DEBUG: /filtercounts/all - raw counts from DB (with search='{search}'): {counts}")
-        
-        # Calculate inventory turnover for each filter type
-        # The where_clause and params already include the search filter if it was provided
-        turnover_query = f"""
-            WITH filter_data AS (
-                SELECT 
-                    status,
-                    "Inventory Balance",
-                    "Sum of Quantity On Hand",
-                    COALESCE("Sum of TTM Qty Used", 0) AS ttm_qty,
-                    COALESCE("_Average Cost", 0) AS avg_cost
-                FROM inventory_management.demo_inventory
-                {where_clause}
-            )
-            SELECT 
-                SUM("Inventory Balance") AS total_value,
-                SUM(("Sum of Quantity On Hand" + ttm_qty) * avg_cost) AS total_cogs,
-                SUM(CASE WHEN status = 'excess' THEN "Inventory Balance" ELSE 0 END) AS excess_value,
-                SUM(CASE WHEN status = 'excess' THEN ("Sum of Quantity On Hand" + ttm_qty) * avg_cost ELSE 0 END) AS excess_cogs,
-                SUM(CASE WHEN status = 'low' THEN "Inventory Balance" ELSE 0 END) AS low_value,
-                SUM(CASE WHEN status = 'low' THEN ("Sum of Quantity On Hand" + ttm_qty) * avg_cost ELSE 0 END) AS low_cogs,
-                SUM(CASE WHEN status = 'dead' THEN "Inventory Balance" ELSE 0 END) AS dead_value,
-                SUM(CASE WHEN status = 'dead' THEN ("Sum of Quantity On Hand" + ttm_qty) * avg_cost ELSE 0 END) AS dead_cogs
-            FROM filter_data
-        """
-        
-        cursor.execute(turnover_query, tuple(params))
-        turnover_data = cursor.fetchone()
-        
-        # Calculate inventory turns for each category
-        total_turns = 0.0
-        excess_turns = 0.0
-        low_turns = 0.0
-        dead_turns = 0.0
-        
-        if turnover_data:
-            # Overall turns
-            if turnover_data["total_value"] and turnover_data["total_value"] > 0:
-                total_turns = turnover_data["total_cogs"] / turnover_data["total_value"]
-                
-            # Excess turns
-            if turnover_data["excess_value"] and turnover_data["excess_value"] > 0:
-                excess_turns = turnover_data["excess_cogs"] / turnover_data["excess_value"]
-                
-            # Low stock turns
-            if turnover_data["low_value"] and turnover_data["low_value"] > 0:
-                low_turns = turnover_data["low_cogs"] / turnover_data["low_value"]
-                
-            # Dead stock turns
-            if turnover_data["dead_value"] and turnover_data["dead_value"] > 0:
-                dead_turns = turnover_data["dead_cogs"] / turnover_data["dead_value"]
-        
-        cursor.close()
-        
-        return {
-            "totalItems": safe_convert(counts["total_items"], int),
-            "excessItems": safe_convert(counts["excess_items"], int),
-            "lowStockItems": safe_convert(counts["low_stock_items"], int),
-            "deadStockItems": safe_convert(counts["dead_stock_items"], int),
-            "summaries": {
-                "overview": {
-                    "totalValue": safe_convert(counts["total_value"], float),
-                    "totalQuantity": safe_convert(counts["total_quantity"], int),
-                    "entityCount": safe_convert(counts["entity_count"], int),
-                    "branchCount": safe_convert(counts["branch_count"], int),
-                    "inventoryTurnover": safe_convert(total_turns, float)
-                },
-                "excess": {
-                    "totalValue": safe_convert(counts["excess_value"], float),
-                    "totalQuantity": safe_convert(counts["excess_quantity"], int),
-                    "entityCount": safe_convert(counts["entity_count"], int),
-                    "branchCount": safe_convert(counts["branch_count"], int),
-                    "inventoryTurnover": safe_convert(excess_turns, float)
-                },
-                "lowStock": {
-                    "totalValue": safe_convert(counts["low_value"], float),
-                    "totalQuantity": safe_convert(counts["low_quantity"], int),
-                    "entityCount": safe_convert(counts["entity_count"], int),
-                    "branchCount": safe_convert(counts["branch_count"], int),
-                    "inventoryTurnover": safe_convert(low_turns, float)
-                },
-                "deadStock": {
-                    "totalValue": safe_convert(counts["dead_value"], float),
-                    "totalQuantity": safe_convert(counts["dead_quantity"], int),
-                    "entityCount": safe_convert(counts["entity_count"], int),
-                    "branchCount": safe_convert(counts["branch_count"], int),
-                    "inventoryTurnover": safe_convert(dead_turns, float)
-                }
-            }
-        }
-    
-    except Exception as e:
-        print(f"Error fetching all filter counts: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error fetching all filter counts: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
+            release_db_connection(conn)
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to ZentroQ Inventory API", "backend": "PostgreSQL"}
 
 @app.get("/part-branch-summary", response_model=Dict[str, List[str]])
-async def get_part_branch_summary():
+@db_offload
+@coalesce_requests
+def get_part_branch_summary():
     """
     Provides a summary of which branches each part number exists in.
     Returns a dictionary where keys are part numbers and values are lists of branch names.
@@ -1968,7 +4071,11 @@ async def get_part_branch_summary():
     conn = None
     part_branch_map = {}
     try:
-        conn = get_db_connection()
+        snapshot = get_inventory_snapshot()
+        if snapshot is not None:
+            return snapshot.part_branch_summary()
+
+        conn = get_db_connection(read_only=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
         # Query to get part numbers and an aggregated list of their distinct branches
@@ -2004,10 +4111,12 @@ async def get_part_branch_summary():
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 @app.get("/part-details/all/{part_number_str}", response_model=List[InventoryItem])
-async def get_part_details_across_all_branches(part_number_str: str):
+@db_offload
+@coalesce_requests
+def get_part_details_across_all_branches(part_number_str: str):
     """
     Retrieve all inventory items for a specific part number (either internal or MFG) 
     across all entities and branches.
@@ -2015,7 +4124,7 @@ async def get_part_details_across_all_branches(part_number_str: str):
     conn = None
     cursor = None # Initialize cursor to None
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(read_only=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
         query = """
@@ -2045,11 +4154,12 @@ async def get_part_details_across_all_branches(part_number_str: str):
         if cursor: # Check if cursor exists before closing
             cursor.close()
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 # NEW Endpoint to submit orders
 @app.post("/submit-orders")
-async def submit_orders(payload: SubmitOrdersRequest, db_user_email: Optional[str] = Depends(lambda: None)): # db_user_email for future proper auth
+@db_offload
+def submit_orders(payload: SubmitOrdersRequest, db_user_email: Optional[str] = Depends(lambda: None)): # db_user_email for future proper auth
     print("@@@ /submit-orders endpoint HIT! Top of function. (Corrected Version Check) @@@") # DIAGNOSTIC
     conn = None
     try:
@@ -2114,7 +4224,7 @@ async def submit_orders(payload: SubmitOrdersRequest, db_user_email: Optional[st
         if conn:
             if cursor: # Ensure cursor exists before trying to close
                 cursor.close()
-            conn.close()
+            release_db_connection(conn)
 
 # NEW Pydantic model for returning pending orders (matches table structure more closely for now)
 class PendingOrderResponseItem(BaseModel):
@@ -2139,7 +4249,8 @@ class UpdateOrderStatusRequest(BaseModel):
 
 # NEW Endpoint to get pending orders
 @app.get("/pending-orders", response_model=List[PendingOrderResponseItem])
-async def get_pending_orders(user_email: Optional[str] = Depends(lambda: None)): # Placeholder for auth based filtering
+@db_offload
+def get_pending_orders(user_email: Optional[str] = Depends(lambda: None)): # Placeholder for auth based filtering
     conn = None
     try:
         conn = get_db_connection()
@@ -2168,11 +4279,12 @@ async def get_pending_orders(user_email: Optional[str] = Depends(lambda: None)):
         raise HTTPException(status_code=500, detail=f"Failed to fetch pending orders: {str(e)}")
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 # NEW Endpoint to get completed orders
 @app.get("/completed-orders", response_model=List[PendingOrderResponseItem])
-async def get_completed_orders(user_email: Optional[str] = Depends(lambda: None)):
+@db_offload
+def get_completed_orders(user_email: Optional[str] = Depends(lambda: None)):
     conn = None
     try:
         conn = get_db_connection()
@@ -2196,11 +4308,12 @@ async def get_completed_orders(user_email: Optional[str] = Depends(lambda: None)
         raise HTTPException(status_code=500, detail=f"Failed to fetch completed orders: {str(e)}")
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 # NEW Endpoint to get cancelled orders
 @app.get("/cancelled-orders", response_model=List[PendingOrderResponseItem])
-async def get_cancelled_orders(user_email: Optional[str] = Depends(lambda: None)):
+@db_offload
+def get_cancelled_orders(user_email: Optional[str] = Depends(lambda: None)):
     conn = None
     try:
         conn = get_db_connection()
@@ -2224,11 +4337,12 @@ async def get_cancelled_orders(user_email: Optional[str] = Depends(lambda: None)
         raise HTTPException(status_code=500, detail=f"Failed to fetch cancelled orders: {str(e)}")
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 # NEW Endpoint to update order status
 @app.put("/order-request/{order_request_id}/status")
-async def update_order_status(order_request_id: int, payload: UpdateOrderStatusRequest, user_email: Optional[str] = Depends(lambda: None)):
+@db_offload
+def update_order_status(order_request_id: int, payload: UpdateOrderStatusRequest, user_email: Optional[str] = Depends(lambda: None)):
     conn = None
     try:
         conn = get_db_connection()
@@ -2263,11 +4377,12 @@ async def update_order_status(order_request_id: int, payload: UpdateOrderStatusR
         raise HTTPException(status_code=500, detail=f"Failed to update order status: {str(e)}")
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 # NEW Endpoint to get active orders for a user
 @app.get("/active-orders", response_model=List[PendingOrderResponseItem])
-async def get_active_orders(user_email: str = Query(...)):
+@db_offload
+def get_active_orders(user_email: str = Query(...)):
     if not user_email:
         raise HTTPException(status_code=400, detail="User email query parameter is required.")
     conn = None
@@ -2286,11 +4401,12 @@ async def get_active_orders(user_email: str = Query(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch active orders: {str(e)}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 # NEW Endpoint to add an item to active order (creates or updates quantity)
 @app.post("/active-orders/item", response_model=PendingOrderResponseItem)
-async def add_or_update_active_order_item(item_payload: AddToActiveOrderRequest):
+@db_offload
+def add_or_update_active_order_item(item_payload: AddToActiveOrderRequest):
     conn = None
     user_email = item_payload.requested_by_user_email # Crucial for user-specific cart
     if not user_email:
@@ -2363,11 +4479,12 @@ async def add_or_update_active_order_item(item_payload: AddToActiveOrderRequest)
         if conn: conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to add/update active order item: {str(e)}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 # NEW Endpoint to update quantity of a specific active order item
 @app.put("/active-orders/item/{order_request_id}/quantity", response_model=PendingOrderResponseItem)
-async def update_active_order_item_quantity(order_request_id: int, payload: UpdateActiveOrderItemQuantityRequest):
+@db_offload
+def update_active_order_item_quantity(order_request_id: int, payload: UpdateActiveOrderItemQuantityRequest):
     conn = None
     try:
         conn = get_db_connection()
@@ -2392,11 +4509,12 @@ async def update_active_order_item_quantity(order_request_id: int, payload: Upda
         if conn: conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to update active order item quantity: {str(e)}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 # NEW Endpoint to remove a specific item from active order
 @app.delete("/active-orders/item/{order_request_id}")
-async def remove_active_order_item(order_request_id: int, user_email: str = Query(...)):
+@db_offload
+def remove_active_order_item(order_request_id: int, user_email: str = Query(...)):
     conn = None
     try:
         conn = get_db_connection()
@@ -2418,11 +4536,12 @@ async def remove_active_order_item(order_request_id: int, user_email: str = Quer
         if conn: conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to remove active order item: {str(e)}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 # NEW Endpoint to clear all active orders for a user
 @app.delete("/active-orders/all")
-async def clear_all_active_orders(user_email: str = Query(...)):
+@db_offload
+def clear_all_active_orders(user_email: str = Query(...)):
     conn = None
     try:
         conn = get_db_connection()
@@ -2443,13 +4562,14 @@ async def clear_all_active_orders(user_email: str = Query(...)):
         if conn: conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to clear active orders: {str(e)}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 # ... (get_pending_orders, get_completed_orders, get_cancelled_orders, update_order_status remain the same)
 
 # Ensure this new endpoint is placed logically, e.g., after other submission endpoints
 @app.post("/submit-transfer-requests")
-async def submit_transfer_requests(payload: SubmitTransferRequestsRequest):
+@db_offload
+def submit_transfer_requests(payload: SubmitTransferRequestsRequest):
     print(f"<<<<< INSIDE /submit-transfer-requests - Payload received: {payload} >>>>>") # DIAGNOSTIC PRINT
     conn = None
     cursor = None # Initialize cursor to None
@@ -2504,7 +4624,7 @@ async def submit_transfer_requests(payload: SubmitTransferRequestsRequest):
         if cursor: # Check if cursor was initialized
             cursor.close()
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 # NEW Pydantic model for returning transfer data
 class TransferResponseItem(BaseModel):
@@ -2527,7 +4647,8 @@ class UpdateTransferStatusRequest(BaseModel):
 
 # NEW Endpoint to get pending transfers
 @app.get("/pending-transfers", response_model=List[TransferResponseItem])
-async def get_pending_transfers(user_email: Optional[str] = Depends(lambda: None)): # Placeholder for auth
+@db_offload
+def get_pending_transfers(user_email: Optional[str] = Depends(lambda: None)): # Placeholder for auth
     conn = None
     try:
         conn = get_db_connection()
@@ -2562,11 +4683,12 @@ async def get_pending_transfers(user_email: Optional[str] = Depends(lambda: None
     finally:
         if conn:
             if cursor: cursor.close() # ensure cursor is closed
-            conn.close()
+            release_db_connection(conn)
 
 # NEW Endpoint to get completed transfers
 @app.get("/completed-transfers", response_model=List[TransferResponseItem])
-async def get_completed_transfers(user_email: Optional[str] = Depends(lambda: None)): # Placeholder for auth
+@db_offload
+def get_completed_transfers(user_email: Optional[str] = Depends(lambda: None)): # Placeholder for auth
     conn = None
     try:
         conn = get_db_connection()
@@ -2590,11 +4712,12 @@ async def get_completed_transfers(user_email: Optional[str] = Depends(lambda: No
     finally:
         if conn:
             if cursor: cursor.close()
-            conn.close()
+            release_db_connection(conn)
 
 # NEW Endpoint to get cancelled transfers
 @app.get("/cancelled-transfers", response_model=List[TransferResponseItem])
-async def get_cancelled_transfers(user_email: Optional[str] = Depends(lambda: None)): # Placeholder for auth
+@db_offload
+def get_cancelled_transfers(user_email: Optional[str] = Depends(lambda: None)): # Placeholder for auth
     conn = None
     try:
         conn = get_db_connection()
@@ -2618,11 +4741,12 @@ async def get_cancelled_transfers(user_email: Optional[str] = Depends(lambda: No
     finally:
         if conn:
             if cursor: cursor.close()
-            conn.close()
+            release_db_connection(conn)
 
 # NEW Endpoint to update transfer status
 @app.put("/transfer-request/{transfer_id}/status", response_model=TransferResponseItem) # Return the updated item
-async def update_transfer_status(transfer_id: int, payload: UpdateTransferStatusRequest, user_email: Optional[str] = Depends(lambda: None)): # Placeholder for auth
+@db_offload
+def update_transfer_status(transfer_id: int, payload: UpdateTransferStatusRequest, user_email: Optional[str] = Depends(lambda: None)): # Placeholder for auth
     conn = None
     try:
         conn = get_db_connection()
@@ -2665,7 +4789,7 @@ async def update_transfer_status(transfer_id: int, payload: UpdateTransferStatus
     finally:
         if conn:
             if cursor: cursor.close()
-            conn.close()
+            release_db_connection(conn)
 
 # ACTIVE TRANSFER CART ENDPOINTS (mirroring active orders system)
 
@@ -2686,7 +4810,8 @@ class UpdateActiveTransferItemQuantityRequest(BaseModel):
 
 # Endpoint to get active transfers for a user
 @app.get("/active-transfers", response_model=List[TransferResponseItem])
-async def get_active_transfers(user_email: str = Query(...)):
+@db_offload
+def get_active_transfers(user_email: str = Query(...)):
     if not user_email:
         raise HTTPException(status_code=400, detail="User email query parameter is required.")
     conn = None
@@ -2705,11 +4830,12 @@ async def get_active_transfers(user_email: str = Query(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch active transfers: {str(e)}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 # Endpoint to add an item to active transfer cart (creates or updates quantity)
 @app.post("/active-transfers/item", response_model=TransferResponseItem)
-async def add_or_update_active_transfer_item(item_payload: AddToActiveTransferRequest):
+@db_offload
+def add_or_update_active_transfer_item(item_payload: AddToActiveTransferRequest):
     conn = None
     user_email = item_payload.requested_by_user_email
     if not user_email:
@@ -2773,11 +4899,12 @@ async def add_or_update_active_transfer_item(item_payload: AddToActiveTransferRe
         if conn: conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to add/update active transfer item: {str(e)}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 # Endpoint to update quantity of a specific active transfer item
 @app.put("/active-transfers/item/{transfer_request_id}/quantity", response_model=TransferResponseItem)
-async def update_active_transfer_item_quantity(transfer_request_id: int, payload: UpdateActiveTransferItemQuantityRequest):
+@db_offload
+def update_active_transfer_item_quantity(transfer_request_id: int, payload: UpdateActiveTransferItemQuantityRequest):
     conn = None
     try:
         conn = get_db_connection()
@@ -2800,11 +4927,12 @@ async def update_active_transfer_item_quantity(transfer_request_id: int, payload
         if conn: conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to update active transfer item quantity: {str(e)}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 # Endpoint to remove a specific item from active transfer cart
 @app.delete("/active-transfers/item/{transfer_request_id}")
-async def remove_active_transfer_item(transfer_request_id: int, user_email: str = Query(...)):
+@db_offload
+def remove_active_transfer_item(transfer_request_id: int, user_email: str = Query(...)):
     conn = None
     try:
         conn = get_db_connection()
@@ -2824,11 +4952,12 @@ async def remove_active_transfer_item(transfer_request_id: int, user_email: str
         if conn: conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to remove active transfer item: {str(e)}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 # Endpoint to clear all active transfers for a user
 @app.delete("/active-transfers/all")
-async def clear_all_active_transfers(user_email: str = Query(...)):
+@db_offload
+def clear_all_active_transfers(user_email: str = Query(...)):
     conn = None
     try:
         conn = get_db_connection()
@@ -2847,11 +4976,12 @@ async def clear_all_active_transfers(user_email: str = Query(...)):
         if conn: conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to clear active transfers: {str(e)}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 # Endpoint to submit active transfers (convert Active -> Pending Transfer)
 @app.post("/submit-active-transfers")
-async def submit_active_transfers(user_email: str = Query(...)):
+@db_offload
+def submit_active_transfers(user_email: str = Query(...)):
     conn = None
     try:
         conn = get_db_connection()
@@ -2876,11 +5006,12 @@ async def submit_active_transfers(user_email: str = Query(...)):
         if conn: conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to submit active transfers: {str(e)}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 # Endpoint to submit active orders (convert Active -> Pending Send)
 @app.post("/submit-active-orders")
-async def submit_active_orders(user_email: str = Query(...)):
+@db_offload
+def submit_active_orders(user_email: str = Query(...)):
     conn = None
     try:
         conn = get_db_connection()
@@ -2905,7 +5036,7 @@ async def submit_active_orders(user_email: str = Query(...)):
         if conn: conn.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to submit active orders: {str(e)}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 # Make sure this is at the very end of the file if it's the main app script
 # ... existing code ...
\ No newline at end of file
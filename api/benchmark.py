@@ -0,0 +1,203 @@
+"""
+Endpoint latency benchmark for the demo_inventory migrations.
+
+Loads app/data.csv scaled up to --rows rows into a separate local database (BENCHMARK_DB_NAME,
+created on the DB_HOST server from the same DB_* settings as the API), measures each endpoint
+through the app in-process, applies the migrations in migrations/, measures again and prints the
+before/after latency per endpoint. The CSV is repeated with a copy suffix on partnbr/mfgpartnbr, so
+entities and branches stay the same and each branch holds proportionally more parts.
+
+Usage:
+    python benchmark.py --rows 2000000 [--repeat 5] [--csv app/data.csv] [--keep]
+"""
+import os
+import io
+import sys
+import csv
+import time
+import argparse
+import statistics
+import contextlib
+import psycopg2
+from psycopg2 import sql
+
+import migrate
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_DB_NAME = os.getenv('BENCHMARK_DB_NAME', 'inventory_benchmark')
+COPY_BATCH_ROWS = 50000
+
+# Column types of demo_inventory; every other data.csv column is double precision
+TEXT_COLUMNS = {"entity", "branch", "partnbr", "mfgname", "mfgpartnbr", "description", "family", "category",
+                "Sum of Months of Cover", "status", "Network Flag", "Network Status", "Branch Flag",
+                "Months of Coverage"}
+TIMESTAMP_COLUMNS = {"Last Receipt"}
+
+def create_database(params):
+    conn = psycopg2.connect(**params)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(BENCHMARK_DB_NAME)))
+        cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(BENCHMARK_DB_NAME)))
+    conn.close()
+
+def load_inventory(conn, csv_path, total_rows):
+    """Create demo_inventory and COPY the CSV into it, repeated until it has total_rows rows"""
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        source_rows = list(reader)
+    part_columns = [header.index("partnbr"), header.index("mfgpartnbr")]
+
+    column_definitions = []
+    for column in header:
+        column_type = "TEXT" if column in TEXT_COLUMNS else "TIMESTAMP" if column in TIMESTAMP_COLUMNS else "DOUBLE PRECISION"
+        column_definitions.append(f'"{column}" {column_type}')
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA inventory_management")
+        cursor.execute(f"CREATE TABLE inventory_management.demo_inventory ({', '.join(column_definitions)})")
+
+        start_time = time.time()
+        loaded = 0
+        while loaded < total_rows:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            batch_end = min(total_rows, loaded + COPY_BATCH_ROWS)
+            for i in range(loaded, batch_end):
+                row = source_rows[i % len(source_rows)]
+                copy_number = i // len(source_rows)
+                if copy_number:
+                    row = list(row)
+                    for column in part_columns:
+                        row[column] = f"{row[column]}-{copy_number}"
+                writer.writerow(row)
+            buffer.seek(0)
+            cursor.copy_expert("COPY inventory_management.demo_inventory FROM STDIN WITH (FORMAT csv, NULL '')", buffer)
+            loaded = batch_end
+            print(f"  loaded {loaded} rows", end="\r")
+        conn.commit()
+        print(f"\nLoaded {loaded} rows in {time.time() - start_time:.1f} seconds")
+        cursor.execute("ANALYZE inventory_management.demo_inventory")
+    conn.commit()
+
+def benchmark_endpoints(conn):
+    """Endpoints to time, with an entity, branch and part number taken from the loaded data"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT entity, branch, mfgpartnbr FROM inventory_management.demo_inventory
+            WHERE branch != 'Corporate' LIMIT 1
+        """)
+        entity, branch, part = cursor.fetchone()
+    conn.commit()
+    return [
+        "/inventory?limit=100",
+        f"/inventory?entity={entity}&branch={branch}&limit=100",
+        "/inventory?status=excess&limit=100",
+        "/inventory?network_status=dead&limit=100",
+        "/inventory?sort_by=inventoryBalance&sort_dir=desc&limit=100",
+        "/inventory?sort_by=monthsOfCoverage&limit=100",
+        "/inventory?offset=5000&limit=100",
+        "/inventory?search=sensor&limit=100",
+        f"/inventory?search={part}&sort_by=relevance&limit=100",
+        f"/inventory/{entity}?limit=100",
+        f"/inventory/{entity}?status=dead&limit=100",
+        f"/inventory/advanced?entities={entity}&branches={branch}&limit=100",
+        "/metrics",
+        f"/metrics/{entity}",
+        "/metrics/all/complete",
+        "/filtercounts/all",
+        "/filtercounts/all?search=sensor",
+        f"/filtercounts/{entity}?branch={branch}",
+        "/entities",
+        f"/part-details/all/{part}",
+    ]
+
+def measure(client, endpoints, repeat):
+    """{endpoint: (median ms, max ms)}; each endpoint gets one untimed request first"""
+    results = {}
+    for endpoint in endpoints:
+        timings = []
+        for i in range(repeat + 1):
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):  # the API logs every query
+                response = client.get(endpoint)
+            elapsed = (time.perf_counter() - start_time) * 1000
+            if response.status_code != 200:
+                raise RuntimeError(f"{endpoint} returned {response.status_code}: {response.text[:200]}")
+            if i:
+                timings.append(elapsed)
+        results[endpoint] = (statistics.median(timings), max(timings))
+        print(f"  {endpoint}: {results[endpoint][0]:.1f} ms")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Before/after latency of the demo_inventory migrations")
+    parser.add_argument("--rows", type=int, default=2000000, help="rows to load (default 2000000)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed requests per endpoint (default 5)")
+    parser.add_argument("--csv", default=os.path.join(API_DIR, 'app', 'data.csv'), help="source CSV")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark database afterwards")
+    args = parser.parse_args()
+
+    params = migrate.connection_params()
+    if params['database'] == BENCHMARK_DB_NAME:
+        print("BENCHMARK_DB_NAME must differ from DB_NAME: the benchmark database is dropped and recreated")
+        return 1
+    print(f"Creating database {BENCHMARK_DB_NAME} on {params['host']}...")
+    create_database(params)
+    bench_params = {**params, 'database': BENCHMARK_DB_NAME}
+    conn = psycopg2.connect(**bench_params)
+    try:
+        load_inventory(conn, args.csv, args.rows)
+        endpoints = benchmark_endpoints(conn)
+
+        # Point the app at the benchmark database, without the features that would hide query time
+        os.environ.update({
+            'DB_NAME': BENCHMARK_DB_NAME,
+            'DB_REPLICA_HOST': '',
+            'STARTUP_WARMUP': 'false',
+            'INVENTORY_SNAPSHOT': 'false',
+            'STATEMENT_TIMEOUT_INVENTORY_MS': '0',
+            'STATEMENT_TIMEOUT_METRICS_MS': '0',
+            'STATEMENT_TIMEOUT_FILTERCOUNTS_MS': '0',
+        })
+        sys.path.insert(0, API_DIR)
+        with contextlib.redirect_stdout(io.StringIO()):
+            from app.main import app
+        from fastapi.testclient import TestClient
+
+        with TestClient(app) as client:
+            print("Before migrations:")
+            before = measure(client, endpoints, args.repeat)
+        print("Applying migrations...")
+        migrate.migrate(conn)
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE inventory_management.demo_inventory")
+        conn.commit()
+        # A second app lifespan, as after a deploy: the shutdown closed the pool (and its prepared
+        # statements), and startup detects the schema features the migrations added
+        with TestClient(app) as client:
+            print("After migrations:")
+            after = measure(client, endpoints, args.repeat)
+
+        width = max(len(endpoint) for endpoint in endpoints)
+        print(f"\n{args.rows} rows, median of {args.repeat} requests (max in parentheses)")
+        print(f"{'endpoint'.ljust(width)}  {'before ms':>18}  {'after ms':>18}  {'speedup':>8}")
+        for endpoint in endpoints:
+            (before_median, before_max), (after_median, after_max) = before[endpoint], after[endpoint]
+            print(f"{endpoint.ljust(width)}  {before_median:9.1f} ({before_max:6.1f})  "
+                  f"{after_median:9.1f} ({after_max:6.1f})  {before_median / after_median:7.1f}x")
+        return 0
+    finally:
+        conn.close()
+        if not args.keep:
+            admin = psycopg2.connect(**params)
+            admin.autocommit = True
+            with admin.cursor() as cursor:
+                # The app's pooled connections are still open in this process
+                cursor.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = %s AND pid != pg_backend_pid()",
+                               (BENCHMARK_DB_NAME,))
+                cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(BENCHMARK_DB_NAME)))
+            admin.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
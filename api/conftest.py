@@ -0,0 +1,111 @@
+"""
+Shared pytest fixtures (run from api/: python -m pytest).
+
+inventory_snapshot is a snapshot of app/data.csv built in a temporary directory. inventory_db loads the same
+CSV into a scratch database (TEST_DB_NAME, created on the DB_HOST server from the DB_* settings, as
+benchmark.py does), applies every migration the server can run and points the app's pool at it; tests
+using it are skipped when no server is configured or reachable.
+"""
+import os
+import time
+import pytest
+import psycopg2
+from psycopg2 import sql
+
+import migrate
+import benchmark
+from app import main
+
+# Manual scripts that call a running server when imported, not pytest tests
+collect_ignore = ["test_api.py", "test_db.py", "test_inventory.py"]
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+CSV_PATH = os.path.join(API_DIR, 'app', 'data.csv')
+TEST_DB_NAME = os.getenv('TEST_DB_NAME', 'inventory_test')
+
+@pytest.fixture(scope="session")
+def inventory_frame():
+    """app/data.csv as a snapshot build reads it: text columns, NULL and '' as NaN"""
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(main, "INVENTORY_SNAPSHOT_SOURCE", "csv")
+        patch.setattr(main, "INVENTORY_CSV_PATH", CSV_PATH)
+        frame, _, _ = main._read_inventory_source()
+    return frame
+
+def build_snapshot(directory, frame, source="csv", data_version=None):
+    """Builds one snapshot version of frame's rows into directory and maps it"""
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(main, "INVENTORY_SNAPSHOT_SOURCE", source)
+        main._build_inventory_snapshot(str(directory), 1, frame, data_version)
+    return main.InventorySnapshot(str(directory))
+
+@pytest.fixture(scope="session")
+def inventory_snapshot(tmp_path_factory, inventory_frame):
+    return build_snapshot(tmp_path_factory.mktemp("snapshot") / "v000001", inventory_frame)
+
+def _drop_database(params):
+    admin = psycopg2.connect(**params)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = %s AND pid != pg_backend_pid()",
+                       (TEST_DB_NAME,))
+        cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(TEST_DB_NAME)))
+    admin.close()
+
+@pytest.fixture(scope="session")
+def inventory_db(inventory_frame):
+    """
+    (connection, applied migration versions) of a scratch database holding app/data.csv, which the app's
+    pool uses for the session. The database is created with C collation, so text sorts in code point order
+    like the snapshot's. Migrations the server cannot run (0004 needs pg_trgm) are left out.
+    """
+    params = migrate.connection_params()
+    if not params['host']:
+        pytest.skip("DB_HOST is not set")
+    if params['database'] == TEST_DB_NAME:
+        pytest.skip("TEST_DB_NAME must differ from DB_NAME: the test database is dropped and recreated")
+    try:
+        _drop_database(params)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Database server unreachable: {e}")
+    admin = psycopg2.connect(**params)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(sql.SQL("CREATE DATABASE {} TEMPLATE template0 ENCODING 'UTF8' LC_COLLATE 'C' LC_CTYPE 'C'")
+                       .format(sql.Identifier(TEST_DB_NAME)))
+    admin.close()
+
+    conn = psycopg2.connect(**{**params, 'database': TEST_DB_NAME})
+    benchmark.load_inventory(conn, CSV_PATH, len(inventory_frame))
+    applied = set()
+    migrate.applied_migrations(conn)
+    conn.commit()
+    for version, name, migration_sql in migrate.available_migrations():
+        try:
+            migrate.apply_migration(conn, version, name, migration_sql)
+            applied.add(version)
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"Migration {version}_{name} left out: {e}")
+    conn.autocommit = True
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setitem(main.db_params, 'database', TEST_DB_NAME)
+        patch.setitem(main.db_params, 'sslmode', params['sslmode'])
+        patch.setattr(main, "replica_db_params", None)
+        patch.setattr(main, "db_pool", None)
+        patch.setattr(main, "database_breaker", main.CircuitBreaker(main.DB_BREAKER_FAILURE_THRESHOLD, 1))
+        patch.setattr(main, "schema_features", dict(main.schema_features))
+        main.probe_schema_features()
+        patch.setattr(main, "_schema_features_checked_at", time.time() + 3600)
+        try:
+            yield conn, applied
+        finally:
+            main.close_db_pool()
+            conn.close()
+            _drop_database(params)
+
+def require_migrations(applied, *versions):
+    missing = [version for version in versions if version not in applied]
+    if missing:
+        pytest.skip(f"Migrations not applied on this server: {', '.join(missing)}")
@@ -0,0 +1,158 @@
+"""
+Versioned schema migrations for the inventory database.
+
+Migrations are the numbered .sql files in migrations/ (NNNN_description.sql), applied in order and
+recorded in inventory_management.schema_migrations, so running this again only applies new ones.
+A file whose first line is "-- migrate: no-transaction" runs statement by statement outside a
+transaction, which CREATE INDEX CONCURRENTLY needs (it does not block reads or writes on the table
+while the index builds); every other file runs in a single transaction.
+
+Usage (uses the same DB_* environment variables / .env as the API):
+    python migrate.py            apply pending migrations
+    python migrate.py --list     show applied and pending migrations
+"""
+import os
+import re
+import sys
+import time
+import hashlib
+import argparse
+import psycopg2
+from dotenv import load_dotenv
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATIONS_TABLE = "inventory_management.schema_migrations"
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+def connection_params():
+    """Connection parameters from the environment, the same variables app/main.py reads"""
+    load_dotenv()
+    app_env = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', '.env')
+    if os.path.exists(app_env):
+        load_dotenv(app_env)
+    return {
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT', '5432'),
+        'database': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'sslmode': os.getenv('DB_SSLMODE', 'require'),
+        'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '10'))
+    }
+
+def available_migrations():
+    """[(version, name, sql)] for every migration file, in version order"""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.match(r"^(\d+)_(\w+)\.sql$", filename)
+        if not match:
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename)) as f:
+            migrations.append((match.group(1), match.group(2), f.read()))
+    return migrations
+
+def split_statements(sql):
+    """
+    Statements of a migration file: comment lines are dropped and a ';' ending a line ends a
+    statement, except inside $$-quoted function and DO bodies.
+    """
+    statements, current, in_dollar_quote = [], [], False
+    for line in sql.splitlines():
+        if not in_dollar_quote and line.strip().startswith("--"):
+            continue
+        current.append(line)
+        if line.count("$$") % 2:
+            in_dollar_quote = not in_dollar_quote
+        if not in_dollar_quote and line.rstrip().endswith(";"):
+            statements.append("\n".join(current).strip())
+            current = []
+    if "\n".join(current).strip():
+        statements.append("\n".join(current).strip())
+    return statements
+
+def checksum(sql):
+    return hashlib.sha256(sql.encode()).hexdigest()
+
+def applied_migrations(conn):
+    """{version: checksum} of the migrations already recorded"""
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS inventory_management")
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+                version TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """)
+        cursor.execute(f"SELECT version, checksum FROM {MIGRATIONS_TABLE}")
+        return dict(cursor.fetchall())
+
+def apply_migration(conn, version, name, sql):
+    no_transaction = sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+    with conn.cursor() as cursor:
+        if no_transaction:
+            conn.autocommit = True
+            try:
+                for statement in split_statements(sql):
+                    cursor.execute(statement)
+            finally:
+                conn.autocommit = False
+        else:
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {MIGRATIONS_TABLE} (version, name, checksum) VALUES (%s, %s, %s)",
+                       (version, name, checksum(sql)))
+    conn.commit()
+
+def migrate(conn, verbose=True):
+    """Apply every pending migration in order; returns the versions applied"""
+    conn.autocommit = False
+    applied = applied_migrations(conn)
+    conn.commit()
+    done = []
+    for version, name, sql in available_migrations():
+        if version in applied:
+            if applied[version] != checksum(sql) and verbose:
+                print(f"Warning: migration {version}_{name} changed after it was applied")
+            continue
+        if verbose:
+            print(f"Applying {version}_{name}...")
+        start_time = time.time()
+        try:
+            apply_migration(conn, version, name, sql)
+        except Exception as e:
+            conn.rollback()
+            print(f"Migration {version}_{name} failed: {e}")
+            if sql.lstrip().startswith(NO_TRANSACTION_MARKER):
+                # A failed CREATE INDEX CONCURRENTLY leaves an INVALID index that IF NOT EXISTS would skip
+                print("Statements before the failure stay applied; drop any index left INVALID before re-running")
+            raise
+        if verbose:
+            print(f"  done in {time.time() - start_time:.2f} seconds")
+        done.append(version)
+    return done
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply the inventory database migrations")
+    parser.add_argument("--list", action="store_true", help="show applied and pending migrations")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**connection_params())
+    try:
+        if args.list:
+            applied = applied_migrations(conn)
+            conn.commit()
+            for version, name, _ in available_migrations():
+                print(f"{version}_{name}: {'applied' if version in applied else 'pending'}")
+            return 0
+        done = migrate(conn)
+        print(f"Applied {len(done)} migration(s)" if done else "Database is up to date")
+        return 0
+    except Exception as e:
+        print(f"Migration error: {e}")
+        return 1
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,21 @@
+-- migrate: no-transaction
+-- Indexes for the filters every inventory, metrics and filter count request applies.
+-- The listing endpoints leave out the 'Corporate' branch, so the per-filter indexes are partial on
+-- that predicate (branch != 'Corporate' in the queries is the same operator as <> here).
+
+-- branch / entity filters and the branch lists of /entities. Not partial, because /entities and
+-- /inventory/advanced read the Corporate rows too. Branch leads: with few entities an entity-first
+-- index is so well correlated with the table that the planner walks it for whole-table aggregates
+-- (COUNT(DISTINCT entity)), which is slower than a sequential scan.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_branch_entity_idx
+    ON inventory_management.demo_inventory (branch, entity);
+
+-- status = %s, optionally combined with an entity filter
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_status_entity_idx
+    ON inventory_management.demo_inventory (status, entity)
+    WHERE branch <> 'Corporate';
+
+-- "Network Status" = %s, and the companyStatus sort in keyset order
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_network_status_idx
+    ON inventory_management.demo_inventory ("Network Status", entity, branch, partnbr)
+    WHERE branch <> 'Corporate';
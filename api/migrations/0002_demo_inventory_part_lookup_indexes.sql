@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+-- Part number lookups: /part-details/all/{part} (partnbr = %s OR mfgpartnbr = %s, combined as a
+-- bitmap OR) and the company-wide totals by mfgpartnbr.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_partnbr_idx
+    ON inventory_management.demo_inventory (partnbr);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_mfgpartnbr_idx
+    ON inventory_management.demo_inventory (mfgpartnbr);
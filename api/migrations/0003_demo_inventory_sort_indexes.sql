@@ -0,0 +1,40 @@
+-- migrate: no-transaction
+-- One index per listing sort field (SORT_FIELD_MAP in app/main.py) in keyset order: the sort column
+-- followed by the (entity, branch, partnbr) tiebreaker. A btree scans both ways, so each index serves
+-- ascending and descending pages, and a LIMIT query reads only the rows it returns.
+-- companyStatus uses demo_inventory_network_status_idx; the entity and branch sorts are left to a
+-- sort (see 0001 for why there is no entity-first index).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_sort_mfgpartnbr_idx
+    ON inventory_management.demo_inventory (mfgpartnbr, entity, branch, partnbr)
+    WHERE branch <> 'Corporate';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_sort_partnbr_idx
+    ON inventory_management.demo_inventory (partnbr, entity, branch)
+    WHERE branch <> 'Corporate';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_sort_description_idx
+    ON inventory_management.demo_inventory (description, entity, branch, partnbr)
+    WHERE branch <> 'Corporate';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_sort_inventory_balance_idx
+    ON inventory_management.demo_inventory ("Inventory Balance", entity, branch, partnbr)
+    WHERE branch <> 'Corporate';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_sort_quantity_on_hand_idx
+    ON inventory_management.demo_inventory ("Sum of Quantity On Hand", entity, branch, partnbr)
+    WHERE branch <> 'Corporate';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_sort_ttm_qty_used_idx
+    ON inventory_management.demo_inventory ("Sum of TTM Qty Used", entity, branch, partnbr)
+    WHERE branch <> 'Corporate';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_sort_last_receipt_idx
+    ON inventory_management.demo_inventory ("Last Receipt", entity, branch, partnbr)
+    WHERE branch <> 'Corporate';
+
+-- "Months of Coverage" is stored as text and sorted as CAST(... AS FLOAT); the index expression
+-- must match the query's for the planner to use it
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_sort_months_of_coverage_idx
+    ON inventory_management.demo_inventory ((CAST("Months of Coverage" AS FLOAT)), entity, branch, partnbr)
+    WHERE branch <> 'Corporate';
@@ -0,0 +1,18 @@
+-- migrate: no-transaction
+-- Substring search over one combined, trigram-indexed search document instead of an ILIKE per column
+-- (which always scans the table). The app switches to it once this column exists (INVENTORY_SEARCH_MODE).
+-- pg_trgm must be allowed on the server (on Azure Database for PostgreSQL, add it to azure.extensions).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- The search columns (SEARCH_COLUMNS in app/main.py) joined by newlines, which search text never
+-- contains, so a match still lies within one column. Adding a stored column rewrites the table.
+ALTER TABLE inventory_management.demo_inventory
+    ADD COLUMN IF NOT EXISTS search_document TEXT GENERATED ALWAYS AS (
+        COALESCE(mfgpartnbr, '') || E'\n' || COALESCE(description, '') || E'\n' || COALESCE(mfgname, '') || E'\n' ||
+        COALESCE(partnbr, '') || E'\n' || COALESCE(entity, '') || E'\n' || COALESCE(branch, '')
+    ) STORED;
+
+-- Serves search_document ILIKE '%text%' for search text of three or more characters
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_search_document_trgm_idx
+    ON inventory_management.demo_inventory USING gin (search_document gin_trgm_ops);
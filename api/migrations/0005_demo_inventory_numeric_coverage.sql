@@ -0,0 +1,49 @@
+-- migrate: no-transaction
+-- Numeric companions of the coverage and burn-rate columns, which demo_inventory loads as text
+-- ('inf' for no usage, spreadsheet errors such as '#NAME?'). Sorting by months of coverage then reads
+-- a plain DOUBLE PRECISION column through an index instead of casting every row, and the API rows
+-- need no string parsing. The source columns are left as loaded; the companions are generated from them.
+-- Adding them rewrites demo_inventory under an ACCESS EXCLUSIVE lock: reads and writes wait for the whole
+-- rewrite (the indexes below are built concurrently afterwards), so apply it in a maintenance window.
+
+-- Text -> DOUBLE PRECISION: 'inf'/'Infinity' become Infinity (sorting above every finite value, as
+-- CAST did), numbers are cast, anything else (empty, 'nan', '#NAME?') becomes NULL
+CREATE OR REPLACE FUNCTION inventory_management.parse_float(value TEXT) RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT CASE
+        WHEN value ~* '^\s*\+?inf(inity)?\s*$' THEN 'Infinity'::DOUBLE PRECISION
+        WHEN value ~* '^\s*-inf(inity)?\s*$' THEN '-Infinity'::DOUBLE PRECISION
+        WHEN value ~ '^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$' THEN CAST(value AS DOUBLE PRECISION)
+    END
+$$;
+
+-- One generated column per source column that is stored as text, all added by one ALTER TABLE so the
+-- table is rewritten once
+DO $$
+DECLARE
+    additions TEXT;
+BEGIN
+    SELECT string_agg(format(
+               'ADD COLUMN IF NOT EXISTS %I DOUBLE PRECISION GENERATED ALWAYS AS (inventory_management.parse_float(%I)) STORED',
+               companion.numeric_column, companion.source_column), ', ')
+    INTO additions
+    FROM (VALUES
+        ('Months of Coverage', 'months_of_coverage'),
+        ('Sum of Months of Cover', 'months_of_cover'),
+        ('Weeks to Burn', 'weeks_to_burn'),
+        ('Months to Burn', 'months_to_burn')
+    ) companion (source_column, numeric_column)
+    JOIN information_schema.columns ON table_schema = 'inventory_management' AND table_name = 'demo_inventory'
+        AND column_name = companion.source_column AND data_type = 'text';
+    IF additions IS NOT NULL THEN
+        EXECUTE 'ALTER TABLE inventory_management.demo_inventory ' || additions;
+    END IF;
+END
+$$;
+
+-- The monthsOfCoverage sort in keyset order, replacing the expression index on the text column
+CREATE INDEX CONCURRENTLY IF NOT EXISTS demo_inventory_sort_months_of_coverage_value_idx
+    ON inventory_management.demo_inventory (months_of_coverage, entity, branch, partnbr)
+    WHERE branch <> 'Corporate';
+
+DROP INDEX CONCURRENTLY IF EXISTS inventory_management.demo_inventory_sort_months_of_coverage_idx;
@@ -0,0 +1,122 @@
+-- Per (entity, branch, status, "Network Status") sums of the figures the metrics and filter count
+-- endpoints report: SKU count, inventory value, quantity on hand and COGS. Without search text those
+-- endpoints sum these few hundred rows instead of scanning demo_inventory (INVENTORY_METRICS_SOURCE).
+-- The key columns keep the names of demo_inventory, so the shared filter compiler applies as is.
+-- Sums are NUMERIC so the incremental updates below never drift.
+-- Creating the triggers locks demo_inventory against writes (SHARE ROW EXCLUSIVE; reads go on) until the
+-- initial rebuild at the end commits, which scans the whole table: apply it in a maintenance window.
+CREATE TABLE IF NOT EXISTS inventory_management.demo_inventory_rollup (
+    entity TEXT,
+    branch TEXT,
+    status TEXT,
+    "Network Status" TEXT,
+    sku_count INTEGER NOT NULL,
+    inventory_value NUMERIC NOT NULL,
+    quantity_on_hand NUMERIC NOT NULL,
+    cogs NUMERIC NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS demo_inventory_rollup_entity_branch_idx
+    ON inventory_management.demo_inventory_rollup (entity, branch);
+
+-- Recomputes the rollup from demo_inventory; for loads that run with triggers disabled
+CREATE OR REPLACE FUNCTION inventory_management.rebuild_demo_inventory_rollup() RETURNS VOID
+LANGUAGE plpgsql AS $$
+BEGIN
+    LOCK TABLE inventory_management.demo_inventory_rollup IN SHARE ROW EXCLUSIVE MODE;
+    DELETE FROM inventory_management.demo_inventory_rollup;
+    INSERT INTO inventory_management.demo_inventory_rollup
+    SELECT
+        entity, branch, status, "Network Status",
+        COUNT(*),
+        COALESCE(SUM("Inventory Balance"::NUMERIC), 0),
+        COALESCE(SUM("Sum of Quantity On Hand"::NUMERIC), 0),
+        COALESCE(SUM((("Sum of Quantity On Hand" + COALESCE("Sum of TTM Qty Used", 0)) * COALESCE("_Average Cost", 0))::NUMERIC), 0)
+    FROM inventory_management.demo_inventory
+    GROUP BY entity, branch, status, "Network Status";
+END
+$$;
+
+-- Applies the rows a statement changed (its transition tables) to the rollup. Writers of demo_inventory
+-- take turns on the rollup lock, so a bucket is never inserted twice; readers are not blocked.
+CREATE OR REPLACE FUNCTION inventory_management.apply_demo_inventory_rollup_delta() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    changed_rows TEXT;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM inventory_management.demo_inventory_rollup;
+        RETURN NULL;
+    END IF;
+    changed_rows := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT 1 AS sign, * FROM new_rows'
+        WHEN 'DELETE' THEN 'SELECT -1 AS sign, * FROM old_rows'
+        ELSE 'SELECT 1 AS sign, * FROM new_rows UNION ALL SELECT -1 AS sign, * FROM old_rows'
+    END;
+    LOCK TABLE inventory_management.demo_inventory_rollup IN SHARE ROW EXCLUSIVE MODE;
+    EXECUTE format($sql$
+        WITH delta AS (
+            SELECT
+                entity, branch, status, "Network Status",
+                SUM(sign)::INTEGER AS sku_count,
+                COALESCE(SUM(sign * "Inventory Balance"::NUMERIC), 0) AS inventory_value,
+                COALESCE(SUM(sign * "Sum of Quantity On Hand"::NUMERIC), 0) AS quantity_on_hand,
+                COALESCE(SUM(sign * (("Sum of Quantity On Hand" + COALESCE("Sum of TTM Qty Used", 0)) * COALESCE("_Average Cost", 0))::NUMERIC), 0) AS cogs
+            FROM (%s) changed
+            GROUP BY entity, branch, status, "Network Status"
+        ),
+        updated AS (
+            UPDATE inventory_management.demo_inventory_rollup rollup SET
+                sku_count = rollup.sku_count + delta.sku_count,
+                inventory_value = rollup.inventory_value + delta.inventory_value,
+                quantity_on_hand = rollup.quantity_on_hand + delta.quantity_on_hand,
+                cogs = rollup.cogs + delta.cogs
+            FROM delta
+            WHERE rollup.entity IS NOT DISTINCT FROM delta.entity AND rollup.branch IS NOT DISTINCT FROM delta.branch
+                AND rollup.status IS NOT DISTINCT FROM delta.status
+                AND rollup."Network Status" IS NOT DISTINCT FROM delta."Network Status"
+            RETURNING delta.entity, delta.branch, delta.status, delta."Network Status"
+        )
+        INSERT INTO inventory_management.demo_inventory_rollup
+        SELECT * FROM delta
+        WHERE NOT EXISTS (
+            SELECT 1 FROM updated
+            WHERE updated.entity IS NOT DISTINCT FROM delta.entity AND updated.branch IS NOT DISTINCT FROM delta.branch
+                AND updated.status IS NOT DISTINCT FROM delta.status
+                AND updated."Network Status" IS NOT DISTINCT FROM delta."Network Status"
+        )
+    $sql$, changed_rows);
+    -- Buckets without rows go, so COUNT(DISTINCT ...) over the rollup matches the table
+    DELETE FROM inventory_management.demo_inventory_rollup WHERE sku_count = 0;
+    RETURN NULL;
+END
+$$;
+
+-- Statement-level triggers: a bulk load (COPY, INSERT ... SELECT) updates the rollup once, from the
+-- rows it loaded. Transition tables need one trigger per event.
+DROP TRIGGER IF EXISTS demo_inventory_rollup_insert ON inventory_management.demo_inventory;
+CREATE TRIGGER demo_inventory_rollup_insert
+    AFTER INSERT ON inventory_management.demo_inventory
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_management.apply_demo_inventory_rollup_delta();
+
+DROP TRIGGER IF EXISTS demo_inventory_rollup_update ON inventory_management.demo_inventory;
+CREATE TRIGGER demo_inventory_rollup_update
+    AFTER UPDATE ON inventory_management.demo_inventory
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_management.apply_demo_inventory_rollup_delta();
+
+DROP TRIGGER IF EXISTS demo_inventory_rollup_delete ON inventory_management.demo_inventory;
+CREATE TRIGGER demo_inventory_rollup_delete
+    AFTER DELETE ON inventory_management.demo_inventory
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_management.apply_demo_inventory_rollup_delta();
+
+DROP TRIGGER IF EXISTS demo_inventory_rollup_truncate ON inventory_management.demo_inventory;
+CREATE TRIGGER demo_inventory_rollup_truncate
+    AFTER TRUNCATE ON inventory_management.demo_inventory
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_management.apply_demo_inventory_rollup_delta();
+
+-- The triggers hold their lock on demo_inventory until this migration commits, so no write slips
+-- in between the initial fill and the first delta
+SELECT inventory_management.rebuild_demo_inventory_rollup();
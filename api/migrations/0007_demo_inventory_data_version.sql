@@ -0,0 +1,24 @@
+-- A counter bumped by every statement that changes demo_inventory. The API re-reads it every few seconds
+-- (DATA_VERSION_CHECK_INTERVAL) and keeps results derived from the whole table, such as the entity/branch
+-- hierarchy, until it moves.
+CREATE TABLE IF NOT EXISTS inventory_management.demo_inventory_data_version (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    version BIGINT NOT NULL,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+INSERT INTO inventory_management.demo_inventory_data_version (version) VALUES (1)
+ON CONFLICT (singleton) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION inventory_management.bump_demo_inventory_data_version() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE inventory_management.demo_inventory_data_version SET version = version + 1, changed_at = now();
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS demo_inventory_data_version ON inventory_management.demo_inventory;
+CREATE TRIGGER demo_inventory_data_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON inventory_management.demo_inventory
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_management.bump_demo_inventory_data_version();
@@ -0,0 +1,75 @@
+-- The (entity, branch, partnbr) keys each statement on demo_inventory touched, under the data version
+-- (0007) it bumped. The API reads the keys changed since its snapshot's version and copies only those
+-- rows, instead of reloading the whole table; a TRUNCATE is logged as truncated and forces a full reload.
+-- The log keeps the last 10000 versions; changes_since is the version after which it is complete.
+ALTER TABLE inventory_management.demo_inventory_data_version ADD COLUMN IF NOT EXISTS changes_since BIGINT;
+UPDATE inventory_management.demo_inventory_data_version SET changes_since = version WHERE changes_since IS NULL;
+
+CREATE TABLE IF NOT EXISTS inventory_management.demo_inventory_changes (
+    version BIGINT NOT NULL,
+    truncated BOOLEAN NOT NULL DEFAULT FALSE,
+    entity TEXT,
+    branch TEXT,
+    partnbr TEXT
+);
+
+CREATE INDEX IF NOT EXISTS demo_inventory_changes_version_idx
+    ON inventory_management.demo_inventory_changes (version);
+
+-- Bumps the data version and logs the statement's keys (its transition tables) under the new version.
+-- The version row stays locked until commit, so versions commit in order.
+CREATE OR REPLACE FUNCTION inventory_management.record_demo_inventory_changes() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    next_version BIGINT;
+BEGIN
+    UPDATE inventory_management.demo_inventory_data_version SET version = version + 1, changed_at = now()
+    RETURNING version INTO next_version;
+    IF TG_OP = 'TRUNCATE' THEN
+        INSERT INTO inventory_management.demo_inventory_changes (version, truncated) VALUES (next_version, TRUE);
+    ELSE
+        EXECUTE format($sql$
+            INSERT INTO inventory_management.demo_inventory_changes (version, entity, branch, partnbr)
+            SELECT DISTINCT $1, entity, branch, partnbr FROM (%s) changed
+        $sql$, CASE TG_OP
+            WHEN 'INSERT' THEN 'SELECT entity, branch, partnbr FROM new_rows'
+            WHEN 'DELETE' THEN 'SELECT entity, branch, partnbr FROM old_rows'
+            ELSE 'SELECT entity, branch, partnbr FROM new_rows UNION ALL SELECT entity, branch, partnbr FROM old_rows'
+        END) USING next_version;
+    END IF;
+    -- Pruned every 100 versions, down to the last 10000
+    IF next_version % 100 = 0 AND next_version > 10000 THEN
+        DELETE FROM inventory_management.demo_inventory_changes WHERE version <= next_version - 10000;
+        UPDATE inventory_management.demo_inventory_data_version
+        SET changes_since = GREATEST(changes_since, next_version - 10000);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+-- Replaces the single bump trigger of 0007: transition tables need one trigger per event
+DROP TRIGGER IF EXISTS demo_inventory_data_version ON inventory_management.demo_inventory;
+DROP FUNCTION IF EXISTS inventory_management.bump_demo_inventory_data_version();
+
+DROP TRIGGER IF EXISTS demo_inventory_changes_insert ON inventory_management.demo_inventory;
+CREATE TRIGGER demo_inventory_changes_insert
+    AFTER INSERT ON inventory_management.demo_inventory
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_management.record_demo_inventory_changes();
+
+DROP TRIGGER IF EXISTS demo_inventory_changes_update ON inventory_management.demo_inventory;
+CREATE TRIGGER demo_inventory_changes_update
+    AFTER UPDATE ON inventory_management.demo_inventory
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_management.record_demo_inventory_changes();
+
+DROP TRIGGER IF EXISTS demo_inventory_changes_delete ON inventory_management.demo_inventory;
+CREATE TRIGGER demo_inventory_changes_delete
+    AFTER DELETE ON inventory_management.demo_inventory
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_management.record_demo_inventory_changes();
+
+DROP TRIGGER IF EXISTS demo_inventory_changes_truncate ON inventory_management.demo_inventory;
+CREATE TRIGGER demo_inventory_changes_truncate
+    AFTER TRUNCATE ON inventory_management.demo_inventory
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_management.record_demo_inventory_changes();
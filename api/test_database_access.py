@@ -0,0 +1,249 @@
+"""Pooled database access: prepared statements, coalesced requests, admission budgets, breaker and stale results"""
+import time
+import asyncio
+import threading
+import httpx
+import pytest
+import psycopg2
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from app import main
+
+def test_prepared_statement_survives_added_column(inventory_db):
+    """A cached statement whose result type changed is prepared again instead of failing the request"""
+    setup, _ = inventory_db
+    with setup.cursor() as cursor:
+        cursor.execute("CREATE TABLE inventory_management.prepared_probe (id INTEGER)")
+        cursor.execute("INSERT INTO inventory_management.prepared_probe VALUES (1)")
+    conn = main.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        main.execute_prepared(cursor, "SELECT * FROM inventory_management.prepared_probe WHERE id = %s", [1])
+        assert cursor.fetchall() == [(1,)]
+        conn.rollback()
+        with setup.cursor() as other:
+            other.execute("ALTER TABLE inventory_management.prepared_probe ADD COLUMN note TEXT DEFAULT 'added'")
+        replanned = main.prepared_statement_stats()["replanned"]
+        main.execute_prepared(cursor, "SELECT * FROM inventory_management.prepared_probe WHERE id = %s", [1])
+        assert cursor.fetchall() == [(1, 'added')]
+        assert main.prepared_statement_stats()["replanned"] == replanned + 1
+        assert not conn.discard_on_release
+        cursor.close()
+    finally:
+        main.release_db_connection(conn)
+        with setup.cursor() as cursor:
+            cursor.execute("DROP TABLE inventory_management.prepared_probe")
+
+def test_coalesced_waiters_get_private_copies():
+    """Identical concurrent calls run once; no caller's result is an object another caller holds"""
+    release = threading.Event()
+    calls = []
+
+    @main.coalesce_requests
+    def summary(entity):
+        calls.append(entity)
+        release.wait(5)
+        return {"entity": entity, "branches": ["A", "B"]}
+
+    results = {}
+    leader = threading.Thread(target=lambda: results.setdefault("leader", summary("ABC")))
+    leader.start()
+    while not main._inflight_calls:
+        time.sleep(0.001)
+    waiter = threading.Thread(target=lambda: results.setdefault("waiter", summary("ABC")))
+    waiter.start()
+    flight = next(iter(main._inflight_calls.values()))
+    while flight.waiters < 1:
+        time.sleep(0.001)
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+
+    assert calls == ["ABC"]
+    assert results["leader"] == results["waiter"] == {"entity": "ABC", "branches": ["A", "B"]}
+    assert results["leader"] is not results["waiter"]
+    assert results["leader"] is not flight.result and results["waiter"] is not flight.result
+    results["leader"]["branches"].append("rewritten")
+    assert results["waiter"]["branches"] == ["A", "B"]
+
+def test_joined_requests_take_queue_places():
+    """Requests joining an identical running one are bounded by the queue like queued requests"""
+    async def scenario():
+        budget = main.AdmissionBudget("heavy", limit=1, queue_size=2, queue_timeout=0.05)
+        assert await budget.acquire()
+        assert budget.join() and budget.join()
+        assert not budget.join()
+        assert not await budget.acquire()  # the queue is full of joined requests
+        budget.leave()
+        assert budget.join()
+        budget.leave()
+        budget.leave()
+        budget.release()
+        return budget.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["joinedWaiting"] == 0 and stats["running"] == 0
+    assert stats["joined"] == 3 and stats["rejected"] == 2
+
+class ConcurrencyProbe:
+    """Endpoint bodies that block until released and record how many ran at once"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = self.most_running = 0
+        self.started = []
+        self.release = {}
+
+    def run(self, name):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+            self.started.append(name)
+            release = self.release.setdefault(name, threading.Event())
+        release.wait(5)
+        with self.lock:
+            self.running -= 1
+        return {"name": name}
+
+async def _until(condition):
+    for _ in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+def test_admission_slots_bound_what_runs_at_once(monkeypatch):
+    """
+    Only requests to coalesced routes wait on an identical one without a slot, and one that finds it finished
+    takes a slot before querying; either way no more than the limit run at once
+    """
+    budget = main.AdmissionBudget("light", limit=1, queue_size=4, queue_timeout=5)
+    monkeypatch.setitem(main.admission_budgets, "light", budget)
+    probe = ConcurrencyProbe()
+    joiner_may_run = threading.Event()
+    app = FastAPI()
+    app.add_middleware(main.AdmissionControlMiddleware)
+
+    @app.get("/plain-probe")
+    def plain_probe(name: str):
+        return probe.run(name)
+
+    def gate(name: str):
+        if name == "a" and "a" in probe.started:  # the joiner, held back until the request it joined is over
+            joiner_may_run.wait(5)
+
+    @app.get("/coalesced-probe")
+    @main.coalesce_requests
+    def coalesced_probe(name: str, _=Depends(gate)):
+        return probe.run(name)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://probe") as client:
+            # An identical request to a route without coalescing queues for the slot
+            first = asyncio.create_task(client.get("/plain-probe", params={"name": "p"}))
+            await _until(lambda: probe.started == ["p"])
+            second = asyncio.create_task(client.get("/plain-probe", params={"name": "p"}))
+            await _until(lambda: len(budget._waiters) == 1)
+            probe.release["p"].set()
+            assert [(await first).status_code, (await second).status_code] == [200, 200]
+
+            # A joiner whose request finished first waits for the slot another request holds
+            probe.started.clear()
+            leader = asyncio.create_task(client.get("/coalesced-probe", params={"name": "a"}))
+            await _until(lambda: probe.started == ["a"])
+            joiner = asyncio.create_task(client.get("/coalesced-probe", params={"name": "a"}))
+            await _until(lambda: budget.joined == 1)
+            probe.release["a"].set()
+            assert (await leader).status_code == 200
+            other = asyncio.create_task(client.get("/coalesced-probe", params={"name": "b"}))
+            await _until(lambda: "b" in probe.started)
+            joiner_may_run.set()
+            await _until(lambda: len(budget._waiters) == 1)
+            assert probe.started == ["a", "b"]
+            probe.release["b"].set()
+            assert [(await joiner).status_code, (await other).status_code] == [200, 200]
+            assert probe.started == ["a", "b", "a"]
+
+    asyncio.run(scenario())
+    assert probe.most_running == 1
+    stats = budget.stats()
+    assert stats["running"] == 0 and stats["joinedWaiting"] == 0 and stats["joined"] == 1
+
+def test_breaker_opens_after_consecutive_failures_and_probes_once():
+    breaker = main.CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(main.DatabaseUnavailableError):
+        breaker.before_call()
+    time.sleep(0.06)
+    breaker.before_call()  # the probe
+    assert breaker.state == "half-open"
+    with pytest.raises(main.DatabaseUnavailableError):
+        breaker.before_call()
+    breaker.record_inconclusive()  # the probe never reached the database: another may try
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.consecutive_failures == 0
+
+class SaturatedPool:
+    def getconn(self):
+        raise main.PoolTimeoutError("Timed out waiting for a connection")
+
+def test_pool_timeouts_are_not_breaker_failures(monkeypatch):
+    """A saturated pool answers 503 busy without opening the breaker or marking the replica down"""
+    breaker = main.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    monkeypatch.setattr(main, "database_breaker", breaker)
+    monkeypatch.setattr(main.data_source_router, "pool_for", lambda read_only: SaturatedPool())
+    marked = []
+    monkeypatch.setattr(main.data_source_router, "mark_replica_unavailable", marked.append)
+    for _ in range(5):
+        with pytest.raises(main.DatabaseBusyError) as raised:
+            main.get_db_connection(read_only=True)
+        assert raised.value.status_code == 503 and "Retry-After" in raised.value.headers
+    assert breaker.state == "closed" and breaker.consecutive_failures == 0
+    assert marked == []
+
+def test_stale_results_are_served_during_an_outage():
+    outage = {"on": False}
+
+    @main.serve_stale_on_outage
+    def stale_probe_metrics(entity):
+        if outage["on"]:
+            try:
+                raise psycopg2.OperationalError("server closed the connection")
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+        return {"entity": entity, "total": 3}
+
+    assert stale_probe_metrics("ABC") == {"entity": "ABC", "total": 3}
+    outage["on"] = True
+    result = stale_probe_metrics("ABC")
+    assert result["stale"] is True and result["total"] == 3
+    with pytest.raises(HTTPException) as raised:
+        stale_probe_metrics("XYZ")  # nothing remembered for these arguments
+    assert raised.value.status_code == 503
+
+def test_etags_follow_the_response_freshness(monkeypatch):
+    """Fresh reads carry the data version ETag (and revalidate to 304); stale results served in an outage do not"""
+    monkeypatch.setattr(main, "get_data_version", lambda: 7)
+    monkeypatch.setattr(main, "inventory_snapshot", None)
+    outage = {"on": False}
+    probe = FastAPI()
+    probe.add_middleware(main.DataVersionETagMiddleware)
+
+    @probe.get("/metrics/etag-probe")
+    @main.serve_stale_on_outage
+    def etag_probe_metrics():
+        if outage["on"]:
+            raise HTTPException(status_code=503, detail="Database unavailable")
+        return {"total": 3}
+
+    with TestClient(probe) as client:
+        fresh = client.get("/metrics/etag-probe")
+        assert fresh.json() == {"total": 3} and fresh.headers["ETag"] == 'W/"d7.s0"'
+        assert client.get("/metrics/etag-probe", headers={"If-None-Match": 'W/"d7.s0"'}).status_code == 304
+        outage["on"] = True
+        stale = client.get("/metrics/etag-probe")
+        assert stale.json()["stale"] is True and "ETag" not in stale.headers
@@ -0,0 +1,303 @@
+"""The columnar inventory snapshot answers listings and counts as the database does"""
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+from psycopg2.extras import RealDictCursor
+from app import main
+from conftest import build_snapshot, require_migrations
+
+@pytest.fixture(scope="module")
+def database_snapshot(inventory_db, tmp_path_factory):
+    """A snapshot of the test database's demo_inventory, as the app builds it"""
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(main, "INVENTORY_SNAPSHOT_SOURCE", "database")
+        frame, data_version, _ = main._read_inventory_source()
+    return build_snapshot(tmp_path_factory.mktemp("database_snapshot") / "v000001", frame, "database", data_version)
+
+@pytest.fixture
+def db_cursor(inventory_db):
+    conn = main.get_db_connection(read_only=True)
+    try:
+        yield conn.cursor(cursor_factory=RealDictCursor)
+    finally:
+        conn.rollback()
+        main.release_db_connection(conn)
+
+def sample_filters(snapshot):
+    """Filters over the snapshot's own entities and branches, with and without search text"""
+    entities = snapshot.columns["entity"].values.tolist()
+    branches = snapshot.columns["branch"].values.tolist()
+    return [
+        main.InventoryFilter(),
+        main.InventoryFilter(status="excess"),
+        main.InventoryFilter(entities=entities[:1], exclude_corporate=True),
+        main.InventoryFilter(entities=entities[:2], branches=branches[:3], status="low"),
+        main.InventoryFilter(network_status="excess", status="overview"),
+        main.InventoryFilter(search="Carbon Sensor"),
+        main.InventoryFilter(entities=["no such entity"]),
+    ]
+
+def _page_keys(rows, sort_by):
+    """(sort value, entity, branch, partnbr) of each page row; coverage as the number it sorts by"""
+    keys = []
+    for row in rows:
+        key = row[main.SORT_FIELD_MAP[sort_by]]
+        if sort_by == "monthsOfCoverage":
+            key = row.get("months_of_coverage", key)
+            key = None if key is None else float(key)
+        keys.append((key, *(row[column] for column in main.KEYSET_TIEBREAKER)))
+    return keys
+
+@pytest.mark.parametrize("sort_dir", ["asc", "desc"])
+def test_listing_pages_match_the_database(database_snapshot, db_cursor, sort_dir):
+    """
+    Totals, OFFSET pages (ties in any order, so only their sort values) and keyset pages (fully ordered; the
+    database runs with C collation, the snapshot's code point order)
+    """
+    for inventory_filter in sample_filters(database_snapshot):
+        for sort_by in main.SORT_FIELD_MAP:
+            expected_totals, expected = main.fetch_inventory_page(
+                db_cursor, inventory_filter, main.INVENTORY_PAGE_TOTALS, sort_by, sort_dir, 50, 1000)
+            totals, rows = database_snapshot.inventory_page(
+                inventory_filter, main.INVENTORY_PAGE_TOTALS, sort_by, sort_dir, 50, 1000)
+            assert totals == pytest.approx(dict(expected_totals)), (inventory_filter, sort_by)
+            assert ([key for key, *_ in _page_keys(rows, sort_by)]
+                    == [key for key, *_ in _page_keys(expected, sort_by)]), (inventory_filter, sort_by)
+            after = None
+            for _ in range(2):
+                _, expected = main.fetch_inventory_page(db_cursor, inventory_filter, main.INVENTORY_PAGE_TOTALS,
+                                                        sort_by, sort_dir, 50, 0, after, keyset=True)
+                _, rows = database_snapshot.inventory_page(inventory_filter, main.INVENTORY_PAGE_TOTALS,
+                                                           sort_by, sort_dir, 50, 0, after, keyset=True)
+                assert _page_keys(rows, sort_by) == _page_keys(expected, sort_by), (inventory_filter, sort_by, after)
+                if not rows:
+                    break
+                _, after = main.decode_inventory_cursor(main.encode_inventory_cursor(sort_by, sort_dir, 50, rows[-1]),
+                                                        sort_by, sort_dir)
+
+FACET_TOTALS = {**main.FILTER_COUNT_TOTALS, "entity_count": "COUNT(DISTINCT entity)",
+                "branch_count": "COUNT(DISTINCT branch)"}
+
+def facet_filters(snapshot):
+    """Every combination of the key filters the bitmaps answer"""
+    branches = snapshot.columns["branch"].values.tolist()
+    return [main.InventoryFilter(entities=entities, branches=branch_list, status=status, network_status=network_status,
+                                 exclude_corporate=exclude_corporate)
+            for entities, branch_list, status, network_status, exclude_corporate in itertools.product(
+                [[], snapshot.columns["entity"].values.tolist()[:1], ["no such entity"]],
+                [[], branches[:1], ["Corporate"] + branches[:2]],
+                [None, "overview", "excess", "low", "dead"],
+                [None, "excess", "low"],
+                [False, True])]
+
+def test_filter_counts_match_the_database(database_snapshot, db_cursor):
+    """Bitmap popcounts and bucket sums report the same figures as the SQL totals"""
+    for inventory_filter in facet_filters(database_snapshot):
+        db_cursor.execute(*main.compile_inventory_totals(inventory_filter, FACET_TOTALS))
+        expected = dict(db_cursor.fetchone())
+        assert database_snapshot.filter_counts(inventory_filter, FACET_TOTALS) == pytest.approx(expected), inventory_filter
+
+def test_filter_counts_match_the_rows(inventory_snapshot, inventory_frame):
+    """The same figures counted directly over app/data.csv's rows, without a database"""
+    numbers = {name: pd.to_numeric(inventory_frame[name]) for name in
+               ("Inventory Balance", "Sum of Quantity On Hand", "Sum of TTM Qty Used", "_Average Cost")}
+    measures = {"items": pd.Series(1, index=inventory_frame.index), "value": numbers["Inventory Balance"].fillna(0),
+                "quantity": numbers["Sum of Quantity On Hand"].fillna(0),
+                "cogs": ((numbers["Sum of Quantity On Hand"] + numbers["Sum of TTM Qty Used"].fillna(0))
+                         * numbers["_Average Cost"].fillna(0)).fillna(0)}
+    for inventory_filter in facet_filters(inventory_snapshot):
+        rows = pd.Series(True, index=inventory_frame.index)
+        if inventory_filter.exclude_corporate:
+            rows &= inventory_frame["branch"].notna() & (inventory_frame["branch"] != "Corporate")
+        if inventory_filter.entities:
+            rows &= inventory_frame["entity"].isin(inventory_filter.entities)
+        if inventory_filter.branches:
+            rows &= inventory_frame["branch"].isin(inventory_filter.branches)
+        if inventory_filter.filters_status():
+            rows &= inventory_frame["status"] == inventory_filter.status
+        if inventory_filter.network_status:
+            rows &= inventory_frame["Network Status"] == inventory_filter.network_status
+        counts = inventory_snapshot.filter_counts(inventory_filter, [*main.FILTER_COUNT_TOTALS, "entity_count", "branch_count"])
+        assert counts["entity_count"] == inventory_frame["entity"][rows].nunique()
+        assert counts["branch_count"] == inventory_frame["branch"][rows].nunique()
+        if not rows.any():
+            assert counts["total_items"] == 0 and counts["total_value"] is None
+            continue
+        for status, prefix in (("total", "total"), ("excess", "excess"), ("low", "low_stock"), ("dead", "dead_stock")):
+            in_status = rows if status == "total" else rows & (inventory_frame["status"] == status)
+            assert counts[f"{prefix}_items"] == in_status.sum(), (inventory_filter, status)
+            for measure in ("value", "quantity", "cogs"):
+                assert counts[f"{status}_{measure}"] == pytest.approx(measures[measure][in_status].sum()), (
+                    inventory_filter, status, measure)
+
+SEARCH_TEXTS = ["carbon", "CARBON SENSOR", "Code-000", "branch 1", "manufacturer-0003", "or", "E", "r a", "no such part"]
+
+@pytest.mark.parametrize("search", SEARCH_TEXTS)
+def test_search_matches_what_ilike_matches(database_snapshot, db_cursor, search):
+    """The trigram index finds the rows ILIKE '%text%' finds, also for texts shorter than a trigram"""
+    for inventory_filter in (main.InventoryFilter(search=search), main.InventoryFilter(search=search, status="excess")):
+        db_cursor.execute(*main.compile_inventory_totals(inventory_filter, FACET_TOTALS))
+        expected = dict(db_cursor.fetchone())
+        assert database_snapshot.filter_counts(inventory_filter, FACET_TOTALS) == pytest.approx(expected), inventory_filter
+        db_cursor.execute(*main.compile_inventory_page(inventory_filter, "partNumber", "asc", 0, 0, keyset=True,
+                                                       select_list=", ".join(main.KEYSET_TIEBREAKER)))
+        _, rows = database_snapshot.inventory_page(inventory_filter, main.INVENTORY_PAGE_TOTALS, "partNumber", "asc", 0, 0,
+                                                   keyset=True)
+        assert _page_keys(rows, "partNumber") == _page_keys(db_cursor.fetchall(), "partNumber"), inventory_filter
+
+@pytest.mark.parametrize("sort_dir", ["asc", "desc"])
+def test_sort_permutations_follow_the_database_order(database_snapshot, db_cursor, sort_dir):
+    """Each stored permutation, read forwards or backwards, is the database's keyset order over all rows"""
+    keys = list(zip(*(database_snapshot.columns[name].decode(database_snapshot.columns[name].codes)
+                      for name in main.KEYSET_TIEBREAKER)))
+    everything = np.ones(database_snapshot.row_count, dtype=bool)
+    for sort_by in main.SORT_FIELD_MAP:
+        db_cursor.execute(*main.compile_inventory_page(main.InventoryFilter(), sort_by, sort_dir, 0, 0, keyset=True,
+                                                       select_list=", ".join(main.KEYSET_TIEBREAKER)))
+        expected = [tuple(row.values()) for row in db_cursor.fetchall()]
+        assert [keys[row] for row in database_snapshot._sorted(everything, sort_by, sort_dir)] == expected, sort_by
+
+@pytest.mark.parametrize("sort_dir", ["asc", "desc"])
+def test_sorted_walks_and_keyset_pages_agree_with_the_full_order(inventory_snapshot, monkeypatch, sort_dir):
+    """Walking the permutation in chunks finds the first rows of the full order; cursor pages cover it once"""
+    monkeypatch.setattr(main, "SORT_WALK_CHUNK", 64)
+    for inventory_filter in (main.InventoryFilter(), main.InventoryFilter(status="dead", network_status="low"),
+                             main.InventoryFilter(search="Carbon Sensor")):
+        mask = inventory_snapshot._row_mask(inventory_filter)
+        for sort_by in main.SORT_FIELD_MAP:
+            ordered = inventory_snapshot._sorted(mask, sort_by, sort_dir)
+            assert len(ordered) == mask.sum()
+            for count in (1, 100, 1000):
+                assert inventory_snapshot._sorted(mask, sort_by, sort_dir, count).tolist() == ordered[:count].tolist()
+            walked, after = [], None
+            while True:
+                _, rows = inventory_snapshot.inventory_page(inventory_filter, main.INVENTORY_PAGE_TOTALS, sort_by,
+                                                            sort_dir, 700, 0, after, keyset=True)
+                walked.extend(_page_keys(rows, sort_by))
+                if len(rows) < 700:
+                    break
+                _, after = main.decode_inventory_cursor(main.encode_inventory_cursor(sort_by, sort_dir, 0, rows[-1]),
+                                                        sort_by, sort_dir)
+            expected = _page_keys(inventory_snapshot._rows(ordered), sort_by)
+            assert [key[1:] for key in walked] == [key[1:] for key in expected], (inventory_filter, sort_by)
+
+class CountingMask(np.ndarray):
+    """A row mask that counts the rows looked up in it"""
+    looked_up = 0
+
+    def __getitem__(self, index):
+        if isinstance(index, np.ndarray):
+            CountingMask.looked_up += len(index)
+        return super().__getitem__(index)
+
+@pytest.mark.parametrize("sort_dir", ["asc", "desc"])
+def test_cursor_pages_examine_a_bounded_number_of_rows(inventory_snapshot, monkeypatch, sort_dir):
+    """A page after a cursor binary-searches its position and walks from there, whatever the rows before it"""
+    monkeypatch.setattr(main, "SORT_WALK_CHUNK", 64)
+    row_mask = inventory_snapshot._row_mask
+    monkeypatch.setattr(inventory_snapshot, "_row_mask",
+                        lambda inventory_filter: row_mask(inventory_filter).view(CountingMask))
+    after_rows = []
+    after = inventory_snapshot._after
+    monkeypatch.setattr(inventory_snapshot, "_after",
+                        lambda rows, *args: after_rows.append(len(rows)) or after(rows, *args))
+    everything = np.ones(inventory_snapshot.row_count, dtype=bool)
+    for sort_by in main.SORT_FIELD_MAP:
+        ordered = inventory_snapshot._sorted(everything, sort_by, sort_dir)
+        cursor_row = inventory_snapshot._rows(ordered[len(ordered) // 2:len(ordered) // 2 + 1])[0]
+        _, after_key = main.decode_inventory_cursor(main.encode_inventory_cursor(sort_by, sort_dir, 0, cursor_row),
+                                                    sort_by, sort_dir)
+        CountingMask.looked_up, after_rows[:] = 0, []
+        _, rows = inventory_snapshot.inventory_page(main.InventoryFilter(), main.INVENTORY_PAGE_TOTALS, sort_by, sort_dir,
+                                                    50, 0, after_key, keyset=True)
+        assert (_page_keys(rows, sort_by)
+                == _page_keys(inventory_snapshot._rows(ordered[len(ordered) // 2 + 1:len(ordered) // 2 + 51]), sort_by))
+        assert CountingMask.looked_up <= 64 and sum(after_rows) <= 20, sort_by
+
+def _all_rows(snapshot):
+    """Every row of a snapshot as a tuple, in a fixed order (row order within a build is not part of its contract)"""
+    rows = snapshot._rows(np.arange(snapshot.row_count))
+    return sorted((tuple(row.values()) for row in rows), key=repr)
+
+def assert_same_snapshot(built, expected):
+    assert built.row_count == expected.row_count
+    assert _all_rows(built) == _all_rows(expected)
+    assert built.overall_metrics() == pytest.approx(expected.overall_metrics())
+    assert built.entity_hierarchy() == expected.entity_hierarchy()
+    everything = np.ones(built.row_count, dtype=bool)
+    for sort_by in main.SORT_FIELD_MAP:
+        assert (_page_keys(built._rows(built._sorted(everything, sort_by, "asc")), sort_by)
+                == _page_keys(expected._rows(expected._sorted(everything, sort_by, "asc")), sort_by)), sort_by
+    for inventory_filter in facet_filters(expected):
+        assert built.filter_counts(inventory_filter, FACET_TOTALS) == pytest.approx(
+            expected.filter_counts(inventory_filter, FACET_TOTALS)), inventory_filter
+
+def test_delta_build_matches_a_full_build(inventory_snapshot, inventory_frame, tmp_path):
+    """Patching changed keys into the previous snapshot's rows builds what a full rebuild builds"""
+    changed_frame = inventory_frame.copy()
+    updated = changed_frame.index[changed_frame["branch"] == "Branch 2"][:40]
+    changed_frame.loc[updated, "Inventory Balance"] = "12345.5"
+    changed_frame.loc[updated, "status"] = "dead"
+    deleted = changed_frame.index[changed_frame["status"] == "low"][:25]
+    inserted = changed_frame.iloc[:30].copy()
+    inserted["partnbr"] = [f"DELTA-{n}" for n in range(len(inserted))]
+    inserted["branch"] = "Branch Delta"  # a value the previous snapshot does not know
+    changed_frame = pd.concat([changed_frame.drop(deleted), inserted], ignore_index=True)
+    keys = set()
+    for frame in (inventory_frame.loc[updated.union(deleted)], inserted):
+        keys.update(frame[main.KEYSET_TIEBREAKER].itertuples(index=False, name=None))
+
+    changed = changed_frame[[key in keys for key in changed_frame[main.KEYSET_TIEBREAKER].itertuples(index=False, name=None)]]
+    changed = changed.copy()
+    for name in main.SNAPSHOT_NUMERIC_COLUMNS:
+        changed[name] = pd.to_numeric(changed[name], errors="coerce")
+    for name in main.SNAPSHOT_DATETIME_COLUMNS:
+        changed[name] = pd.to_datetime(changed[name], errors="coerce", format="mixed")
+    delta_frame = pd.concat([inventory_snapshot.frame(without_keys=sorted(keys)), changed], ignore_index=True)
+
+    assert_same_snapshot(build_snapshot(tmp_path / "delta", delta_frame), build_snapshot(tmp_path / "full", changed_frame))
+
+def test_change_log_refresh_matches_a_full_read(inventory_db, tmp_path):
+    """Copying the keys the change log (0007, 0008) recorded since a snapshot gives the rows a full read gives"""
+    conn, applied = inventory_db
+    require_migrations(applied, "0007", "0008")
+    columns = ", ".join(f'"{column}"' for column in main.SNAPSHOT_STRING_COLUMNS + main.SNAPSHOT_NUMERIC_COLUMNS
+                        + main.SNAPSHOT_DATETIME_COLUMNS)
+    with conn.cursor() as cursor, pytest.MonkeyPatch.context() as patch:
+        patch.setattr(main, "INVENTORY_SNAPSHOT_SOURCE", "database")
+        try:
+            cursor.execute(f"""
+                INSERT INTO inventory_management.demo_inventory ({columns})
+                SELECT {columns.replace('"partnbr"', "'DELTA-' || n").replace('"branch"', "'Branch Delta'")}
+                FROM (SELECT * FROM inventory_management.demo_inventory LIMIT 1) source, generate_series(1, 3) n
+            """)
+            frame, data_version, _ = main._read_inventory_source()
+            base = build_snapshot(tmp_path / "base", frame, "database", data_version)
+            assert main._read_inventory_source(base) == (None, data_version, 0)
+
+            cursor.execute("""UPDATE inventory_management.demo_inventory SET description = description || ' (changed)'
+                              WHERE branch = 'Branch 2' AND status = 'low'""")
+            cursor.execute("""UPDATE inventory_management.demo_inventory SET "Inventory Balance" = 99, status = 'dead'
+                              WHERE partnbr = 'DELTA-1'""")
+            cursor.execute("DELETE FROM inventory_management.demo_inventory WHERE partnbr = 'DELTA-2'")
+            delta_frame, version, changed_keys = main._read_inventory_source(base)
+            full_frame, full_version, full_changed_keys = main._read_inventory_source()
+            assert version == full_version > data_version
+            assert changed_keys and full_changed_keys is None
+            assert_same_snapshot(build_snapshot(tmp_path / "delta", delta_frame, "database", version),
+                                 build_snapshot(tmp_path / "full", full_frame, "database", full_version))
+
+            # Once the log no longer covers the snapshot's version, the table is read in full
+            cursor.execute("SELECT changes_since FROM inventory_management.demo_inventory_data_version")
+            changes_since, = cursor.fetchone()
+            cursor.execute("UPDATE inventory_management.demo_inventory_data_version SET changes_since = version")
+            try:
+                assert main._read_inventory_source(base)[2] is None
+            finally:
+                cursor.execute("UPDATE inventory_management.demo_inventory_data_version SET changes_since = %s",
+                               (changes_since,))
+        finally:
+            cursor.execute("DELETE FROM inventory_management.demo_inventory WHERE partnbr LIKE 'DELTA-%'")
+            cursor.execute("""UPDATE inventory_management.demo_inventory SET description = left(description, -10)
+                              WHERE description LIKE '% (changed)'""")
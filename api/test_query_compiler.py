@@ -0,0 +1,173 @@
+"""Inventory filter, sort and totals compilation, and keyset cursors"""
+import datetime
+import pytest
+from fastapi import HTTPException
+from psycopg2.extras import RealDictCursor
+from app import main
+from conftest import require_migrations
+
+@pytest.fixture
+def base_schema(monkeypatch):
+    """Compile against the schema without migrations: per-column search, text coverage, no rollup"""
+    monkeypatch.setattr(main, "schema_features", {**main.schema_features, "searchDocument": False, "trigram": False,
+                                                  "numericCoverage": False, "rollup": False})
+    monkeypatch.setattr(main, "_schema_features_checked_at", float("inf"))
+
+def test_filter_params_follow_placeholders(base_schema):
+    inventory_filter = main.InventoryFilter(entities=["ABC", "DEF"], branches=["Branch 1"], status="excess",
+                                            network_status="low", search="valve", exclude_corporate=True)
+    where, params = main.compile_inventory_filter(inventory_filter)
+    assert where.startswith("WHERE branch != 'Corporate' AND entity IN (%s, %s) AND branch IN (%s)")
+    assert where.count("%s") == len(params)
+    assert params == ["ABC", "DEF", "Branch 1", "excess", "low"] + ["%valve%"] * len(main.SEARCH_COLUMNS)
+
+def test_overview_and_empty_filters_do_not_filter(base_schema):
+    assert main.compile_inventory_filter(main.InventoryFilter(status="overview")) == ("", [])
+
+def test_grouping_sets_flag_their_keys(base_schema):
+    query, params = main.compile_inventory_totals(main.InventoryFilter(entities=["ABC"]), {"skus": "COUNT(*)"},
+                                                  grouping_sets=[(), ("entity",), ("entity", "branch")])
+    assert "GROUP BY GROUPING SETS ((), (entity), (entity, branch))" in query
+    assert "GROUPING(entity) = 0 AS by_entity" in query and "GROUPING(branch) = 0 AS by_branch" in query
+    assert params == ["ABC"]
+
+def test_grouping_sets_totals_match_grouped_totals(base_schema, inventory_db):
+    """One GROUPING SETS scan reports what separate GROUP BY queries report"""
+    conn, _ = inventory_db
+    totals = {"skus": "COUNT(*)", "value": "SUM({value})"}
+    inventory_filter = main.InventoryFilter(status="excess")
+    with conn.cursor() as cursor:
+        cursor.execute(*main.compile_inventory_totals(inventory_filter, totals, grouping_sets=[(), ("branch",)]))
+        rows = cursor.fetchall()  # branch, by_branch, skus, value
+        cursor.execute(*main.compile_inventory_totals(inventory_filter, totals))
+        overall = cursor.fetchone()
+        cursor.execute(*main.compile_inventory_totals(inventory_filter, totals, group_by=("branch",)))
+        by_branch = {row[0]: row[1:] for row in cursor.fetchall()}
+    assert [row[2:] for row in rows if not row[1]] == [pytest.approx(overall)]
+    assert {row[0]: row[2:] for row in rows if row[1]} == {
+        branch: pytest.approx(figures) for branch, figures in by_branch.items()}
+
+CURSOR_ROW = {"Inventory Balance": 12.5, "mfgpartnbr": "CODE-1", "partnbr": "P-1", "description": "Valve",
+              "Sum of Quantity On Hand": 3.0, "Months of Coverage": "inf", "Sum of TTM Qty Used": None,
+              "entity": "ABC", "branch": "Branch 1", "Last Receipt": datetime.datetime(2024, 1, 2, 3, 4, 5),
+              "Network Status": "excess"}
+
+@pytest.mark.parametrize("sort_dir", ["asc", "desc"])
+@pytest.mark.parametrize("sort_by", list(main.SORT_FIELD_MAP))
+def test_cursor_round_trip(sort_by, sort_dir):
+    cursor = main.encode_inventory_cursor(sort_by, sort_dir, 40, CURSOR_ROW)
+    position, after = main.decode_inventory_cursor(cursor, sort_by, sort_dir)
+    key = CURSOR_ROW[main.SORT_FIELD_MAP[sort_by]]
+    if sort_by == "monthsOfCoverage":
+        key = float(key)
+    elif sort_by == "lastReceipt":
+        key = key.isoformat()
+    assert (position, after) == (40, [key, "ABC", "Branch 1", "P-1"])
+
+def test_cursor_is_bound_to_its_sort():
+    cursor = main.encode_inventory_cursor("description", "asc", 20, CURSOR_ROW)
+    assert main.decode_inventory_cursor("", "description", "asc") == (0, None)
+    for sort_by, sort_dir in (("description", "desc"), ("partNumber", "asc")):
+        with pytest.raises(HTTPException) as raised:
+            main.decode_inventory_cursor(cursor, sort_by, sort_dir)
+        assert raised.value.status_code == 400
+    for bad_cursor, sort_by in (("not a cursor", "description"), (cursor, main.RELEVANCE_SORT_FIELD)):
+        with pytest.raises(HTTPException) as raised:
+            main.decode_inventory_cursor(bad_cursor, sort_by, "asc")
+        assert raised.value.status_code == 400
+
+PAGE_SIZE = 500
+
+def _fetch(conn, query, params):
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+def _sort_value(sort_by, row):
+    """The value a row is sorted by (coverage as a number, as it is compared)"""
+    if sort_by == "monthsOfCoverage":
+        value = row.get("months_of_coverage", row["Months of Coverage"])
+        return None if value is None else float(value)
+    return row[main.SORT_FIELD_MAP[sort_by]]
+
+@pytest.mark.parametrize("inventory_filter", [main.InventoryFilter(),
+                                              main.InventoryFilter(status="excess", exclude_corporate=True)])
+def test_keyset_pages_follow_offset_order(inventory_db, inventory_filter):
+    """Walking cursors visits every row once, in the keyset ORDER BY, with the sort values OFFSET pages show"""
+    conn, _ = inventory_db
+    for sort_by in main.SORT_FIELD_MAP:
+        columns = list(dict.fromkeys(main.KEYSET_TIEBREAKER + [main.SORT_FIELD_MAP[sort_by]]))
+        if sort_by == "monthsOfCoverage" and main.numeric_coverage_available():
+            columns.append("months_of_coverage")
+        select_list = ", ".join(f'"{column}"' for column in columns)
+        for sort_dir in ("asc", "desc"):
+            ordered = _fetch(conn, *main.compile_inventory_page(inventory_filter, sort_by, sort_dir, 0, 0, keyset=True,
+                                                                select_list=select_list))
+            walked, after, position = [], None, 0
+            while True:
+                page = _fetch(conn, *main.compile_inventory_page(inventory_filter, sort_by, sort_dir, PAGE_SIZE, 0,
+                                                                 after, keyset=True, select_list=select_list))
+                walked.extend(page)
+                if len(page) < PAGE_SIZE:
+                    break
+                position += len(page)
+                cursor = main.encode_inventory_cursor(sort_by, sort_dir, position, page[-1])
+                position, after = main.decode_inventory_cursor(cursor, sort_by, sort_dir)
+            offset_paged = []
+            for offset in range(0, len(ordered), PAGE_SIZE):
+                offset_paged.extend(_fetch(conn, *main.compile_inventory_page(inventory_filter, sort_by, sort_dir,
+                                                                              PAGE_SIZE, offset, select_list=select_list)))
+            key = lambda row: tuple(row[column] for column in main.KEYSET_TIEBREAKER)
+            assert [key(row) for row in walked] == [key(row) for row in ordered], (sort_by, sort_dir)
+            assert len(set(map(key, walked))) == len(walked)
+            assert ([_sort_value(sort_by, row) for row in walked]
+                    == [_sort_value(sort_by, row) for row in offset_paged]), (sort_by, sort_dir)
+
+ROLLUP_CHECK_TOTALS = {**main.FILTER_COUNT_TOTALS, "entity_count": "COUNT(DISTINCT entity)",
+                       "branch_count": "COUNT(DISTINCT branch)"}
+
+def test_rollup_triggers_follow_row_changes(inventory_db, monkeypatch):
+    """After inserts, bucket-moving updates and deletes the rollup reports what aggregating the table reports"""
+    conn, applied = inventory_db
+    require_migrations(applied, "0006")
+    columns = ", ".join(f'"{column}"' for column in main.SNAPSHOT_STRING_COLUMNS + main.SNAPSHOT_NUMERIC_COLUMNS
+                        + main.SNAPSHOT_DATETIME_COLUMNS)
+    filters = [main.InventoryFilter(), main.InventoryFilter(status="excess"), main.InventoryFilter(status="dead"),
+               main.InventoryFilter(branches=["Branch 2", "Branch Delta"]), main.InventoryFilter(network_status="low"),
+               main.InventoryFilter(entities=["ABC"], branches=["Branch 3"], status="low")]
+    with conn.cursor() as cursor:
+        cursor.execute("BEGIN")  # rolled back below, so the rows are left as loaded
+        try:
+            cursor.execute(f"""
+                INSERT INTO inventory_management.demo_inventory ({columns})
+                SELECT {columns.replace('"partnbr"', "'DELTA-' || n").replace('"branch"', "'Branch Delta'")}
+                FROM (SELECT * FROM inventory_management.demo_inventory LIMIT 1) source, generate_series(1, 3) n
+            """)
+            # A new bucket, rows moving between buckets by status, branch and network status (some to NULL),
+            # and buckets emptied by moves and deletes
+            for statement in (
+                """UPDATE inventory_management.demo_inventory SET status = 'dead', "Inventory Balance" = 1.25
+                   WHERE partnbr = 'DELTA-1'""",
+                "UPDATE inventory_management.demo_inventory SET status = 'excess' WHERE branch = 'Branch 3' AND status = 'low'",
+                """UPDATE inventory_management.demo_inventory SET branch = 'Branch Delta', "Network Status" = NULL
+                   WHERE branch = 'Branch 2' AND status = 'optimal'""",
+                """UPDATE inventory_management.demo_inventory SET "Network Status" = 'low'
+                   WHERE "Network Status" IS NULL AND branch = 'Branch 4'""",
+                "DELETE FROM inventory_management.demo_inventory WHERE partnbr IN ('DELTA-2', 'DELTA-3')",
+                "DELETE FROM inventory_management.demo_inventory WHERE branch = 'Branch 5' AND status = 'dead'",
+            ):
+                cursor.execute(statement)
+                assert cursor.rowcount > 0, statement
+
+            cursor.execute("SELECT COUNT(*) FROM inventory_management.demo_inventory_rollup WHERE sku_count <= 0")
+            assert cursor.fetchone() == (0,)
+            for inventory_filter in filters:
+                assert main.inventory_aggregate_source(inventory_filter)[0] == main.INVENTORY_ROLLUP_TABLE
+                cursor.execute(*main.compile_inventory_totals(inventory_filter, ROLLUP_CHECK_TOTALS))
+                from_rollup = cursor.fetchone()
+                with monkeypatch.context() as patch:
+                    patch.setattr(main, "INVENTORY_METRICS_SOURCE", "table")
+                    cursor.execute(*main.compile_inventory_totals(inventory_filter, ROLLUP_CHECK_TOTALS))
+                assert from_rollup == pytest.approx(cursor.fetchone()), inventory_filter
+        finally:
+            cursor.execute("ROLLBACK")